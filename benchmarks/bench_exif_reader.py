@@ -0,0 +1,70 @@
+"""
+Compare the bounded header reader in photoorganiser.exif_reader with exifread
+for every RAW format in consts.RAW_FILE_EXTENSIONS found under a sample
+directory:
+
+    $ poetry run python benchmarks/bench_exif_reader.py ~/Pictures/samples
+"""
+
+import argparse
+import os
+import os.path as osp
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+from photoorganiser.consts import RAW_FILE_EXTENSIONS
+from photoorganiser.exif_reader import read_exif_tags
+from photoorganiser.metadata import _read_exifread_tags
+
+
+def _time_reader(reader: Callable, paths: List[str], repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for path in paths:
+            reader(path)
+    return (time.perf_counter() - start) / (repeat * len(paths))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("sample_dir")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    extensions = {ext.strip().lower() for ext in RAW_FILE_EXTENSIONS.values()}
+    samples: Dict[str, List[str]] = defaultdict(list)
+    for root, directory_names, file_names in os.walk(args.sample_dir):
+        for file_name in file_names:
+            ext = osp.splitext(file_name)[1][1:].lower()
+            if ext in extensions:
+                samples[ext].append(osp.join(root, file_name))
+
+    print(
+        f"{'format':<8}{'files':>7}{'exifread ms':>14}{'header ms':>12}"
+        f"{'speedup':>10}{'fallback':>10}{'mismatch':>10}"
+    )
+    for ext in sorted(samples):
+        paths = samples[ext]
+        exifread_time = _time_reader(_read_exifread_tags, paths, args.repeat)
+        header_time = _time_reader(read_exif_tags, paths, args.repeat)
+
+        fallback = mismatch = 0
+        for path in paths:
+            tags = read_exif_tags(path)
+            if tags is None:
+                fallback += 1
+                continue
+            reference = _read_exifread_tags(path)
+            if reference is not None and tags != reference:
+                mismatch += 1
+
+        print(
+            f"{ext:<8}{len(paths):>7}{exifread_time * 1000:>14.3f}"
+            f"{header_time * 1000:>12.3f}{exifread_time / header_time:>10.1f}"
+            f"{fallback:>10}{mismatch:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Time matching file names against the selected formats, as the scanner does
+for every directory listing, over a synthetic tree of a million names or the
+listings of a real directory tree:
+
+    $ poetry run python benchmarks/bench_extension_filter.py
+    $ poetry run python benchmarks/bench_extension_filter.py --tree ~/Pictures
+
+The regular expression the scanner used to build is timed for comparison.
+"""
+
+import argparse
+import os
+import re
+import time
+from typing import Callable, List
+
+from photoorganiser.consts import ALL_FORMATS, RAW_FILE_EXTENSIONS, format_suffixes
+from photoorganiser.file_scanner import _list_directory, _matching
+
+_FILES_PER_DIRECTORY = 500
+# Roughly what a card dump or exported library holds alongside the images.
+_SUFFIXES = (".CR3", ".cr2", ".NEF", ".JPG", ".jpeg", ".xmp", ".THM", ".MOV", "")
+_SELECTIONS = ((ALL_FORMATS,), ("jpg",), ("cr3", "nef", "raf"))
+
+
+def _synthetic_listings(names: int) -> List[List[str]]:
+    return [
+        [
+            f"IMG_{row:07d}{_SUFFIXES[row % len(_SUFFIXES)]}"
+            for row in range(start, min(start + _FILES_PER_DIRECTORY, names))
+        ]
+        for start in range(0, names, _FILES_PER_DIRECTORY)
+    ]
+
+
+def _tree_listings(root: str) -> List[List[str]]:
+    listings = []
+    directories = [root]
+    while len(directories):
+        directory = directories.pop()
+        snapshot = _list_directory(directory, 0)
+        if snapshot is None:
+            continue
+        directories.extend(os.path.join(directory, d) for d in snapshot.directory_names)
+        listings.append(snapshot.file_names)
+    return listings
+
+
+def _regex_filter(formats) -> Callable[[List[str]], List[str]]:
+    if ALL_FORMATS in formats:
+        formats = RAW_FILE_EXTENSIONS.values()
+    exts = "|".join([f"{ext.lower()}|{ext.upper()}" for ext in formats])
+    path_re = re.compile(f"^.*.({exts})$")
+    return lambda file_names: [name for name in file_names if path_re.match(name)]
+
+
+def _suffix_filter(formats) -> Callable[[List[str]], List[str]]:
+    suffixes = format_suffixes(formats)
+    return lambda file_names: _matching(file_names, suffixes)
+
+
+def _time(match: Callable[[List[str]], List[str]], listings: List[List[str]]):
+    start = time.perf_counter()
+    found = sum(len(match(file_names)) for file_names in listings)
+    return time.perf_counter() - start, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--names", type=int, default=1000000)
+    parser.add_argument("--tree")
+    args = parser.parse_args()
+
+    if args.tree:
+        listings = _tree_listings(args.tree)
+    else:
+        listings = _synthetic_listings(args.names)
+    names = sum(len(file_names) for file_names in listings)
+
+    print(f"{names} names{'regex ms':>24}{'suffix ms':>11}{'speedup':>9}{'found':>9}")
+    for formats in _SELECTIONS:
+        regex_time, regex_found = _time(_regex_filter(formats), listings)
+        suffix_time, found = _time(_suffix_filter(formats), listings)
+        # The regular expression also matched mixed case suffixes only in
+        # upper or lower case, and names ending in the extension without a dot.
+        print(
+            f"  {','.join(formats):<25}{regex_time * 1e3:>10.1f}"
+            f"{suffix_time * 1e3:>11.1f}{regex_time / suffix_time:>8.1f}x"
+            f"{found:>9}{'' if found == regex_found else f' (regex {regex_found})'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Compare the memory held by scan results as a list of FileModelRecords with the
+columnar RecordStore behind FileModel, for synthetic scans of 100k and 1M
+files, and time sorting, searching and planning destinations for the store:
+
+    $ poetry run python benchmarks/bench_file_model.py
+    $ poetry run python benchmarks/bench_file_model.py --rows 250000
+"""
+
+import argparse
+import gc
+import os.path as osp
+import time
+import tracemalloc
+from typing import Iterator, List
+
+from photoorganiser.dest_template import DestinationTemplate, plan_destinations
+from photoorganiser.file_model import FileModelRecord, RecordStore
+from photoorganiser.file_search import parse_query, search
+
+_FILES_PER_DIRECTORY = 500
+_CAMERAS = ("Canon_EOS_R5", "NIKON_Z_6", "X-T4")
+_EXTENSIONS = ("CR3", "NEF", "RAF", "JPG")
+_SEARCHES = (
+    "IMG_00123",
+    "ext:nef",
+    "camera:nikon date:2021-06",
+    "date:2021-03-01..2021-03-07",
+    "ext:cr3 camera:canon date:2021-06-12 IMG_0",
+)
+_TEMPLATES = (
+    "{year}/{month}/{day}/{camera}/{file_name}",
+    "{year}/{month:02}/{date}/{camera}_{lens}/{stem}_{seq:07}.{ext}",
+)
+
+
+def _records(rows: int) -> Iterator[FileModelRecord]:
+    # Laid out like a card dump: a few hundred files per source directory and
+    # destinations spread over dates and cameras.
+    for row in range(rows):
+        directory = osp.join(
+            "/media/card", "DCIM", f"{100 + row // _FILES_PER_DIRECTORY}CANON"
+        )
+        file_name = f"IMG_{row:07d}.{_EXTENSIONS[row % len(_EXTENSIONS)]}"
+        month, day = 1 + row // 100000 % 12, 1 + row // 5000 % 28
+        camera_model = _CAMERAS[row // 20000 % len(_CAMERAS)]
+        dest_path = osp.join("2021", str(month), str(day), camera_model, file_name)
+        yield FileModelRecord(
+            file_name,
+            osp.join(directory, file_name),
+            dest_path,
+            size=25000000,
+            camera_model=camera_model,
+            date_time_original=f"2021:{month:02d}:{day:02d} 12:00:{row % 60:02d}",
+        )
+
+
+def _measure(build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def _time_append(rows: int) -> float:
+    # Timed separately as tracemalloc slows allocation down considerably.
+    records = _build_list(rows)
+    start = time.perf_counter()
+    RecordStore().extend(records)
+    return (time.perf_counter() - start) / rows * 1e6
+
+
+def _build_list(rows: int) -> List[FileModelRecord]:
+    return list(_records(rows))
+
+
+def _build_store(rows: int) -> RecordStore:
+    store = RecordStore()
+    store.extend(_records(rows))
+    return store
+
+
+def _time_queries(rows: int):
+    store = _build_store(rows)
+    print(f"\n{rows} rows{'first ms':>42}{'again ms':>10}{'found':>9}")
+    for key in RecordStore.SORT_KEYS:
+        start = time.perf_counter()
+        store.sort_order(key)
+        print(f"  sort {key:<38}{(time.perf_counter() - start) * 1e3:>10.1f}")
+    for text in _SEARCHES:
+        times = []
+        for _ in range(2):
+            start = time.perf_counter()
+            found = search(store, parse_query(text))
+            times.append((time.perf_counter() - start) * 1e3)
+        print(f"  {text:<43}{times[0]:>10.1f}{times[1]:>10.1f}{len(found):>9}")
+    for template in _TEMPLATES:
+        start = time.perf_counter()
+        collisions = plan_destinations(store, DestinationTemplate(template))
+        elapsed = (time.perf_counter() - start) * 1e3
+        print(f"  plan {template[:38]:<38}{elapsed:>10.1f}{'':>10}{len(collisions):>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, action="append")
+    args = parser.parse_args()
+
+    print(f"{'rows':>9}{'list MB':>10}{'store MB':>10}{'ratio':>8}{'append us':>12}")
+    for rows in args.rows or [100000, 1000000]:
+        list_size = _measure(lambda: _build_list(rows))
+        store_size = _measure(lambda: _build_store(rows))
+        print(
+            f"{rows:>9}{list_size / 1e6:>10.1f}{store_size / 1e6:>10.1f}"
+            f"{list_size / store_size:>8.1f}{_time_append(rows):>12.2f}"
+        )
+    for rows in args.rows or [100000, 1000000]:
+        _time_queries(rows)
+
+
+if __name__ == "__main__":
+    main()
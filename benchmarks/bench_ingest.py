@@ -0,0 +1,352 @@
+"""
+Benchmark scanning and copying end to end on a synthetic tree of TIFF and JPEG
+files with valid EXIF, headless, and write the results as a JSON report that
+can be compared with an earlier one:
+
+    $ poetry run python benchmarks/bench_ingest.py -o before.json
+    $ poetry run python benchmarks/bench_ingest.py -o after.json --compare before.json
+    $ poetry run python benchmarks/bench_ingest.py --files 20000 --size 64K --pairs
+
+Reports scan files/s without and with the metadata cache, copy MB/s, peak RSS
+after each stage and the latency of the Qt event loop while scanning and
+copying, which is what the GUI would feel. The fixture is generated once per
+set of parameters and reused; files will mostly be in the page cache, so
+results reflect the code rather than the disk.
+"""
+
+import argparse
+import json
+import os
+import os.path as osp
+import platform
+import resource
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtCore import PYQT_VERSION_STR, QT_VERSION_STR, QEventLoop, QTimer
+from PyQt5.QtWidgets import QApplication
+
+from photoorganiser.dest_template import DestinationTemplate, plan_destinations
+from photoorganiser.file_copier import VERIFY_OFF, FileCopier
+from photoorganiser.file_model import RecordStore
+from photoorganiser.file_scanner import FileScanner
+
+_REPORT_VERSION = 1
+_FILES_PER_DIRECTORY = 250
+_CAMERAS = (b"Canon EOS R5", b"NIKON Z 6", b"ILCE-7M3")
+_LENSES = (b"RF24-105mm F4 L IS USM", b"NIKKOR Z 50mm f/1.8 S", b"FE 35mm F1.8")
+# Files are padded with repeats of one random block: cheap to write, and not
+# compressible by filesystems that try.
+_PADDING = os.urandom(1 << 20)
+_PROBE_INTERVAL_MS = 5
+
+
+def _parse_size(text: str) -> int:
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    if text[-1:].upper() in units:
+        return int(float(text[:-1]) * units[text[-1:].upper()])
+    return int(text)
+
+
+def _tiff(model: bytes, date_time: bytes, lens: bytes) -> bytes:
+    # Little endian TIFF header, IFD0 holding Model and the EXIF IFD pointer,
+    # then an EXIF IFD holding DateTimeOriginal and LensModel.
+    model, date_time, lens = model + b"\0", date_time + b"\0", lens + b"\0"
+    ifd0 = 8
+    exif_ifd = ifd0 + 2 + 2 * 12 + 4
+    data = exif_ifd + 2 + 2 * 12 + 4
+    return b"".join(
+        (
+            b"II",
+            struct.pack("<HI", 42, ifd0),
+            struct.pack("<H", 2),
+            struct.pack("<HHII", 0x0110, 2, len(model), data),
+            struct.pack("<HHII", 0x8769, 4, 1, exif_ifd),
+            struct.pack("<I", 0),
+            struct.pack("<H", 2),
+            struct.pack("<HHII", 0x9003, 2, len(date_time), data + len(model)),
+            struct.pack("<HHII", 0xA434, 2, len(lens), data + len(model) + 20),
+            struct.pack("<I", 0),
+            model,
+            date_time,
+            lens,
+        )
+    )
+
+
+def _jpeg(exif: bytes) -> bytes:
+    # SOI and an APP1 Exif segment; the padding stands in for the scan data.
+    return b"\xff\xd8\xff\xe1" + struct.pack(">H", 8 + len(exif)) + b"Exif\0\0" + exif
+
+
+def _write(path: str, header: bytes, size: int, trailer: bytes = b""):
+    with open(path, "wb") as f:
+        f.write(header)
+        remaining = size - len(header) - len(trailer)
+        while remaining > 0:
+            f.write(_PADDING[: min(remaining, len(_PADDING))])
+            remaining -= len(_PADDING)
+        f.write(trailer)
+
+
+def _make_fixture(root: str, parameters: Dict[str, Any]):
+    # Even shots are TIFFs and odd ones JPEGs, or both with pairs, spread over
+    # directories of a card dump's size, cameras and a year of dates.
+    manifest_path = osp.join(root, "fixture.json")
+    try:
+        with open(manifest_path) as f:
+            if json.load(f) == parameters:
+                return
+    except (OSError, ValueError):
+        pass
+
+    shutil.rmtree(root, ignore_errors=True)
+    for shot in range(parameters["files"]):
+        directory = osp.join(root, f"{shot // _FILES_PER_DIRECTORY:04d}")
+        if shot % _FILES_PER_DIRECTORY == 0:
+            os.makedirs(directory)
+        day = shot * 365 // parameters["files"]
+        date_time = (
+            f"2021:{day // 31 % 12 + 1:02d}:{day % 28 + 1:02d} 12:{shot % 60:02d}:00"
+        )
+        exif = _tiff(
+            _CAMERAS[shot % len(_CAMERAS)],
+            date_time.encode(),
+            _LENSES[shot % len(_LENSES)],
+        )
+        name = osp.join(directory, f"IMG_{shot:07d}")
+        if parameters["pairs"] or shot % 2 == 0:
+            _write(name + ".tif", exif, parameters["size"])
+        if parameters["pairs"] or shot % 2 == 1:
+            _write(name + ".jpg", _jpeg(exif), parameters["size"], b"\xff\xd9")
+
+    with open(manifest_path, "w") as f:
+        json.dump(parameters, f)
+
+
+class _LatencyProbe(object):
+    # Measures how late a short repeating timer fires on the GUI thread: any
+    # lateness is time the event loop spent unable to repaint or take input.
+    def __init__(self):
+        self._timer = QTimer(interval=_PROBE_INTERVAL_MS, timeout=self._tick)
+        self._last = 0.0
+        self._late_ms: List[float] = []
+
+    def start(self):
+        self._late_ms = []
+        self._last = time.perf_counter()
+        self._timer.start()
+
+    def _tick(self):
+        now = time.perf_counter()
+        self._late_ms.append(max(0.0, (now - self._last) * 1e3 - _PROBE_INTERVAL_MS))
+        self._last = now
+
+    def stop(self) -> Dict[str, float]:
+        self._timer.stop()
+        late = sorted(self._late_ms) or [0.0]
+        return dict(
+            latency_p50_ms=round(late[len(late) // 2], 2),
+            latency_p99_ms=round(late[min(len(late) - 1, len(late) * 99 // 100)], 2),
+            latency_max_ms=round(late[-1], 2),
+        )
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux but bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+
+
+def _run_until(start: Callable[[Callable[[], None]], None]):
+    # Runs the event loop until start's work calls the finished callback.
+    loop = QEventLoop()
+    start(loop.quit)
+    loop.exec_()
+
+
+def _scan(source: str, cache_dir: str, workers: int, probe: _LatencyProbe) -> Dict:
+    store = RecordStore()
+    errors = []
+
+    def start(finished: Callable[[], None]):
+        scanner.scan_complete.connect(finished)
+        scanner.scan(source, ["*"], workers, cache_dir, incremental=bool(cache_dir))
+
+    scanner = FileScanner(
+        scan_batch=store.extend, scan_error=lambda path: errors.append(path)
+    )
+    probe.start()
+    begin = time.perf_counter()
+    _run_until(start)
+    plan_destinations(store, DestinationTemplate())
+    elapsed = time.perf_counter() - begin
+    result = dict(
+        files=len(store),
+        errors=len(errors),
+        seconds=round(elapsed, 3),
+        files_per_second=round(len(store) / elapsed, 1),
+        **probe.stop(),
+        peak_rss_mb=_peak_rss_mb(),
+    )
+    scanner.shutdown()
+    result["store"] = store
+    return result
+
+
+def _copy(
+    store: RecordStore, dest: str, workers: int, verify: str, probe: _LatencyProbe
+) -> Dict:
+    remaining = set()
+    failed = []
+    total_bytes = sum(store.size(row) for row in range(len(store)))
+
+    def start(finished: Callable[[], None]):
+        def done(uid: str, *args):
+            remaining.discard(uid)
+            if not len(remaining):
+                finished()
+
+        def error(uid: str, error: int):
+            failed.append(error)
+            done(uid)
+
+        copier.copy_complete.connect(done)
+        copier.copy_skipped.connect(done)
+        copier.copy_error.connect(error)
+        for record in store.records():
+            remaining.add(
+                copier.copy_file(
+                    record.full_path, osp.join(dest, record.dest_path), record.group
+                )
+            )
+
+    copier = FileCopier(workers=workers, verify=verify)
+    probe.start()
+    begin = time.perf_counter()
+    _run_until(start)
+    elapsed = time.perf_counter() - begin
+    copier.shutdown()
+    return dict(
+        files=len(store),
+        errors=len(failed),
+        megabytes=round(total_bytes / 1e6, 1),
+        seconds=round(elapsed, 3),
+        megabytes_per_second=round(total_bytes / 1e6 / elapsed, 1),
+        **probe.stop(),
+        peak_rss_mb=_peak_rss_mb(),
+    )
+
+
+def _environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=osp.dirname(osp.abspath(__file__)),
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return dict(
+        commit=commit,
+        python=platform.python_version(),
+        qt=QT_VERSION_STR,
+        pyqt=PYQT_VERSION_STR,
+        platform=platform.platform(),
+        cpus=os.cpu_count(),
+    )
+
+
+def _compare(previous: Dict, report: Dict):
+    if previous.get("parameters") != report["parameters"]:
+        print("warning: the reports were made with different parameters")
+    print(f"{'':<32}{'before':>10}{'after':>10}{'change':>9}")
+    for stage, results in report["results"].items():
+        for metric, value in results.items():
+            before = previous.get("results", {}).get(stage, {}).get(metric)
+            if not isinstance(before, (int, float)) or metric in ("files", "errors"):
+                continue
+            change = f"{(value - before) / before * 100:+.0f}%" if before else ""
+            print(f"{stage + ' ' + metric:<32}{before:>10}{value:>10}{change:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=1000, help="shots to generate")
+    parser.add_argument("--size", default="256K", help="size of each file")
+    parser.add_argument(
+        "--pairs", action="store_true", help="write each shot as TIFF and JPEG"
+    )
+    parser.add_argument("--scan-workers", type=int, default=0)
+    parser.add_argument("--copy-workers", type=int, default=0)
+    parser.add_argument("--verify", default=VERIFY_OFF)
+    parser.add_argument(
+        "--work-dir",
+        default=osp.join(tempfile.gettempdir(), "photoorganiser-bench"),
+        help="where the fixture, cache and copies are kept",
+    )
+    parser.add_argument("-o", "--output", help="write the JSON report here")
+    parser.add_argument("--compare", help="an earlier report to compare with")
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv[:1])
+    parameters = dict(files=args.files, size=_parse_size(args.size), pairs=args.pairs)
+    source = osp.join(args.work_dir, "source")
+    cache_dir = osp.join(args.work_dir, "cache")
+    dest = osp.join(args.work_dir, "dest")
+
+    begin = time.perf_counter()
+    _make_fixture(source, parameters)
+    print(f"fixture ready in {time.perf_counter() - begin:.1f} s", file=sys.stderr)
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    shutil.rmtree(dest, ignore_errors=True)
+    os.makedirs(cache_dir)
+    probe = _LatencyProbe()
+    results = {}
+    scan = _scan(source, "", args.scan_workers, probe)
+    store = scan.pop("store")
+    results["scan"] = scan
+    # The first cached scan fills the cache; the second is measured.
+    _scan(source, cache_dir, args.scan_workers, probe)
+    results["scan_cached"] = _scan(source, cache_dir, args.scan_workers, probe)
+    results["scan_cached"].pop("store")
+    results["copy"] = _copy(store, dest, args.copy_workers, args.verify, probe)
+    shutil.rmtree(dest, ignore_errors=True)
+    app.quit()
+
+    report = dict(
+        version=_REPORT_VERSION,
+        created=datetime.now().isoformat(timespec="seconds"),
+        environment=_environment(),
+        parameters=dict(
+            parameters,
+            scan_workers=args.scan_workers,
+            copy_workers=args.copy_workers,
+            verify=args.verify,
+        ),
+        results=results,
+    )
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            _compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Time how long the GUI takes to show its window, over fresh interpreters, and
+write the results as a JSON report that can be compared with an earlier one:
+
+    $ poetry run python benchmarks/bench_startup.py -o before.json
+    $ poetry run python benchmarks/bench_startup.py -o after.json --compare before.json
+    $ QT_QPA_PLATFORM=xcb poetry run python benchmarks/bench_startup.py --imports 20
+
+Each run launches Python as python -m photoorganiser would and reports the
+time from process start to the first events after showing the window, split
+into interpreter start, imports, application and settings set up, building
+the window and showing it. Runs use default settings in a temporary config
+directory, and the offscreen platform unless QT_QPA_PLATFORM is set. With
+--imports, the slowest imports of one more run are listed.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+_REPORT_VERSION = 1
+
+# Mirrors the GUI branch of photoorganiser.__main__, quitting once the first
+# events after show() have been processed.
+_CHILD = """
+import time
+start = time.perf_counter()
+import sys
+from photoorganiser.utils import configure_application
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QApplication
+from photoorganiser.main_window import PhotoOrganiser
+from photoorganiser.settings import Settings
+imported = time.perf_counter()
+a = QApplication(sys.argv[:1])
+configure_application(a)
+a.setApplicationDisplayName(a.applicationName())
+Settings().read("metrics")
+configured = time.perf_counter()
+p = PhotoOrganiser()
+built = time.perf_counter()
+p.show()
+def shown():
+    print(start, imported, configured, built, time.perf_counter(), flush=True)
+    a.quit()
+QTimer.singleShot(0, shown)
+a.exec()
+"""
+
+_PHASES = ("interpreter", "imports", "application", "window", "show", "total")
+
+
+def _environment(config_dir: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    # Where QStandardPaths looks for the settings file on Linux.
+    env["XDG_CONFIG_HOME"] = config_dir
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(
+        p for p in (root, env.get("PYTHONPATH", "")) if len(p)
+    )
+    return env
+
+
+def _run(env: Dict[str, str]) -> Dict[str, float]:
+    # Child times are on the same perf_counter clock as the parent's.
+    launched = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", _CHILD],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        check=True,
+        text=True,
+    ).stdout
+    start, imported, configured, built, shown = map(float, output.split())
+    return dict(
+        interpreter=start - launched,
+        imports=imported - start,
+        application=configured - imported,
+        window=built - configured,
+        show=shown - built,
+        total=shown - launched,
+    )
+
+
+def _slowest_imports(env: Dict[str, str], count: int) -> List[List]:
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _CHILD],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        check=True,
+        text=True,
+    ).stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if cumulative.strip().isdigit():
+            imports.append([name.strip(), int(cumulative) / 1e6])
+    return sorted(imports, key=lambda i: -i[1])[:count]
+
+
+def _compare(previous: Dict, report: Dict):
+    print(f"{'':<24}{'before':>10}{'after':>10}{'change':>9}")
+    for phase, seconds in report["results"].items():
+        before = previous.get("results", {}).get(phase)
+        if not isinstance(before, (int, float)):
+            continue
+        change = f"{(seconds - before) / before * 100:+.0f}%" if before else ""
+        print(
+            f"{phase + ' ms':<24}{before * 1e3:>10.1f}{seconds * 1e3:>10.1f}{change:>9}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument(
+        "--imports", type=int, default=0, help="list this many slowest imports"
+    )
+    parser.add_argument("-o", "--output", help="write the JSON report here")
+    parser.add_argument("--compare", help="an earlier report to compare with")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        env = _environment(config_dir)
+        # The first run writes the settings file and warms the disk cache.
+        _run(env)
+        runs = [_run(env) for _ in range(args.runs)]
+        imports = _slowest_imports(env, args.imports) if args.imports else []
+
+    # Medians, as a run now and then is slowed by something else.
+    results = {
+        phase: round(statistics.median(run[phase] for run in runs), 4)
+        for phase in _PHASES
+    }
+    report = dict(
+        version=_REPORT_VERSION,
+        python=sys.version.split()[0],
+        platform=env["QT_QPA_PLATFORM"],
+        runs=args.runs,
+        results=results,
+        slowest_imports=imports,
+    )
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            _compare(json.load(f), report)
+    else:
+        for phase, seconds in results.items():
+            print(f"{phase + ' ms':<24}{seconds * 1e3:>10.1f}")
+    for name, seconds in imports:
+        print(f"  {name:<40}{seconds * 1e3:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+import argparse
+import json
+import os.path as osp
+import signal
+import sys
+from typing import Dict, List, Union
+
+from PyQt5.QtCore import QCoreApplication, QObject, QTimer, pyqtSlot
+
+from photoorganiser.consts import ALL_FORMATS
+from photoorganiser.copy_journal import CopyJournal
+from photoorganiser.dest_template import (
+    DestinationTemplate,
+    TemplateError,
+    plan_destinations,
+)
+from photoorganiser.file_copier import (
+    FileCopier,
+    VERIFY_OFF,
+    VERIFY_CHECKSUM,
+    VERIFY_REREAD,
+)
+from photoorganiser.file_model import FileModelRecord, RecordStore
+from photoorganiser.file_scanner import FileScanner
+from photoorganiser.library_index import LibraryIndex
+from photoorganiser.metrics import metrics
+from photoorganiser.progress_aggregator import ProgressAggregator
+from photoorganiser.settings import Settings
+from photoorganiser.utils import configure_application
+
+EXIT_OK = 0
+EXIT_FILE_ERRORS = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+
+def _emit(event: str, flush: bool = False, **fields):
+    fields["event"] = event
+    sys.stdout.write(json.dumps(fields) + "\n")
+    if flush:
+        sys.stdout.flush()
+
+
+class _CliRunner(QObject):
+    def __init__(self, args: argparse.Namespace, parent=None, **kwargs):
+        super().__init__(parent, **kwargs)
+
+        self._args = args
+        self._exit_code = EXIT_OK
+        self._records = RecordStore()
+        self._copy_dict: Dict[str, FileModelRecord] = {}
+        self._file_copier: Union[FileCopier, None] = None
+        self._library_index: Union[LibraryIndex, None] = None
+        self._copy_journal: Union[CopyJournal, None] = None
+        self._template: Union[DestinationTemplate, None] = None
+        self._formats: List[str] = []
+        self._interrupted = False
+        self._copy_failed = False
+
+        self._file_scanner = FileScanner(
+            self,
+            scan_batch=self.scan_batch,
+            scan_progress=self.scan_progress,
+            scan_error=self.scan_error,
+            scan_complete=self.scan_complete,
+            scan_cancelled=self.scan_cancelled,
+        )
+
+    def start(self):
+        args = self._args
+        if args.command == "resume":
+            self._start_copy()
+            return
+
+        settings = Settings()
+        profile = dict(
+            formats=[ALL_FORMATS],
+            workers=settings.read("scan")["workers"],
+            cache=settings.read("cache")["enabled"],
+            incremental=False,
+            template=settings.read("dest")["template"],
+        )
+        if args.scan_profile is not None:
+            saved = settings.scan_profile(args.scan_profile)
+            if saved is None:
+                _emit(
+                    "usage_error",
+                    flush=True,
+                    message=f"There is no scan profile {args.scan_profile}",
+                )
+                self._exit_code = EXIT_USAGE
+                self._finish()
+                return
+            # Watching only applies to the GUI.
+            saved.pop("watch", None)
+            profile.update(saved)
+        # Options given on the command line override the profile.
+        if args.format:
+            profile["formats"] = args.format
+        if args.workers is not None:
+            profile["workers"] = args.workers
+        if args.no_cache:
+            profile["cache"] = False
+        if args.incremental:
+            profile["incremental"] = True
+        if args.template is not None:
+            profile["template"] = args.template
+
+        template = profile["template"]
+        cache_dir = settings.config_dir if profile["cache"] else ""
+        try:
+            self._template = DestinationTemplate(template)
+        except TemplateError as e:
+            _emit("usage_error", flush=True, message=f"{template}: {e}")
+            self._exit_code = EXIT_USAGE
+            self._finish()
+            return
+
+        if args.save_scan_profile is not None:
+            settings.save_scan_profile(args.save_scan_profile, profile)
+
+        self._formats = profile["formats"]
+        self._file_scanner.scan(
+            args.source,
+            self._formats,
+            profile["workers"],
+            cache_dir,
+            settings.read("cache")["max_entries"],
+            profile["incremental"],
+            False,
+            template,
+        )
+
+    def interrupt(self):
+        self._interrupted = True
+        self._exit_code = EXIT_INTERRUPTED
+        self._file_scanner.cancel()
+        if self._file_copier is not None:
+            self._file_copier.cancel_all()
+
+    def shutdown(self):
+        self._file_scanner.shutdown()
+        if self._file_copier is not None:
+            self._file_copier.shutdown()
+
+    def _finish(self):
+        if self._library_index is not None:
+            self._library_index.close()
+        if self._copy_journal is not None:
+            # Kept after copy errors or an interruption so the copy can be
+            # resumed.
+            if not self._interrupted and not self._copy_failed:
+                self._copy_journal.finish()
+            self._copy_journal.close()
+        _emit("finished", flush=True, exit_code=self._exit_code)
+        QCoreApplication.exit(self._exit_code)
+
+    @pyqtSlot(list)
+    def scan_batch(self, records: List[FileModelRecord]):
+        # Destinations are only final once the whole scan has been planned.
+        self._records.extend(records)
+
+    @pyqtSlot(int, int)
+    def scan_progress(self, scanned: int, found: int):
+        _emit("scan_progress", flush=True, scanned=scanned, found=found)
+
+    @pyqtSlot(str)
+    def scan_error(self, path: str):
+        _emit("scan_error", path=path)
+        if not self._interrupted:
+            self._exit_code = EXIT_FILE_ERRORS
+
+    @pyqtSlot(int)
+    def scan_complete(self, found: int):
+        _emit("scan_complete", flush=True, found=found)
+        Settings().record_source(osp.abspath(self._args.source), self._formats, found)
+        records = self._records
+        collisions = plan_destinations(records, self._template)
+        if self._args.command == "scan":
+            for row in range(len(records)):
+                _emit(
+                    "file",
+                    source=records.full_path(row),
+                    dest=records.dest_path(row),
+                    size=records.size(row),
+                )
+        for dest, rows in collisions.items():
+            _emit(
+                "dest_collision",
+                dest=dest,
+                sources=[records.full_path(row) for row in rows],
+            )
+
+        if len(collisions):
+            # Copying would overwrite files with others of the same name.
+            self._exit_code = EXIT_FILE_ERRORS
+        if self._args.command == "scan" or len(collisions):
+            self._finish()
+        else:
+            self._start_copy()
+
+    @pyqtSlot()
+    def scan_cancelled(self):
+        self._finish()
+
+    def _start_copy(self):
+        args = self._args
+        copy_settings = dict(Settings().read("copy"))
+        if args.copy_workers is not None:
+            copy_settings["workers"] = args.copy_workers
+        if args.verify is not None:
+            copy_settings["verify"] = args.verify
+        if args.sync:
+            copy_settings["sync"] = True
+
+        self._progress_aggregator = ProgressAggregator(
+            self,
+            rate_hz=args.progress_rate,
+            progress_updated=self.copy_progress_updated,
+        )
+        self._file_copier = FileCopier(
+            self,
+            workers=copy_settings["workers"],
+            per_source_device=copy_settings["per_source_device"],
+            per_dest_device=copy_settings["per_dest_device"],
+            progress_rate=args.progress_rate,
+            verify=copy_settings["verify"],
+            sync=copy_settings["sync"],
+            move=args.move,
+            copy_complete=self.copy_complete,
+            copy_error=self.copy_error,
+            copy_cancelled=self.copy_cancelled,
+            copy_progress=self._progress_aggregator.file_progress,
+            copy_resumed=self._progress_aggregator.file_resumed,
+            copy_skipped=self.copy_skipped,
+        )
+        if args.skip_duplicates:
+            self._library_index = LibraryIndex(Settings().config_dir, args.dest)
+            self._file_copier.set_library_index(self._library_index)
+
+        self._copy_journal = CopyJournal(Settings().config_dir, args.dest)
+        self._file_copier.set_journal(self._copy_journal)
+        if args.command == "resume":
+            records = [
+                FileModelRecord(
+                    osp.basename(entry.dest_path),
+                    entry.source_path,
+                    osp.relpath(entry.dest_path, args.dest),
+                    size=entry.size,
+                )
+                for entry in self._copy_journal.unfinished()
+            ]
+        else:
+            self._copy_journal.begin(
+                (r.full_path, osp.join(args.dest, r.dest_path), r.size)
+                for r in self._records.records()
+            )
+            records = self._records.records()
+
+        bytes_total: int = 0
+        for record in records:
+            uid = self._file_copier.copy_file(
+                record.full_path, osp.join(args.dest, record.dest_path), record.group
+            )
+            self._copy_dict[uid] = record
+            bytes_total += record.size
+        self._records.clear()
+
+        _emit("copy_started", flush=True, files=len(self._copy_dict), bytes=bytes_total)
+        if not len(self._copy_dict):
+            self._finish()
+            return
+        self._progress_aggregator.start(bytes_total)
+
+    def _copy_finished(self, uid: str):
+        self._copy_dict.pop(uid)
+        if not len(self._copy_dict):
+            self._progress_aggregator.stop()
+            self._finish()
+
+    @pyqtSlot("qint64", "qint64", float, float)
+    def copy_progress_updated(
+        self,
+        bytes_done: int,
+        bytes_total: int,
+        bytes_per_second: float,
+        eta_seconds: float,
+    ):
+        _emit(
+            "copy_progress",
+            flush=True,
+            bytes_done=bytes_done,
+            bytes_total=bytes_total,
+            bytes_per_second=round(bytes_per_second),
+            eta_seconds=round(eta_seconds, 1),
+            files_remaining=len(self._copy_dict),
+        )
+
+    @pyqtSlot(str)
+    def copy_complete(self, uid: str):
+        record = self._copy_dict[uid]
+        self._progress_aggregator.file_finished(uid)
+        _emit(
+            "moved" if self._args.move else "copied",
+            source=record.full_path,
+            dest=record.dest_path,
+        )
+        self._copy_finished(uid)
+
+    @pyqtSlot(str, str)
+    def copy_skipped(self, uid: str, existing_path: str):
+        record = self._copy_dict[uid]
+        self._progress_aggregator.file_skipped(uid, record.size)
+        _emit("skipped", source=record.full_path, existing=existing_path)
+        self._copy_finished(uid)
+
+    @pyqtSlot(str, int)
+    def copy_error(self, uid: str, error: int):
+        record = self._copy_dict[uid]
+        self._progress_aggregator.file_abandoned(uid)
+        _emit("copy_error", source=record.full_path, error=error)
+        self._copy_failed = True
+        if not self._interrupted:
+            self._exit_code = EXIT_FILE_ERRORS
+        self._copy_finished(uid)
+
+    @pyqtSlot(str)
+    def copy_cancelled(self, uid: str):
+        self._progress_aggregator.file_abandoned(uid)
+        self._copy_finished(uid)
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m photoorganiser",
+        description="Scan and copy photos without the GUI, reporting progress "
+        "as JSON lines on stdout.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scan = commands.add_parser("scan", help="list files and their destinations")
+    copy = commands.add_parser("copy", help="scan and copy files to DEST")
+    resume = commands.add_parser(
+        "resume", help="finish an interrupted copy to DEST, without rescanning"
+    )
+
+    for command in (scan, copy):
+        command.add_argument("source")
+        command.add_argument(
+            "-f",
+            "--format",
+            action="append",
+            help="file extension to include, may be repeated (default: all)",
+        )
+        command.add_argument("--workers", type=int, default=None)
+        command.add_argument("--no-cache", action="store_true")
+        command.add_argument("--incremental", action="store_true")
+        command.add_argument(
+            "--template",
+            default=None,
+            help="destination layout, e.g. '{year}/{month:02}/{camera}/{file_name}'",
+        )
+        command.add_argument(
+            "--scan-profile",
+            metavar="NAME",
+            help="use the file types, scan options and layout saved as NAME, "
+            "as overridden by any given here",
+        )
+        command.add_argument(
+            "--save-scan-profile",
+            metavar="NAME",
+            help="save the file types, scan options and layout used as NAME",
+        )
+
+    for command in (scan, copy, resume):
+        command.add_argument(
+            "--metrics",
+            metavar="PATH",
+            help="write stage timings to PATH on exit, as Prometheus text if it "
+            "ends in .prom, otherwise JSON",
+        )
+        command.add_argument(
+            "--profile", metavar="PATH", help="write a cProfile profile to PATH"
+        )
+
+    for command in (copy, resume):
+        command.add_argument("dest")
+        command.add_argument("--copy-workers", type=int, default=None)
+        command.add_argument("--skip-duplicates", action="store_true")
+        command.add_argument(
+            "--progress-rate", type=int, default=1, help="updates/second"
+        )
+        command.add_argument(
+            "--verify",
+            choices=(VERIFY_OFF, VERIFY_CHECKSUM, VERIFY_REREAD),
+            default=None,
+            help="checksum files as they are copied, and optionally re-read them",
+        )
+        command.add_argument(
+            "--sync",
+            action="store_true",
+            help="flush files to disk before reporting",
+        )
+        command.add_argument(
+            "--move",
+            action="store_true",
+            help="remove each source file once it is safely in DEST",
+        )
+
+    return parser
+
+
+def main(argv: List[str]) -> int:
+    args = _parser().parse_args(argv)
+    if args.command != "resume" and not osp.isdir(args.source):
+        _emit("usage_error", flush=True, message=f"{args.source} is not a directory")
+        return EXIT_USAGE
+
+    if args.metrics is not None or args.profile is not None:
+        metrics.enable(profile=args.profile is not None)
+
+    a = QCoreApplication(sys.argv[:1])
+    configure_application(a)
+
+    runner = _CliRunner(args)
+    signal.signal(signal.SIGINT, lambda *_: runner.interrupt())
+    signal.signal(signal.SIGTERM, lambda *_: runner.interrupt())
+    # Give the interpreter a chance to run signal handlers while Qt's event
+    # loop is blocking.
+    interrupt_timer = QTimer(interval=200, timeout=lambda: None)
+    interrupt_timer.start()
+
+    QTimer.singleShot(0, runner.start)
+    exit_code = a.exec()
+    runner.shutdown()
+
+    if args.metrics is not None:
+        metrics.write(args.metrics)
+    if args.profile is not None:
+        metrics.write_profile(args.profile)
+    return exit_code
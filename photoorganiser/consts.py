@@ -1,4 +1,19 @@
 from collections import OrderedDict
+from typing import FrozenSet, Iterable
+
+# Verification modes of FileCopier. Both hash the data as it is copied, so the
+# source is read only once. checksum compares that with a hash of the written
+# file before it is renamed into place; reread instead compares it with the
+# file read back from the device once synced.
+VERIFY_OFF = "off"
+VERIFY_CHECKSUM = "checksum"
+VERIFY_REREAD = "reread"
+
+# The layout files have always been copied into, see DestinationTemplate.
+DEFAULT_TEMPLATE = "{year}/{month}/{day}/{camera}/{file_name}"
+
+# Selects every format in RAW_FILE_EXTENSIONS.
+ALL_FORMATS = "*"
 
 RAW_FILE_EXTENSIONS = OrderedDict(
     {
@@ -30,7 +45,7 @@ RAW_FILE_EXTENSIONS = OrderedDict(
         "Nikon *.nef": "nef",
         "Nikon *.nrw": "nrw",
         "*.obm": "obm",
-        "Olympus *.orf": "orf ",
+        "Olympus *.orf": "orf",
         "Pentax *.pef": "pef",
         "Pentax *.ptx": "ptx",
         "Logitech *.pxn": "pxn",
@@ -44,6 +59,32 @@ RAW_FILE_EXTENSIONS = OrderedDict(
         "Sony *.srf": "srf",
         "Samsung *.srw": "srw",
         "TIFF *.tif": "tif",
-        "Sigma *.3xf": "x3f",
+        "Sigma *.x3f": "x3f",
     }
 )
+
+# Lower case suffixes, dot included, of every format, so that a file name is
+# matched with a single set lookup on its extension.
+_SUFFIXES = {ext: f".{ext}" for ext in RAW_FILE_EXTENSIONS.values()}
+ALL_SUFFIXES = frozenset(_SUFFIXES.values())
+
+# Suffixes other software uses too: files with these are only read if they
+# start with a known image header.
+PROBED_SUFFIXES = frozenset({".data", ".raw"})
+
+# Sidecars written next to images by editors; kept with the images they
+# belong to, named either IMG_0001.xmp or IMG_0001.CR3.xmp.
+SIDECAR_SUFFIXES = frozenset({".xmp"})
+
+
+def format_suffixes(formats: Iterable[str]) -> FrozenSet[str]:
+    """
+    Return the suffixes matching the given formats, as listed in
+    RAW_FILE_EXTENSIONS or ALL_FORMATS.
+    """
+    # Tolerates ".JPG" style formats and ones saved before "orf " lost its
+    # stray space.
+    formats = {f.strip().lower().lstrip(".") for f in formats}
+    if ALL_FORMATS in formats:
+        return ALL_SUFFIXES
+    return frozenset(_SUFFIXES[f] for f in formats if f in _SUFFIXES)
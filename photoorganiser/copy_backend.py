@@ -0,0 +1,235 @@
+import ctypes
+import errno
+import os
+import os.path as osp
+import sys
+from typing import BinaryIO, Dict, Iterable, Iterator, Set, Tuple, Union
+
+from photoorganiser.metrics import KERNEL_COPY, READ, WRITE, clock, metrics
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    _syncfs = ctypes.CDLL(None, use_errno=True).syncfs
+except (OSError, AttributeError):
+    _syncfs = None
+
+# Kernel copies are issued in chunks of this size so that progress can be
+# reported and cancellation checked between them.
+_KERNEL_CHUNK_SIZE = 32 * 1024 * 1024
+
+# Userspace fallback buffers start small, so the first progress update of a
+# small file arrives quickly, and double up to the maximum for large files.
+_MIN_BUFFER_SIZE = 1024 * 1024
+_MAX_BUFFER_SIZE = 16 * 1024 * 1024
+
+_FICLONE = 0x40049409
+
+# Errors meaning "this method is not available here", after which the next
+# method is tried rather than failing the copy.
+_UNSUPPORTED_ERRNOS = {
+    errno.EBADF,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.EXDEV,
+    errno.EPERM,
+}
+
+_CLONE = "clone"
+_COPY_FILE_RANGE = "copy_file_range"
+_SENDFILE = "sendfile"
+
+
+class ReadError(Exception):
+    pass
+
+
+class WriteError(Exception):
+    pass
+
+
+class CopyBackend(object):
+    def __init__(self):
+        self._methods: Tuple[str, ...] = ()
+        if sys.platform.startswith("linux"):
+            self._methods += (_CLONE,)
+        if hasattr(os, "copy_file_range"):
+            self._methods += (_COPY_FILE_RANGE,)
+        if sys.platform.startswith("linux") and hasattr(os, "sendfile"):
+            self._methods += (_SENDFILE,)
+
+        # (source device, destination device, method) combinations which have
+        # already failed as unsupported, so they are not retried per file.
+        self._unsupported: Set[Tuple[int, int, str]] = set()
+        self._buffer: Union[memoryview, None] = None
+
+    def copy(
+        self, source: BinaryIO, dest: BinaryIO, total: int, content_hash=None
+    ) -> Iterator[int]:
+        """
+        Copy source to dest from their current positions, yielding the number
+        of bytes copied so far after each chunk. Closing the generator early
+        abandons the copy. If content_hash, a hashlib style object, is given
+        it is updated with the data as it is copied; the data then has to pass
+        through userspace, so the kernel copy methods are not used. Copying
+        stops at the end of source, which need not be total bytes away, so
+        callers must check the final count.
+        """
+        if content_hash is not None:
+            yield from self._buffered(source, dest, content_hash)
+            return
+
+        source_fd = source.fileno()
+        dest_fd = dest.fileno()
+        devices = (os.fstat(source_fd).st_dev, os.fstat(dest_fd).st_dev)
+
+        for method in self._methods:
+            key = devices + (method,)
+            if key in self._unsupported:
+                continue
+
+            copier = getattr(self, f"_{method}")(source_fd, dest_fd, total)
+            try:
+                progress = next(copier)
+            except StopIteration:
+                return
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED_ERRNOS:
+                    raise WriteError() from e
+                self._unsupported.add(key)
+                continue
+
+            yield progress
+            try:
+                yield from copier
+            except OSError as e:
+                raise WriteError() from e
+            return
+
+        yield from self._buffered(source, dest)
+
+    @staticmethod
+    def _clone(source_fd: int, dest_fd: int, total: int) -> Iterator[int]:
+        if fcntl is None:
+            raise OSError(errno.ENOSYS, "fcntl not available")
+        start = clock()
+        fcntl.ioctl(dest_fd, _FICLONE, source_fd)
+        metrics.observe(KERNEL_COPY, start, total)
+        yield total
+
+    @staticmethod
+    def _copy_file_range(source_fd: int, dest_fd: int, total: int) -> Iterator[int]:
+        progress = 0
+        while True:
+            start = clock()
+            copied = os.copy_file_range(source_fd, dest_fd, _KERNEL_CHUNK_SIZE)
+            metrics.observe(KERNEL_COPY, start, copied)
+            if copied == 0:
+                break
+            progress += copied
+            yield progress
+        if progress == 0:
+            yield progress
+
+    @staticmethod
+    def _sendfile(source_fd: int, dest_fd: int, total: int) -> Iterator[int]:
+        # Explicit offsets leave the source position alone, so start from it.
+        offset = os.lseek(source_fd, 0, os.SEEK_CUR)
+        progress = 0
+        while True:
+            start = clock()
+            copied = os.sendfile(
+                dest_fd, source_fd, offset + progress, _KERNEL_CHUNK_SIZE
+            )
+            metrics.observe(KERNEL_COPY, start, copied)
+            if copied == 0:
+                break
+            progress += copied
+            yield progress
+        if progress == 0:
+            yield progress
+
+    def _buffered(
+        self, source: BinaryIO, dest: BinaryIO, content_hash=None
+    ) -> Iterator[int]:
+        if self._buffer is None:
+            self._buffer = memoryview(bytearray(_MAX_BUFFER_SIZE))
+        view = self._buffer
+        buffer_size = _MIN_BUFFER_SIZE
+
+        progress = 0
+        while True:
+            start = clock()
+            try:
+                data_len = source.readinto(view[:buffer_size])
+            except OSError as e:
+                raise ReadError() from e
+            metrics.observe(READ, start, data_len or 0)
+            if not data_len:
+                break
+
+            if content_hash is not None:
+                content_hash.update(view[:data_len])
+            start = clock()
+            try:
+                written = dest.write(view[:data_len])
+            except OSError as e:
+                raise WriteError() from e
+            metrics.observe(WRITE, start, data_len)
+            if written != data_len:
+                raise WriteError()
+
+            progress += data_len
+            buffer_size = min(buffer_size * 2, _MAX_BUFFER_SIZE)
+            yield progress
+
+        if progress == 0:
+            yield progress
+
+
+def sync_files(paths: Iterable[str]):
+    """
+    Flush the data of paths, and the directory entries naming them, to stable
+    storage. Where syncfs() is available this is done once per filesystem
+    rather than once per file. Raises OSError on failure.
+    """
+    paths = list(paths)
+    directories = {osp.dirname(osp.abspath(path)) for path in paths}
+
+    if _syncfs is not None:
+        filesystems: Dict[int, str] = {}
+        for directory in directories:
+            filesystems.setdefault(os.stat(directory).st_dev, directory)
+        for directory in filesystems.values():
+            fd = os.open(directory, os.O_RDONLY)
+            try:
+                if _syncfs(fd) != 0:
+                    e = ctypes.get_errno()
+                    raise OSError(e, os.strerror(e), directory)
+            finally:
+                os.close(fd)
+        return
+
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    for directory in directories:
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.fsync(fd)
+        except OSError:
+            # Not every platform can fsync a directory.
+            pass
+        finally:
+            os.close(fd)
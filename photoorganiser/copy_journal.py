@@ -0,0 +1,159 @@
+import os
+import os.path as osp
+import sqlite3
+import threading
+from typing import Iterable, List, Tuple
+
+from recordtype import recordtype
+
+# Suffix of the temporary file a copy is written to before being renamed into
+# place, so that a destination path only ever holds a complete file.
+PART_SUFFIX = ".part"
+
+# Entry states.
+PLANNED = 0
+COPYING = 1
+COMPLETE = 2
+
+JournalEntry = recordtype(
+    "JournalEntry", ["source_path", "dest_path", "size", ("copied", 0)]
+)
+
+
+def part_path(dest_path: str) -> str:
+    return dest_path + PART_SUFFIX
+
+
+class CopyJournal(object):
+    """
+    Persistent record of the copies planned into a destination root, so that
+    an interrupted copy can be resumed: completed files are not copied again
+    and partly written ones continue from their last checkpoint. Safe to
+    share between copy worker threads.
+    """
+
+    FILE_NAME = "copy_journal.sqlite3"
+
+    def __init__(self, config_dir: str, dest_root: str):
+        self._dest_root = osp.abspath(dest_root)
+        self._lock = threading.Lock()
+
+        self._connection = sqlite3.connect(
+            osp.join(config_dir, self.FILE_NAME), check_same_thread=False
+        )
+        self._connection.executescript(
+            """
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS entries (
+                dest_path TEXT PRIMARY KEY,
+                dest_root TEXT NOT NULL,
+                source_path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                state INTEGER NOT NULL,
+                copied INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS entries_dest_root ON entries (dest_root);
+            """
+        )
+        # Journals written before mtime_ns was recorded; their checkpoints
+        # cannot be matched to a source, so are copied again from the start.
+        columns = [
+            row[1] for row in self._connection.execute("PRAGMA table_info(entries)")
+        ]
+        if "mtime_ns" not in columns:
+            with self._connection:
+                self._connection.execute(
+                    "ALTER TABLE entries ADD COLUMN mtime_ns INTEGER NOT NULL DEFAULT 0"
+                )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def begin(self, entries: Iterable[Tuple[str, str, int]]):
+        # Replaces whatever was recorded for the destination root with the
+        # given (source path, destination path, size) entries. Part files left
+        # by the unfinished copies being replaced are removed.
+        for entry in self.unfinished():
+            try:
+                os.remove(part_path(entry.dest_path))
+            except OSError:
+                pass
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM entries WHERE dest_root = ?", (self._dest_root,)
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO entries "
+                "(dest_path, dest_root, source_path, size, state, copied) "
+                "VALUES (?, ?, ?, ?, ?, 0)",
+                (
+                    (
+                        osp.abspath(dest_path),
+                        self._dest_root,
+                        source_path,
+                        size,
+                        PLANNED,
+                    )
+                    for source_path, dest_path, size in entries
+                ),
+            )
+
+    def finish(self):
+        # Forgets the destination root once everything has been copied.
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM entries WHERE dest_root = ?", (self._dest_root,)
+            )
+
+    def unfinished(self) -> List[JournalEntry]:
+        with self._lock:
+            return [
+                JournalEntry(*row)
+                for row in self._connection.execute(
+                    "SELECT source_path, dest_path, size, copied FROM entries "
+                    "WHERE dest_root = ? AND state != ? ORDER BY rowid",
+                    (self._dest_root, COMPLETE),
+                )
+            ]
+
+    def resume_offset(self, dest_path: str, size: int, mtime_ns: int) -> int:
+        # Bytes of the destination's part file known to have reached the disk,
+        # or 0 if it has to be copied from the start. size and mtime_ns are
+        # those of the source now: a source that has changed since the
+        # checkpoint, such as a card reformatted and refilled with the same
+        # file names, is copied from the start.
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT copied, size, mtime_ns FROM entries WHERE dest_path = ?",
+                (osp.abspath(dest_path),),
+            ).fetchone()
+        if row is None or not row[0]:
+            return 0
+        copied, checkpoint_size, checkpoint_mtime_ns = row
+        if (checkpoint_size, checkpoint_mtime_ns) != (size, mtime_ns) or copied > size:
+            return 0
+        try:
+            if os.stat(part_path(dest_path)).st_size < copied:
+                return 0
+        except OSError:
+            return 0
+        return copied
+
+    def checkpoint(self, dest_path: str, copied: int, size: int, mtime_ns: int):
+        # size and mtime_ns identify the source the copied bytes came from.
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE entries SET state = ?, copied = ?, size = ?, mtime_ns = ? "
+                "WHERE dest_path = ?",
+                (COPYING, copied, size, mtime_ns, osp.abspath(dest_path)),
+            )
+
+    def completed(self, dest_path: str):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE entries SET state = ?, copied = 0 WHERE dest_path = ?",
+                (COMPLETE, osp.abspath(dest_path)),
+            )
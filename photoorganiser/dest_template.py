@@ -0,0 +1,280 @@
+import itertools
+import os
+import os.path as osp
+import re
+import string
+from typing import Callable, Dict, Iterable, List, Sequence, Set, Tuple, Union
+
+from photoorganiser.consts import ALL_SUFFIXES, DEFAULT_TEMPLATE, SIDECAR_SUFFIXES
+from photoorganiser.file_model import FileModelRecord, RecordStore, date_key
+from photoorganiser.metrics import PLAN, clock, metrics
+
+# Placeholders, as expressions over the name, date key (YYYYMMDDHHMMSS), camera
+# and lens model and sequence number of a file. Numbers accept a format spec,
+# so "{month:02}" gives zero padded months. Camera and lens models are made
+# safe as path components before rendering, once per distinct value.
+_FIELDS = {
+    "year": "date // 10000000000",
+    "month": "date // 100000000 % 100",
+    "day": "date // 1000000 % 100",
+    "hour": "date // 10000 % 100",
+    "minute": "date // 100 % 100",
+    "second": "date % 100",
+    "date": "_iso_date(date)",
+    "camera": "camera",
+    "lens": "lens",
+    "file_name": "name",
+    "stem": "stem",
+    "ext": "ext[1:].lower()",
+    "seq": "seq",
+}
+PLACEHOLDERS = tuple(_FIELDS)
+_SPEC_RE = re.compile(r"^[<>=^+\- #0-9,_.a-zA-Z%]*$")
+
+
+class TemplateError(ValueError):
+    pass
+
+
+def _iso_date(key: int) -> str:
+    day = key // 1000000
+    return f"{day // 10000:04}-{day // 100 % 100:02}-{day % 100:02}"
+
+
+def _split_name(name: str) -> Tuple[str, str]:
+    # The stem and extension of a file name. Sidecars named after the file
+    # name of their image, such as IMG_0001.CR3.xmp, share the stem of the
+    # image and keep both extensions, so "{stem}_{seq}.{ext}" renames them
+    # along with the image. Otherwise split as by osp.splitext(), which is
+    # several times slower.
+    dot = name.rfind(".")
+    if dot <= 0 or (name[0] == "." and not len(name[:dot].strip("."))):
+        return name, ""
+    ext = name[dot:]
+    if ext.lower() in SIDECAR_SUFFIXES:
+        image_dot = name.rfind(".", 0, dot)
+        if image_dot > 0 and name[image_dot:dot].lower() in ALL_SUFFIXES:
+            return name[:image_dot], name[image_dot:]
+    return name[:dot], ext
+
+
+def _component(value: str) -> str:
+    # Metadata must not be able to add path components, such as a lens called
+    # "EF24-105mm f/4L".
+    value = value.replace("/", "-").replace(os.sep, "-").strip(". ")
+    return value if len(value) else "Unknown"
+
+
+class DestinationTemplate(object):
+    """
+    A destination layout such as "{year}/{month:02}/{camera}/{file_name}",
+    relative to the destination root. The directory and file name parts of
+    the template are each compiled once into a function rendering whole
+    columns of file metadata in a single list comprehension over an f-string,
+    so planning costs a few microseconds per file. Raises
+    TemplateError if the template is not valid.
+    """
+
+    def __init__(self, template: str = DEFAULT_TEMPLATE):
+        self.template = template
+
+        components = template.split("/")
+        if osp.isabs(template) or ".." in components or not len(components[-1]):
+            raise TemplateError("The template must be a relative path to a file")
+        directory, _, name = template.rpartition("/")
+
+        self._fields: Set[str] = set()
+        self._render_directories = self._compile(directory)
+        # The usual case of keeping file names needs no rendering at all.
+        self._render_names = self._compile(name) if name != "{file_name}" else None
+        if not len(self._fields) and name != "{file_name}":
+            raise TemplateError("The template has no placeholders")
+        self.uses_sequence = "seq" in self._fields
+
+        # Catches format specs that do not suit their placeholder, such as
+        # "{camera:d}".
+        try:
+            self.render(["IMG_0001.JPG"], [20200102030405], ["Camera"], ["Lens"])
+        except (ValueError, TypeError) as e:
+            raise TemplateError(str(e)) from e
+
+    def _compile(self, template: str) -> Callable[..., List[str]]:
+        try:
+            parsed = list(string.Formatter().parse(template))
+        except ValueError as e:
+            raise TemplateError(str(e)) from e
+
+        # Rebuilt as an f-string over the fixed expressions in _FIELDS. Format
+        # specs are limited to characters that need no escaping.
+        parts: List[str] = []
+        fields: Set[str] = set()
+        for literal, field, spec, conversion in parsed:
+            parts.append(
+                literal.replace("{", "{{").replace("}", "}}").replace("/", os.sep)
+            )
+            if field is None:
+                continue
+            if field not in _FIELDS:
+                raise TemplateError(f"Unknown placeholder {{{field}}}")
+            if conversion is not None or not _SPEC_RE.match(spec):
+                raise TemplateError(f"Unsupported format for {{{field}}}")
+            expression = _FIELDS[field]
+            parts.append(f"{{{expression}:{spec}}}" if spec else f"{{{expression}}}")
+            fields.add(field)
+        self._fields.update(fields)
+
+        # Names are only split, once per row, if the stem or extension is used.
+        split = "stem" in fields or "ext" in fields
+        source = (
+            "def render(names, dates, cameras, lenses, seqs):\n"
+            "    return [\n"
+            f"        f{''.join(parts)!r}\n"
+            "        for name, date, camera, lens, seq"
+            f"{', (stem, ext)' if split else ''}\n"
+            "        in zip(names, dates, cameras, lenses, seqs"
+            f"{', map(_split_name, names)' if split else ''})\n"
+            "    ]\n"
+        )
+        namespace = dict(_iso_date=_iso_date, _split_name=_split_name)
+        exec(compile(source, "<destination template>", "exec"), namespace)
+        return namespace["render"]
+
+    def _render(
+        self,
+        file_names: Sequence[str],
+        date_keys: Sequence[int],
+        camera_models: Sequence[str],
+        lens_models: Sequence[str],
+        seqs: Union[Sequence[int], None],
+    ) -> Tuple[List[str], Sequence[str]]:
+        # Camera and lens models must already be safe as path components.
+        columns = (
+            file_names,
+            date_keys,
+            camera_models,
+            lens_models,
+            itertools.repeat(0) if seqs is None else seqs,
+        )
+        directories = self._render_directories(*columns)
+        if self._render_names is None:
+            return directories, file_names
+        return directories, self._render_names(*columns)
+
+    def render(
+        self,
+        file_names: Sequence[str],
+        date_keys: Sequence[int],
+        camera_models: Sequence[str],
+        lens_models: Sequence[str],
+        seqs: Union[Sequence[int], None] = None,
+    ) -> List[str]:
+        """
+        Return the destination path of each file described by the parallel
+        sequences. seqs are the sequence numbers, 0 for all files if None.
+        """
+        directories, names = self._render(
+            file_names,
+            date_keys,
+            [_component(camera_model) for camera_model in camera_models],
+            [_component(lens_model) for lens_model in lens_models],
+            seqs,
+        )
+        return [
+            osp.join(directory, name) for directory, name in zip(directories, names)
+        ]
+
+    def render_records(self, records: List[FileModelRecord]):
+        # Fills in dest_path of each record. Sequence numbers depend on the
+        # whole scan, so are only assigned by plan_destinations().
+        start = clock()
+        dest_paths = self.render(
+            [r.file_name for r in records],
+            [date_key(r.date_time_original) for r in records],
+            [r.camera_model for r in records],
+            [r.lens_model for r in records],
+        )
+        for record, dest_path in zip(records, dest_paths):
+            record.dest_path = dest_path
+        metrics.observe(PLAN, start)
+
+
+def _collisions(dest_paths: Iterable[Tuple[int, str]]) -> Dict[str, List[int]]:
+    # Paths differing only in case collide on case insensitive filesystems,
+    # such as FAT and exFAT cards, SMB shares and APFS by default, so they are
+    # compared casefolded on every platform.
+    first: Dict[str, Tuple[str, int]] = {}
+    collisions: Dict[str, List[int]] = {}
+    for row, dest_path in dest_paths:
+        first_path, first_row = first.setdefault(dest_path.casefold(), (dest_path, row))
+        if first_row != row:
+            collisions.setdefault(first_path, [first_row]).append(row)
+    return collisions
+
+
+def find_collisions(
+    store: RecordStore, rows: Union[Iterable[int], None] = None
+) -> Dict[str, List[int]]:
+    """
+    Return the rows of store, or of rows, that share a destination path,
+    keyed by that path.
+    """
+    if rows is None:
+        rows = range(len(store))
+    return _collisions((row, store.dest_path(row)) for row in rows)
+
+
+def plan_destinations(
+    store: RecordStore, template: DestinationTemplate
+) -> Dict[str, List[int]]:
+    """
+    Render the destination path of every row of store and return any
+    collisions, as find_collisions(). Sequence numbers count from 1 in
+    capture time order, then by file name, one per group of files.
+    """
+    start = clock()
+    file_names, date_keys, cameras, lenses = store.template_inputs()
+
+    def components(column: Tuple[List[str], Sequence[int]]) -> List[str]:
+        # Made safe once per distinct value rather than once per row.
+        values, indexes = column
+        values = [_component(value) for value in values]
+        return [values[index] for index in indexes]
+
+    seqs = None
+    if template.uses_sequence:
+        # Files of a group share a number, so that a RAW file, its JPEG and
+        # their sidecar keep matching names.
+        seqs = [0] * len(store)
+        group_seqs: Dict[int, int] = {}
+        seq = 0
+        by_name = store.sort_order("file_name")
+        for row in sorted(by_name, key=date_keys.__getitem__):
+            group = store.group(row)
+            if group:
+                if group not in group_seqs:
+                    seq += 1
+                    group_seqs[group] = seq
+                seqs[row] = group_seqs[group]
+            else:
+                seq += 1
+                seqs[row] = seq
+
+    directories, names = template._render(
+        file_names, date_keys, components(cameras), components(lenses), seqs
+    )
+    dest_names = {}
+    if names is not file_names:
+        dest_names = {
+            row: name
+            for row, (name, file_name) in enumerate(zip(names, file_names))
+            if name != file_name
+        }
+    store.set_dest_paths(directories, dest_names)
+    metrics.observe(PLAN, start)
+
+    # Nearly every plan is free of collisions, which a set shows quickly.
+    casefold = str.casefold
+    keys = set(zip(map(casefold, directories), map(casefold, names)))
+    if len(keys) == len(store):
+        return {}
+    return find_collisions(store)
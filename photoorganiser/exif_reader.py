@@ -0,0 +1,352 @@
+import mmap
+import struct
+from typing import Callable, Dict, List, Tuple, Union
+
+# Only the header region of a file is ever touched: files are memory mapped so
+# that the kernel pages in just the blocks holding the IFDs we walk, falling
+# back to a bounded read where mapping is not possible.
+_MAX_HEADER_SIZE = 1 << 20
+
+_TAG_MODEL = 0x0110
+_TAG_EXIF_IFD = 0x8769
+_TAG_DATE_TIME_ORIGINAL = 0x9003
+_TAG_LENS_MODEL = 0xA434
+_TAG_SUB_IFDS = 0x014A
+_TAG_JPEG_OFFSET = 0x0201
+_TAG_JPEG_LENGTH = 0x0202
+
+_ASCII = 2
+_SHORT = 3
+_LONG = 4
+_IFD = 13
+
+# Bounds on the IFDs walked looking for previews, against corrupt files.
+_MAX_PREVIEW_IFDS = 16
+# The smallest embedded preview at least this large is used; the thumbnails
+# some cameras embed are too small to be worth decoding instead.
+_MIN_PREVIEW_LENGTH = 16 * 1024
+
+_CANON_UUID = bytes.fromhex("85c0b687820f11e08111f4ce462b6a48")
+
+MODEL = "Image Model"
+DATE_TIME_ORIGINAL = "EXIF DateTimeOriginal"
+LENS_MODEL = "EXIF LensModel"
+REQUIRED_TAGS = (MODEL, DATE_TIME_ORIGINAL)
+_TAG_NAMES = {
+    _TAG_MODEL: MODEL,
+    _TAG_DATE_TIME_ORIGINAL: DATE_TIME_ORIGINAL,
+    _TAG_LENS_MODEL: LENS_MODEL,
+}
+
+
+class _NotFound(Exception):
+    pass
+
+
+def _ascii(buf, offset: int, count: int) -> str:
+    values = bytes(buf[offset : offset + count]).split(b"\x00", 1)[0]
+    return values.decode("utf-8", errors="replace")
+
+
+def _parse_tiff(buf, base: int, tags: Dict[str, str], follow_exif_ifd: bool = True):
+    byte_order = bytes(buf[base : base + 2])
+    if byte_order == b"II":
+        endian = "<"
+    elif byte_order == b"MM":
+        endian = ">"
+    else:
+        raise _NotFound()
+
+    (ifd_offset,) = struct.unpack_from(endian + "I", buf, base + 4)
+    exif_ifd_offset = _parse_ifd(buf, base, ifd_offset, endian, tags)
+    if follow_exif_ifd and DATE_TIME_ORIGINAL not in tags and exif_ifd_offset:
+        try:
+            _parse_ifd(buf, base, exif_ifd_offset, endian, tags)
+        except (struct.error, IndexError):
+            pass
+
+
+def _parse_ifd(buf, base: int, ifd_offset: int, endian: str, tags: Dict[str, str]):
+    entry_format = endian + "HHI4s"
+    exif_ifd_offset = 0
+
+    offset = base + ifd_offset
+    (entry_count,) = struct.unpack_from(endian + "H", buf, offset)
+    offset += 2
+    for _ in range(entry_count):
+        tag, field_type, count, value = struct.unpack_from(entry_format, buf, offset)
+        offset += 12
+
+        if tag == _TAG_EXIF_IFD and field_type == _LONG:
+            (exif_ifd_offset,) = struct.unpack(endian + "I", value)
+        elif tag in _TAG_NAMES and field_type == _ASCII:
+            if count <= 4:
+                string = _ascii(value, 0, count)
+            else:
+                (value_offset,) = struct.unpack(endian + "I", value)
+                string = _ascii(buf, base + value_offset, count)
+            tags[_TAG_NAMES[tag]] = string
+
+        # Entries are sorted by tag, so once past the optional lens model
+        # nothing else of interest follows.
+        if tag >= _TAG_LENS_MODEL and all(name in tags for name in REQUIRED_TAGS):
+            break
+
+    return exif_ifd_offset
+
+
+def _parse_jpeg(buf, offset: int, tags: Dict[str, str]):
+    if bytes(buf[offset : offset + 2]) != b"\xff\xd8":
+        raise _NotFound()
+    offset += 2
+
+    while True:
+        marker, length = struct.unpack_from(">HH", buf, offset)
+        if marker == 0xFFE1 and bytes(buf[offset + 4 : offset + 10]) == b"Exif\0\0":
+            _parse_tiff(buf, offset + 10, tags)
+            return
+        # Start of scan: no more metadata segments follow.
+        if marker == 0xFFDA or marker & 0xFF00 != 0xFF00:
+            raise _NotFound()
+        offset += 2 + length
+
+
+def _parse_raf(buf, tags: Dict[str, str]):
+    (jpeg_offset,) = struct.unpack_from(">I", buf, 84)
+    _parse_jpeg(buf, jpeg_offset, tags)
+
+
+def _iter_boxes(buf, offset: int, end: int):
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", buf, offset)
+        header_size = 8
+        if size == 1:
+            (size,) = struct.unpack_from(">Q", buf, offset + 8)
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            raise _NotFound()
+        yield box_type, offset + header_size, offset + size
+        offset += size
+
+
+def _parse_cr3(buf, tags: Dict[str, str]):
+    for box_type, start, end in _iter_boxes(buf, 0, len(buf)):
+        if box_type != b"moov":
+            continue
+        for child_type, child_start, child_end in _iter_boxes(buf, start, end):
+            if child_type != b"uuid" or bytes(buf[child_start : child_start + 16]) != (
+                _CANON_UUID
+            ):
+                continue
+            for cmt_type, cmt_start, cmt_end in _iter_boxes(
+                buf, child_start + 16, child_end
+            ):
+                # CMT1 holds IFD0 and CMT2 the Exif IFD, each as a TIFF stream.
+                if cmt_type in (b"CMT1", b"CMT2"):
+                    _parse_tiff(buf, cmt_start, tags, follow_exif_ifd=False)
+                if all(name in tags for name in REQUIRED_TAGS):
+                    return
+        return
+
+
+def _parse_mrw(buf, tags: Dict[str, str]):
+    (data_offset,) = struct.unpack_from(">I", buf, 4)
+    offset = 8
+    while offset < data_offset + 8:
+        block_type, length = struct.unpack_from(">4sI", buf, offset)
+        if block_type == b"\0TTW":
+            _parse_tiff(buf, offset + 8, tags)
+            return
+        offset += 8 + length
+    raise _NotFound()
+
+
+def _ifd_int(value: bytes, field_type: int, endian: str) -> int:
+    if field_type == _SHORT:
+        return struct.unpack_from(endian + "H", value)[0]
+    return struct.unpack_from(endian + "I", value)[0]
+
+
+def _tiff_previews(buf, base: int, previews: List[Tuple[int, int]]):
+    byte_order = bytes(buf[base : base + 2])
+    if byte_order not in (b"II", b"MM"):
+        raise _NotFound()
+    endian = "<" if byte_order == b"II" else ">"
+    entry_format = endian + "HHI4s"
+
+    (ifd_offset,) = struct.unpack_from(endian + "I", buf, base + 4)
+    pending = [ifd_offset]
+    seen = set()
+    while len(pending) and len(seen) < _MAX_PREVIEW_IFDS:
+        ifd_offset = pending.pop()
+        if not ifd_offset or ifd_offset in seen:
+            continue
+        seen.add(ifd_offset)
+
+        offset = base + ifd_offset
+        (entry_count,) = struct.unpack_from(endian + "H", buf, offset)
+        jpeg_offset = jpeg_length = 0
+        for i in range(entry_count):
+            tag, field_type, count, value = struct.unpack_from(
+                entry_format, buf, offset + 2 + 12 * i
+            )
+            if tag == _TAG_SUB_IFDS and field_type in (_LONG, _IFD):
+                if count == 1:
+                    pending.append(_ifd_int(value, _LONG, endian))
+                else:
+                    (value_offset,) = struct.unpack(endian + "I", value)
+                    pending.extend(
+                        struct.unpack_from(
+                            endian + "I" * count, buf, base + value_offset
+                        )
+                    )
+            elif tag == _TAG_JPEG_OFFSET:
+                jpeg_offset = _ifd_int(value, field_type, endian)
+            elif tag == _TAG_JPEG_LENGTH:
+                jpeg_length = _ifd_int(value, field_type, endian)
+        if jpeg_offset and jpeg_length:
+            previews.append((base + jpeg_offset, jpeg_length))
+        (next_ifd_offset,) = struct.unpack_from(
+            endian + "I", buf, offset + 2 + 12 * entry_count
+        )
+        pending.append(next_ifd_offset)
+
+
+def _cr3_previews(buf, previews: List[Tuple[int, int]]):
+    for box_type, start, end in _iter_boxes(buf, 0, len(buf)):
+        if box_type != b"moov":
+            continue
+        for child_type, child_start, child_end in _iter_boxes(buf, start, end):
+            if child_type != b"uuid" or bytes(buf[child_start : child_start + 16]) != (
+                _CANON_UUID
+            ):
+                continue
+            for thmb_type, thmb_start, thmb_end in _iter_boxes(
+                buf, child_start + 16, child_end
+            ):
+                # Version and flags, width, height, JPEG length and two
+                # reserved shorts precede the JPEG data.
+                if thmb_type == b"THMB":
+                    (length,) = struct.unpack_from(">I", buf, thmb_start + 8)
+                    previews.append((thmb_start + 16, length))
+                    return
+        return
+
+
+def _previews(buf, previews: List[Tuple[int, int]]):
+    magic = bytes(buf[:16])
+    if magic[:2] in (b"II", b"MM"):
+        _tiff_previews(buf, 0, previews)
+    elif magic == b"FUJIFILMCCD-RAW ":
+        previews.append(struct.unpack_from(">II", buf, 84))
+    elif magic[4:12] == b"ftypcrx ":
+        _cr3_previews(buf, previews)
+    elif magic[:4] == b"\0MRM":
+        # MRW files embed a TIFF stream holding a thumbnail.
+        (data_offset,) = struct.unpack_from(">I", buf, 4)
+        offset = 8
+        while offset < data_offset + 8:
+            block_type, length = struct.unpack_from(">4sI", buf, offset)
+            if block_type == b"\0TTW":
+                _tiff_previews(buf, offset + 8, previews)
+                return
+            offset += 8 + length
+
+
+def read_embedded_preview(full_path: str) -> Union[bytes, None]:
+    """
+    Return a JPEG preview embedded in a TIFF based RAW, RAF, CR3 or MRW file,
+    or None if there is none. Where there are several, the smallest one of
+    a useful size is returned.
+    """
+    previews: List[Tuple[int, int]] = []
+    with open(full_path, "rb") as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            return None
+
+        try:
+            _previews(buf, previews)
+        except (_NotFound, struct.error, IndexError, ValueError):
+            pass
+
+        try:
+            previews = [
+                p
+                for p in previews
+                if p[1] > 0
+                and p[0] + p[1] <= len(buf)
+                and bytes(buf[p[0] : p[0] + 2]) == b"\xff\xd8"
+            ]
+            if not len(previews):
+                return None
+            large = [p for p in previews if p[1] >= _MIN_PREVIEW_LENGTH]
+            if len(large):
+                offset, length = min(large, key=lambda p: p[1])
+            else:
+                offset, length = max(previews, key=lambda p: p[1])
+            return bytes(buf[offset : offset + length])
+        finally:
+            buf.close()
+
+
+def _parser_for(magic: bytes) -> Union[Callable[..., None], None]:
+    # The parser for a file starting with magic, called as parser(buf, tags).
+    if magic[:2] in (b"II", b"MM"):
+        return lambda buf, tags: _parse_tiff(buf, 0, tags)
+    elif magic[:2] == b"\xff\xd8":
+        return lambda buf, tags: _parse_jpeg(buf, 0, tags)
+    elif magic == b"FUJIFILMCCD-RAW ":
+        return _parse_raf
+    elif magic[4:12] == b"ftypcrx ":
+        return _parse_cr3
+    elif magic[:4] == b"\0MRM":
+        return _parse_mrw
+    return None
+
+
+def _parse(buf, tags: Dict[str, str]):
+    parser = _parser_for(bytes(buf[:16]))
+    if parser is None:
+        raise _NotFound()
+    parser(buf, tags)
+
+
+def has_image_header(full_path: str) -> bool:
+    """
+    Return whether full_path starts with the header of a format
+    read_exif_tags() understands, reading only its first 16 bytes.
+    """
+    with open(full_path, "rb") as f:
+        return _parser_for(f.read(16)) is not None
+
+
+def read_exif_tags(full_path: str) -> Union[Dict[str, str], None]:
+    """
+    Read the Image Model and EXIF DateTimeOriginal tags, and EXIF LensModel
+    where present, from the header of a TIFF based RAW, JPEG, RAF, CR3 or MRW
+    file. Returns None if the format is not recognised or either required tag
+    could not be found, in which case callers should fall back to a full
+    parser.
+    """
+    tags: Dict[str, str] = {}
+    with open(full_path, "rb") as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            buf = f.read(_MAX_HEADER_SIZE)
+
+        try:
+            _parse(buf, tags)
+        except (_NotFound, struct.error, IndexError, ValueError):
+            return None
+        finally:
+            if isinstance(buf, mmap.mmap):
+                buf.close()
+
+    if not all(name in tags for name in REQUIRED_TAGS):
+        return None
+    return tags
@@ -1,5 +1,12 @@
+import errno
+import os
+import os.path as osp
+import shutil
+import threading
+import time
 import uuid
-from typing import List, Dict, Union
+from collections import deque, OrderedDict
+from typing import List, Dict, Union, Deque, Tuple, Set
 
 from PyQt5.QtCore import (
     QObject,
@@ -7,11 +14,27 @@ from PyQt5.QtCore import (
     pyqtProperty,
     pyqtSignal,
     pyqtSlot,
-    QFile,
     Q_ENUMS,
-    QFileInfo,
+    QMetaObject,
+    Qt,
+    Q_ARG,
+    QCoreApplication,
+    QTimer,
+)
+from recordtype import recordtype
+
+from photoorganiser.consts import VERIFY_CHECKSUM, VERIFY_OFF, VERIFY_REREAD
+from photoorganiser.copy_backend import CopyBackend, ReadError, WriteError, sync_files
+from photoorganiser.copy_journal import CopyJournal, part_path
+from photoorganiser.library_index import LibraryIndex, full_hash, new_hash
+from photoorganiser.metrics import (
+    PERMISSIONS,
+    QUEUE_WAIT,
+    SYNC,
+    VERIFY,
+    clock,
+    metrics,
 )
-from PyQt5.QtWidgets import qApp
 
 try:
     from icecream import ic
@@ -21,9 +44,6 @@ except ImportError:
         pass
 
 
-_COPY_BLOCK_SIZE = 4096
-
-
 class CopyError(object):
     NoError = 0
     SourceNotExists = 1
@@ -40,6 +60,122 @@ class CopyError(object):
     CannotWriteDestinationFile = 12
     CannotRemoveSource = 13
     Cancelled = 14
+    VerificationFailed = 15
+
+
+# Written files are synced, and re-read if verifying, in batches of this many
+# files or bytes, or once a worker has been idle for _SYNC_IDLE_MS.
+_SYNC_BATCH_FILES = 64
+_SYNC_BATCH_BYTES = 512 * 1024 * 1024
+_SYNC_IDLE_MS = 100
+
+# With a journal, partly copied files are flushed and their progress recorded
+# every this many bytes.
+_CHECKPOINT_BYTES = 64 * 1024 * 1024
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def default_worker_count() -> int:
+    return min(8, os.cpu_count() or 1)
+
+
+def _rename_no_replace(source_path: str, dest_path: str):
+    # Renames source_path to dest_path, raising FileExistsError rather than
+    # replacing a file already there. A hard link makes the check atomic;
+    # filesystems without them, such as FAT, are checked beforehand instead.
+    try:
+        os.link(source_path, dest_path)
+    except FileExistsError:
+        raise
+    except OSError as e:
+        if e.errno == errno.EXDEV:
+            raise
+        if osp.lexists(dest_path):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dest_path)
+        os.rename(source_path, dest_path)
+        return
+    try:
+        os.unlink(source_path)
+    except OSError:
+        # Left as it was rather than in both places.
+        os.unlink(dest_path)
+        raise
+
+
+class _DirectoryCreator(object):
+    # Creates destination directories for all of the copy workers, each one
+    # only once and only when a file is first written to it, so that skipped,
+    # failed or cancelled copies leave no empty directories behind. Parents
+    # are only created when missing, so each new directory usually costs a
+    # single mkdir.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._created: Set[str] = set()
+
+    def forget(self, directory: str):
+        with self._lock:
+            self._created.discard(directory)
+
+    def ensure(self, directory: str) -> bool:
+        if directory in self._created:
+            return True
+        with self._lock:
+            try:
+                self._create(directory)
+            except OSError as e:
+                ic(directory, e)
+                return False
+        return True
+
+    def _create(self, directory: str):
+        if directory in self._created:
+            return
+        try:
+            os.mkdir(directory)
+        except FileExistsError:
+            if not osp.isdir(directory):
+                raise
+        except FileNotFoundError:
+            parent = osp.dirname(directory)
+            if parent == directory:
+                raise
+            # The parent may be missing despite having been created before.
+            self._created.discard(parent)
+            self._create(parent)
+            try:
+                os.mkdir(directory)
+            except FileExistsError:
+                if not osp.isdir(directory):
+                    raise
+        self._created.add(directory)
+
+
+def _checkpoint(
+    journal: CopyJournal, dest_path: str, dest_file, copied: int, source_stat
+):
+    # The data must be on disk before the journal claims it is.
+    getattr(os, "fdatasync", os.fsync)(dest_file.fileno())
+    journal.checkpoint(dest_path, copied, source_stat.st_size, source_stat.st_mtime_ns)
+
+
+def _hash_prefix(source_file, length: int, content_hash):
+    # A resumed copy's checksum has to cover the part copied before.
+    source_file.seek(0)
+    buffer = memoryview(bytearray(_HASH_CHUNK_SIZE))
+    while length > 0:
+        data_len = source_file.readinto(buffer[: min(length, len(buffer))])
+        if not data_len:
+            raise OSError("source file is shorter than the copy being resumed")
+        content_hash.update(buffer[:data_len])
+        length -= data_len
+
+
+# source_path is set for moves, whose source is removed once the destination
+# is safely on disk.
+_WrittenFile = recordtype(
+    "_WrittenFile",
+    ["uid", "dest_path", "content_hash", ("reread", False), ("source_path", None)],
+)
 
 
 class _FileCopierWorker(QObject):
@@ -53,20 +189,54 @@ class _FileCopierWorker(QObject):
 
     copy_complete = pyqtSignal(str, arguments=("uid",))
     copy_error = pyqtSignal(str, int, arguments=("uid", "error"))
-    copy_progress = pyqtSignal(str, int, int, arguments=("uid", "progress", "total"))
+    copy_progress = pyqtSignal(
+        str, "qint64", "qint64", arguments=("uid", "progress", "total")
+    )
+    # A copy continues an interrupted one from offset bytes into the file;
+    # copy_progress then counts from there.
+    copy_resumed = pyqtSignal(str, "qint64", arguments=("uid", "offset"))
     copy_cancelled = pyqtSignal(str, arguments=("uid",))
+    copy_skipped = pyqtSignal(str, str, arguments=("uid", "existing_path"))
+    # The data of a file has been written but it is yet to be synced or
+    # verified; copy_complete or copy_error follows once it has been.
+    copy_written = pyqtSignal(str, arguments=("uid",))
 
-    def __init__(self, **kwargs):
+    def __init__(self, progress_interval: float = 0.0, **kwargs):
         super().__init__(**kwargs)
 
-        self._queue: List[Dict[str, str]] = []
+        self._progress_interval = progress_interval
+
+        # Entries are looked up by uid through _entries; cancelling a queued
+        # entry just drops it from the index and the loop skips it when it
+        # reaches the front of the deque.
+        self._queue: Deque[Dict[str, str]] = deque()
+        self._entries: Dict[str, Dict[str, str]] = {}
+        self._queued: Dict[str, float] = {}
         self._running: bool = False
         self._current_uid: Union[str, None] = None
         self._cancel_current: bool = False
+        self._finishing: bool = False
+        self._backend = CopyBackend()
+        self.library_index: Union[LibraryIndex, None] = None
+        self.journal: Union[CopyJournal, None] = None
+        self.directories = _DirectoryCreator()
+        self.verify: str = VERIFY_OFF
+        self.sync: bool = False
+        self.move: bool = False
+
+        self._written: List[_WrittenFile] = []
+        self._written_bytes: int = 0
+        self._sync_timer = QTimer(
+            self, singleShot=True, interval=_SYNC_IDLE_MS, timeout=self.sync_written
+        )
 
-    @pyqtSlot(str, str, str)
-    def add_to_queue(self, uid: str, source_path: str, dest_path: str):
-        self._queue.append(dict(uid=uid, source_path=source_path, dest_path=dest_path))
+    @pyqtSlot(str, str, str, float)
+    def add_to_queue(self, uid: str, source_path: str, dest_path: str, queued: float):
+        # queued is the clock() time the copy was requested at.
+        entry = dict(uid=uid, source_path=source_path, dest_path=dest_path)
+        self._queued[uid] = queued
+        self._queue.append(entry)
+        self._entries[uid] = entry
         if not self.running:
             self._process_queue()
 
@@ -74,127 +244,534 @@ class _FileCopierWorker(QObject):
     def remove_from_queue(self, uid: str):
         if self.running and uid == self._current_uid:
             self._cancel_current = True
-        else:
-            for index, entry in enumerate(self._queue):
-                if entry["uid"] == uid:
-                    self._queue.pop(index)
-                    break
+        elif self._entries.pop(uid, None) is not None:
+            self._queued.pop(uid, None)
+            self.copy_cancelled.emit(uid)
 
     @pyqtSlot()
     def clear_queue(self):
         if self.running:
             self._cancel_current = True
+        for uid in self._entries:
+            if uid != self._current_uid:
+                self.copy_cancelled.emit(uid)
         self._queue.clear()
+        self._entries.clear()
+        self._queued.clear()
 
     def _process_queue(self):
-        if not len(self._queue):
-            self.running = False
-            return
         self.running = True
-
-        next_copy = self._queue.pop(0)
-        self._copy_file(**next_copy)
-
-        self._process_queue()
+        while len(self._queue):
+            next_copy = self._queue.popleft()
+            if self._entries.get(next_copy["uid"]) is not next_copy:
+                continue
+
+            self._cancel_current = False
+            metrics.observe(QUEUE_WAIT, self._queued.pop(next_copy["uid"]))
+            metrics.profiled(self._copy_file)(**next_copy)
+            self._entries.pop(next_copy["uid"], None)
+            self._current_uid = None
+        self.running = False
+        if self._finishing:
+            self.finish()
 
     def _copy_file(self, uid: str = "", source_path: str = "", dest_path: str = ""):
         self._current_uid = uid
 
-        source_file = QFile(source_path)
-        dest_file = QFile(dest_path)
+        library_index = self.library_index
+        if library_index is not None:
+            try:
+                existing_path = library_index.find_duplicate(source_path)
+            except OSError:
+                self.copy_error.emit(uid, FileCopier.CannotReadSourceFile)
+                return
+            if existing_path is not None:
+                if self.journal is not None:
+                    self.journal.completed(dest_path)
+                self.copy_skipped.emit(uid, existing_path)
+                return
+
+        if self.move:
+            if self._rename(uid, source_path, dest_path):
+                return
+            # Nor may a move across filesystems replace a file in the library.
+            if osp.lexists(dest_path):
+                self.copy_error.emit(uid, FileCopier.DestinationExists)
+                return
 
-        if not source_file.open(QFile.ReadOnly):
+        try:
+            source_file = open(source_path, "rb", buffering=0)
+            source_stat = os.fstat(source_file.fileno())
+        except OSError:
             self.copy_error.emit(uid, FileCopier.CannotOpenSourceFile)
             return
 
-        dest_file_info = QFileInfo(dest_file)
-        dest_dir = dest_file_info.absoluteDir()
-        if not dest_dir.exists():
-            if not dest_dir.mkpath(dest_dir.absolutePath()):
-                self.copy_error.emit(uid, FileCopier.CannotCreateDestinationDirectory)
-                return
+        dest_dir = osp.dirname(osp.abspath(dest_path))
+        if not self.directories.ensure(dest_dir):
+            source_file.close()
+            self.copy_error.emit(uid, FileCopier.CannotCreateDestinationDirectory)
+            return
 
-        if not dest_file.open(QFile.WriteOnly):
-            ic(dest_path, dest_file.errorString())
+        # Data is written to a part file which is renamed over dest_path once
+        # complete. A part file checkpointed in the journal by an interrupted
+        # copy is continued from where it got to.
+        journal = self.journal
+        temp_path = part_path(dest_path)
+        offset = 0
+        if journal is not None:
+            offset = journal.resume_offset(
+                dest_path, source_stat.st_size, source_stat.st_mtime_ns
+            )
+        try:
+            try:
+                dest_file = open(temp_path, "r+b" if offset else "wb", buffering=0)
+            except FileNotFoundError:
+                # Removed since it was created; make it again.
+                self.directories.forget(dest_dir)
+                if not self.directories.ensure(dest_dir):
+                    raise
+                offset = 0
+                dest_file = open(temp_path, "wb", buffering=0)
+        except OSError as e:
+            ic(dest_path, e)
+            source_file.close()
             self.copy_error.emit(uid, FileCopier.CannotOpenDestinationFile)
             return
 
-        progress: int = 0
-        total: int = source_file.size()
+        # Moving between filesystems copies the file, verifies it on disk and
+        # only then removes the source.
+        verify = VERIFY_REREAD if self.move else self.verify
+        sync = self.sync or self.move
+        size: int = source_stat.st_size
+        content_hash = new_hash() if verify != VERIFY_OFF else None
+        if offset:
+            try:
+                dest_file.truncate(offset)
+                dest_file.seek(offset)
+                if content_hash is not None:
+                    _hash_prefix(source_file, offset, content_hash)
+                source_file.seek(offset)
+            except OSError as e:
+                ic(dest_path, e)
+                offset = 0
+                dest_file.truncate(0)
+                dest_file.seek(0)
+                source_file.seek(0)
+                if content_hash is not None:
+                    content_hash = new_hash()
+
+        # Progress is reported for the part of the file copied by this call.
+        if offset:
+            self.copy_resumed.emit(uid, offset)
+        total: int = size - offset
         error: int = FileCopier.NoError
-        while True:
-            if self._cancel_current:
-                self._cancel_current = False
+        cancelled: bool = False
+        copier = self._backend.copy(source_file, dest_file, total, content_hash)
+        progress: int = 0
+        reported: int = -1
+        last_report: float = 0.0
+        checkpointed: int = 0
+        try:
+            for progress in copier:
+                now = time.monotonic()
+                if now - last_report >= self._progress_interval:
+                    self.copy_progress.emit(uid, progress, total)
+                    reported = progress
+                    last_report = now
+
+                if journal is not None and progress - checkpointed >= _CHECKPOINT_BYTES:
+                    _checkpoint(
+                        journal, dest_path, dest_file, offset + progress, source_stat
+                    )
+                    checkpointed = progress
+
+                QCoreApplication.processEvents()
+                if self._cancel_current:
+                    self._cancel_current = False
+                    cancelled = True
+                    break
+        except ReadError:
+            error = FileCopier.CannotReadSourceFile
+        except WriteError:
+            error = FileCopier.CannotWriteDestinationFile
+        except OSError as e:
+            ic(dest_path, e)
+            error = FileCopier.CannotWriteDestinationFile
+        finally:
+            copier.close()
+
+        if error == FileCopier.NoError and not cancelled and progress != total:
+            # The source was truncated or hit an early end of file, or grew,
+            # while being copied; never put a file of the wrong size in place.
+            ic(source_path, progress, total)
+            error = FileCopier.CannotReadSourceFile
+        if error == FileCopier.NoError and not cancelled and reported != progress:
+            self.copy_progress.emit(uid, progress, total)
+
+        if cancelled and journal is not None:
+            # Kept so that resuming can pick up from here.
+            try:
+                _checkpoint(
+                    journal, dest_path, dest_file, dest_file.tell(), source_stat
+                )
+            except OSError as e:
+                ic(dest_path, e)
+        source_file.close()
+        dest_file.close()
+        if error == FileCopier.NoError and not cancelled and verify == VERIFY_CHECKSUM:
+            # Catches data corrupted on its way to the destination, though
+            # possibly read back from the page cache rather than the device.
+            start = clock()
+            try:
+                verified = full_hash(temp_path) == content_hash.digest()
+            except OSError:
+                verified = False
+            metrics.observe(VERIFY, start)
+            if not verified:
+                error = FileCopier.VerificationFailed
+        if error == FileCopier.NoError and not cancelled:
+            try:
+                os.replace(temp_path, dest_path)
+            except OSError as e:
+                ic(dest_path, e)
+                error = FileCopier.CannotWriteDestinationFile
+        if error != FileCopier.NoError or cancelled:
+            if not cancelled or journal is None:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+            if cancelled:
                 self.copy_cancelled.emit(uid)
-                break
+            else:
+                self.copy_error.emit(uid, error)
+            return
 
-            data: Union[bytes, int] = source_file.read(_COPY_BLOCK_SIZE)
-            if isinstance(data, int):
-                assert data == -1
-                error = FileCopier.CannotReadSourceFile
-                break
+        start = clock()
+        shutil.copymode(source_path, dest_path)
+        metrics.observe(PERMISSIONS, start)
+        digest = content_hash.digest() if content_hash is not None else None
+        if not sync and verify != VERIFY_REREAD:
+            if library_index is not None:
+                library_index.add(dest_path, digest)
+            if journal is not None:
+                journal.completed(dest_path)
+            self.copy_complete.emit(uid)
+            return
 
-            data_len = len(data)
-            if data_len == 0:
-                self.copy_progress.emit(uid, progress, total)
-                break
+        self._defer(
+            _WrittenFile(
+                uid,
+                dest_path,
+                digest,
+                reread=verify == VERIFY_REREAD,
+                source_path=source_path if self.move else None,
+            ),
+            size,
+        )
 
-            if data_len != dest_file.write(data):
-                error = FileCopier.CannotWriteDestinationFile
-                break
+    def _rename(self, uid: str, source_path: str, dest_path: str) -> bool:
+        # Within a filesystem a move is a rename, with no data copied. Returns
+        # False, leaving the file to be copied, across filesystems or if the
+        # rename fails for any other reason. A file already at dest_path is
+        # reported as DestinationExists rather than replaced.
+        if not self.directories.ensure(osp.dirname(osp.abspath(dest_path))):
+            return False
+        try:
+            size = os.stat(source_path).st_size
+            _rename_no_replace(source_path, dest_path)
+        except FileExistsError:
+            self.copy_error.emit(uid, FileCopier.DestinationExists)
+            return True
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                ic(source_path, e)
+            return False
+
+        if self.journal is not None:
+            try:
+                os.remove(part_path(dest_path))
+            except OSError:
+                pass
+        self.copy_progress.emit(uid, size, size)
+        if self.sync:
+            self._defer(_WrittenFile(uid, dest_path, None), size)
+            return True
+        if self.library_index is not None:
+            self.library_index.add(dest_path)
+        if self.journal is not None:
+            self.journal.completed(dest_path)
+        self.copy_complete.emit(uid)
+        return True
+
+    def _defer(self, written: _WrittenFile, size: int):
+        # The copy itself is over, so it can no longer be cancelled.
+        self._current_uid = None
+        self._written.append(written)
+        self._written_bytes += size
+        self.copy_written.emit(written.uid)
+        if (
+            len(self._written) >= _SYNC_BATCH_FILES
+            or self._written_bytes >= _SYNC_BATCH_BYTES
+        ):
+            self.sync_written()
+        else:
+            self._sync_timer.start()
 
-            progress += data_len
-            self.copy_progress.emit(uid, progress, total)
+    @pyqtSlot()
+    def finish(self):
+        # Syncs and verifies the files written so far and stops the thread,
+        # once any copy in progress is over.
+        if self.running:
+            self._finishing = True
+            return
+        self._sync_timer.stop()
+        self.sync_written()
+        self.thread().quit()
 
-            qApp.processEvents()
+    @pyqtSlot()
+    def sync_written(self):
+        # Only ever run between copies, not from the event processing done
+        # while one is in progress.
+        if self.running and self._current_uid is not None:
+            self._sync_timer.start()
+            return
 
-        source_file.close()
-        dest_file.close()
-        if error != FileCopier.NoError:
-            dest_file.remove()
-            self.copy_error.emit(uid, error)
-        else:
-            dest_file.setPermissions(source_file.permissions())
-            self.copy_complete.emit(uid)
+        written, self._written = self._written, []
+        self._written_bytes = 0
+        if not len(written):
+            return
+
+        try:
+            start = clock()
+            sync_files(w.dest_path for w in written)
+            metrics.observe(SYNC, start)
+        except OSError as e:
+            ic(e)
+            for w in written:
+                self.copy_error.emit(w.uid, FileCopier.CannotWriteDestinationFile)
+            return
+
+        library_index = self.library_index
+        for w in written:
+            if w.reread:
+                try:
+                    start = clock()
+                    verified = full_hash(w.dest_path, uncached=True) == w.content_hash
+                    metrics.observe(VERIFY, start)
+                except OSError:
+                    verified = False
+                if not verified:
+                    try:
+                        os.remove(w.dest_path)
+                    except OSError:
+                        pass
+                    self.copy_error.emit(w.uid, FileCopier.VerificationFailed)
+                    continue
+            if library_index is not None:
+                library_index.add(w.dest_path, w.content_hash)
+            if self.journal is not None:
+                self.journal.completed(w.dest_path)
+            if w.source_path is not None:
+                try:
+                    os.remove(w.source_path)
+                except OSError as e:
+                    ic(w.source_path, e)
+                    self.copy_error.emit(w.uid, FileCopier.CannotRemoveSource)
+                    continue
+            self.copy_complete.emit(w.uid)
+
+
+_CopyJob = recordtype(
+    "_CopyJob",
+    [
+        "uid",
+        "source_path",
+        "dest_path",
+        "source_device",
+        "dest_device",
+        ("group", 0),
+        ("queued", 0.0),
+    ],
+)
 
 
 class FileCopier(QObject, CopyError):
     Q_ENUMS(CopyError)
 
-    _add_to_queue = pyqtSignal(
-        str, str, str, arguments=("uid", "source_path", "dest_path")
-    )
-    _remove_from_queue = pyqtSignal(str, arguments=("uid",))
-    _clear_queue = pyqtSignal()
-
     copy_complete = pyqtSignal(str, arguments=("uid",))
     copy_error = pyqtSignal(str, int, arguments=("uid", "error"))
-    copy_progress = pyqtSignal(str, int, int, arguments=("uid", "progress", "total"))
+    copy_progress = pyqtSignal(
+        str, "qint64", "qint64", arguments=("uid", "progress", "total")
+    )
+    # A copy continues an interrupted one from offset bytes into the file;
+    # copy_progress then counts from there.
+    copy_resumed = pyqtSignal(str, "qint64", arguments=("uid", "offset"))
     copy_cancelled = pyqtSignal(str, arguments=("uid",))
-
-    def __init__(self, parent=None, **kwargs):
+    copy_skipped = pyqtSignal(str, str, arguments=("uid", "existing_path"))
+
+    def __init__(
+        self,
+        parent=None,
+        workers: int = 0,
+        per_source_device: int = 0,
+        per_dest_device: int = 0,
+        progress_rate: int = 30,
+        verify: str = VERIFY_OFF,
+        sync: bool = False,
+        move: bool = False,
+        **kwargs,
+    ):
         super().__init__(parent, **kwargs)
 
-        self._thread = QThread()
-        self._worker = _FileCopierWorker(
-            copy_complete=self.copy_complete,
-            copy_error=self.copy_error,
-            copy_progress=self.copy_progress,
-            copy_cancelled=self.copy_cancelled,
-        )
-        self._add_to_queue.connect(self._worker.add_to_queue)
-        self._remove_from_queue.connect(self._worker.remove_from_queue)
-        self._clear_queue.connect(self._worker.clear_queue)
-        self._worker.moveToThread(self._thread)
-        self._thread.start()
+        # A limit of 0 means unlimited (bounded only by the worker count).
+        self._per_source_device = per_source_device
+        self._per_dest_device = per_dest_device
+
+        # Pending jobs are kept in one FIFO lane per (source device,
+        # destination device) pair, plus an index by uid. Cancelling a pending
+        # job only removes it from the index; dispatch skips such entries.
+        self._lanes: Dict[Tuple[int, int], Deque[_CopyJob]] = OrderedDict()
+        self._pending: Dict[str, _CopyJob] = {}
+        self._active: Dict[str, _CopyJob] = {}
+        self._active_workers: Dict[str, _FileCopierWorker] = {}
+        self._idle_workers: List[_FileCopierWorker] = []
+        # Jobs queued on each busy worker, and the devices it counts against
+        # the device limits until it is idle again.
+        self._worker_jobs: Dict[_FileCopierWorker, int] = {}
+        self._worker_lanes: Dict[_FileCopierWorker, Tuple[int, int]] = {}
+        # Members of a group of files are all queued on the worker that
+        # starts the first of them: pending members by group, and the worker
+        # and number of active members of each group in progress.
+        self._pending_groups: Dict[int, List[_CopyJob]] = {}
+        self._group_workers: Dict[int, _FileCopierWorker] = {}
+        self._group_jobs: Dict[int, int] = {}
+        self._source_device_load: Dict[int, int] = {}
+        self._dest_device_load: Dict[int, int] = {}
+        self._devices: Dict[str, int] = {}
+        self._directories = _DirectoryCreator()
+        # Jobs whose data has been written and that are waiting for their
+        # worker to sync or verify them; the worker is free for other jobs.
+        self._verifying: Set[str] = set()
+
+        # Worker threads are only started by the first copy, so that an
+        # application that may never copy does not start them on launch.
+        # Until then the worker settings are kept here.
+        self._worker_count = workers if workers > 0 else default_worker_count()
+        self._progress_interval = 1.0 / progress_rate if progress_rate > 0 else 0.0
+        self._verify = verify
+        self._sync = sync
+        self._move = move
+        self._journal: Union[CopyJournal, None] = None
+        self._library_index: Union[LibraryIndex, None] = None
+        self._workers: List[_FileCopierWorker] = []
+        self._threads: List[QThread] = []
+
+    def _start_workers(self):
+        for _ in range(self._worker_count):
+            thread = QThread()
+            worker = _FileCopierWorker(
+                progress_interval=self._progress_interval,
+                copy_progress=self.copy_progress,
+                copy_resumed=self.copy_resumed,
+            )
+            worker.copy_complete.connect(self._worker_complete)
+            worker.copy_error.connect(self._worker_error)
+            worker.copy_cancelled.connect(self._worker_cancelled)
+            worker.copy_skipped.connect(self._worker_skipped)
+            worker.copy_written.connect(self._worker_written)
+            worker.directories = self._directories
+            worker.verify = self._verify
+            worker.sync = self._sync
+            worker.move = self._move
+            worker.journal = self._journal
+            worker.library_index = self._library_index
+            worker.moveToThread(thread)
+            thread.start()
+            self._threads.append(thread)
+            self._workers.append(worker)
+            self._idle_workers.append(worker)
+
+    def shutdown(self):
+        # Each worker stops its own thread once it has finished the copy in
+        # progress and synced the files waiting for it.
+        for worker in self._workers:
+            QMetaObject.invokeMethod(worker, "finish", Qt.QueuedConnection)
+        for thread in self._threads:
+            thread.wait()
 
     @staticmethod
     def new_uid():
         return str(uuid.uuid4())
 
-    def copy_file(self, source_path: str, dest_path: str) -> str:
+    def set_device_limits(self, per_source_device: int, per_dest_device: int):
+        self._per_source_device = per_source_device
+        self._per_dest_device = per_dest_device
+        self._dispatch()
+
+    def set_verification(self, verify: str, sync: bool):
+        # verify is one of VERIFY_OFF, VERIFY_CHECKSUM or VERIFY_REREAD; with
+        # sync, files are only reported complete once flushed to the device.
+        # Applies to copies started after the call.
+        self._verify = verify
+        self._sync = sync
+        for worker in self._workers:
+            worker.verify = verify
+            worker.sync = sync
+
+    def set_move(self, move: bool):
+        # When set, files are moved rather than copied: renamed within a
+        # filesystem, otherwise copied, synced and verified, then removed.
+        # Failing to remove a source is reported as CannotRemoveSource.
+        self._move = move
+        for worker in self._workers:
+            worker.move = move
+
+    def set_journal(self, journal: Union[CopyJournal, None]):
+        # When set, copies are recorded in the journal and partly written
+        # files are kept on cancellation so that they can be resumed.
+        self._journal = journal
+        for worker in self._workers:
+            worker.journal = journal
+
+    def set_library_index(self, library_index: Union[LibraryIndex, None]):
+        # When set, files already present in the library are skipped and
+        # reported through copy_skipped instead of being copied.
+        self._library_index = library_index
+        for worker in self._workers:
+            worker.library_index = library_index
+
+    def copy_file(self, source_path: str, dest_path: str, group: int = 0) -> str:
+        # Files sharing a non-zero group, such as a RAW file, its JPEG and
+        # their sidecar, are scheduled as one unit: copied one after another
+        # by the same worker, and cancelled together.
+        if not len(self._workers):
+            self._start_workers()
         uid = FileCopier.new_uid()
-        self._add_to_queue.emit(uid, source_path, dest_path)
+        dest_dir = osp.dirname(osp.abspath(dest_path))
+        job = _CopyJob(
+            uid,
+            source_path,
+            dest_path,
+            self._device(osp.dirname(source_path)),
+            self._device(dest_dir),
+            group,
+            clock(),
+        )
+
+        worker = self._group_workers.get(group) if group else None
+        if worker is not None:
+            self._assign(job, worker)
+            return uid
+
+        lane = (job.source_device, job.dest_device)
+        if lane not in self._lanes:
+            self._lanes[lane] = deque()
+        self._lanes[lane].append(job)
+        self._pending[uid] = job
+        if group:
+            self._pending_groups.setdefault(group, []).append(job)
+        self._dispatch()
         return uid
 
     def copy_files(self, source_path_list: List[str], dest_path: str) -> List[str]:
@@ -202,3 +779,188 @@ class FileCopier(QObject, CopyError):
         for source_path in source_path_list:
             uid_list.append(self.copy_file(source_path, dest_path))
         return uid_list
+
+    def cancel_copy(self, uid: str):
+        job = self._active.get(uid) or self._pending.get(uid)
+        if job is None:
+            return
+        if not job.group:
+            self._cancel(uid)
+            return
+
+        members = [j.uid for j in self._active.values() if j.group == job.group]
+        members += [j.uid for j in self._pending_groups.pop(job.group, [])]
+        for member in members:
+            self._cancel(member)
+
+    def _cancel(self, uid: str):
+        if uid in self._active_workers:
+            QMetaObject.invokeMethod(
+                self._active_workers[uid],
+                "remove_from_queue",
+                Qt.QueuedConnection,
+                Q_ARG(str, uid),
+            )
+            return
+
+        if self._pending.pop(uid, None) is not None:
+            self.copy_cancelled.emit(uid)
+
+    def cancel_all(self):
+        pending, self._pending = self._pending, {}
+        self._lanes.clear()
+        self._pending_groups.clear()
+        for uid in pending:
+            self.copy_cancelled.emit(uid)
+        for worker in self._active_workers.values():
+            QMetaObject.invokeMethod(worker, "clear_queue", Qt.QueuedConnection)
+
+    def _device(self, directory: str) -> int:
+        # Destination directories may not exist yet, so use the device of the
+        # nearest existing ancestor. Cached per directory as a shoot shares a
+        # handful of them.
+        device = self._devices.get(directory)
+        if device is not None:
+            return device
+
+        path = directory
+        while True:
+            try:
+                device = os.stat(path).st_dev
+                break
+            except OSError:
+                parent = osp.dirname(path)
+                if parent == path:
+                    device = -1
+                    break
+                path = parent
+
+        self._devices[directory] = device
+        return device
+
+    def _can_start(self, source_device: int, dest_device: int) -> bool:
+        if (
+            self._per_source_device > 0
+            and self._source_device_load.get(source_device, 0)
+            >= self._per_source_device
+        ):
+            return False
+        if (
+            self._per_dest_device > 0
+            and self._dest_device_load.get(dest_device, 0) >= self._per_dest_device
+        ):
+            return False
+        return True
+
+    def _next_job(self) -> Union[_CopyJob, None]:
+        for lane, jobs in list(self._lanes.items()):
+            while len(jobs) and jobs[0].uid not in self._pending:
+                jobs.popleft()
+            if not len(jobs):
+                del self._lanes[lane]
+                continue
+            if not self._can_start(*lane):
+                continue
+
+            # Rotate the lane to the back so devices are served round-robin.
+            self._lanes.move_to_end(lane)
+            job = jobs.popleft()
+            del self._pending[job.uid]
+            return job
+        return None
+
+    def _dispatch(self):
+        while len(self._idle_workers) and len(self._pending):
+            job = self._next_job()
+            if job is None:
+                break
+
+            worker = self._idle_workers.pop()
+            self._assign(job, worker)
+            # The rest of the group follows on the same worker.
+            for member in self._pending_groups.pop(job.group, []) if job.group else []:
+                if self._pending.pop(member.uid, None) is not None:
+                    self._assign(member, worker)
+
+    def _assign(self, job: _CopyJob, worker: _FileCopierWorker):
+        self._active[job.uid] = job
+        self._active_workers[job.uid] = worker
+        if job.group:
+            self._group_workers[job.group] = worker
+            self._group_jobs[job.group] = self._group_jobs.get(job.group, 0) + 1
+
+        # A worker copies one file at a time, so it counts once against the
+        # device limits however many jobs it has queued.
+        jobs = self._worker_jobs.get(worker, 0)
+        self._worker_jobs[worker] = jobs + 1
+        if not jobs:
+            self._worker_lanes[worker] = (job.source_device, job.dest_device)
+            self._source_device_load[job.source_device] = (
+                self._source_device_load.get(job.source_device, 0) + 1
+            )
+            self._dest_device_load[job.dest_device] = (
+                self._dest_device_load.get(job.dest_device, 0) + 1
+            )
+
+        QMetaObject.invokeMethod(
+            worker,
+            "add_to_queue",
+            Qt.QueuedConnection,
+            Q_ARG(str, job.uid),
+            Q_ARG(str, job.source_path),
+            Q_ARG(str, job.dest_path),
+            Q_ARG(float, job.queued),
+        )
+
+    def _job_finished(self, uid: str):
+        job = self._active.pop(uid)
+        worker = self._active_workers.pop(uid)
+        if job.group:
+            self._group_jobs[job.group] -= 1
+            if not self._group_jobs[job.group]:
+                del self._group_jobs[job.group]
+                del self._group_workers[job.group]
+
+        self._worker_jobs[worker] -= 1
+        if not self._worker_jobs[worker]:
+            del self._worker_jobs[worker]
+            source_device, dest_device = self._worker_lanes.pop(worker)
+            self._source_device_load[source_device] -= 1
+            self._dest_device_load[dest_device] -= 1
+            self._idle_workers.append(worker)
+
+    @pyqtSlot(str)
+    def _worker_written(self, uid: str):
+        self._job_finished(uid)
+        self._verifying.add(uid)
+        self._dispatch()
+
+    @pyqtSlot(str)
+    def _worker_complete(self, uid: str):
+        if uid in self._verifying:
+            self._verifying.remove(uid)
+        else:
+            self._job_finished(uid)
+        self.copy_complete.emit(uid)
+        self._dispatch()
+
+    @pyqtSlot(str, int)
+    def _worker_error(self, uid: str, error: int):
+        if uid in self._verifying:
+            self._verifying.remove(uid)
+        else:
+            self._job_finished(uid)
+        self.copy_error.emit(uid, error)
+        self._dispatch()
+
+    @pyqtSlot(str)
+    def _worker_cancelled(self, uid: str):
+        self._job_finished(uid)
+        self.copy_cancelled.emit(uid)
+        self._dispatch()
+
+    @pyqtSlot(str, str)
+    def _worker_skipped(self, uid: str, existing_path: str):
+        self._job_finished(uid)
+        self.copy_skipped.emit(uid, existing_path)
+        self._dispatch()
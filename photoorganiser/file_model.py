@@ -1,35 +1,491 @@
-from typing import Any, List
+import os.path as osp
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple, Union
 from recordtype import recordtype
 
 from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
 
+from photoorganiser.file_search import Query, matches, search
+
 FileModelRecord = recordtype(
-    "FileModelRecord", ["file_name", "full_path", "dest_path", ("copy", True)]
+    "FileModelRecord",
+    [
+        "file_name",
+        "full_path",
+        "dest_path",
+        ("copy", True),
+        ("size", 0),
+        ("camera_model", ""),
+        ("date_time_original", ""),
+        ("lens_model", ""),
+        ("group", 0),
+    ],
 )
 
 
+def date_key(date_time_original: str) -> int:
+    # EXIF "YYYY:MM:DD HH:MM:SS" packed into the integer YYYYMMDDHHMMSS, which
+    # orders the same way as the dates do.
+    digits = date_time_original.replace(":", "").replace(" ", "")
+    return int(digits) if digits.isdigit() else 0
+
+
+def _datetime_key(value: datetime) -> int:
+    return int(value.strftime("%Y%m%d%H%M%S"))
+
+
+def _date_from_key(key: int) -> str:
+    if not key:
+        return ""
+    digits = f"{key:014d}"
+    return (
+        f"{digits[0:4]}:{digits[4:6]}:{digits[6:8]} "
+        f"{digits[8:10]}:{digits[10:12]}:{digits[12:14]}"
+    )
+
+
+class _InternedColumn(object):
+    # Column of strings with few distinct values, such as directories. Each
+    # row holds a 32 bit index into a table of the distinct values. Indexed
+    # columns also keep the rows holding each value, so lookups by value do
+    # not scan every row.
+    def __init__(self, indexed: bool = False):
+        self._values: List[str] = []
+        self._index: Dict[str, int] = {}
+        self._rows = array("I")
+        self._postings: Union[List[array], None] = [] if indexed else None
+
+    def __getitem__(self, row: int) -> str:
+        return self._values[self._rows[row]]
+
+    def values(self) -> List[str]:
+        return self._values
+
+    def rows_with(self, values: Iterable[str]) -> Iterator[int]:
+        indexes = {self._index[v] for v in values if v in self._index}
+        if not len(indexes):
+            return
+        if self._postings is not None:
+            for index in indexes:
+                yield from self._postings[index]
+            return
+        for row, index in enumerate(self._rows):
+            if index in indexes:
+                yield row
+
+    def ranks(self) -> List[int]:
+        # Position of each distinct value in sorted order, by value index.
+        ranks = [0] * len(self._values)
+        order = sorted(range(len(self._values)), key=self._values.__getitem__)
+        for rank, index in enumerate(order):
+            ranks[index] = rank
+        return ranks
+
+    def row_indexes(self) -> array:
+        return self._rows
+
+    def append(self, value: str):
+        index = self._index.get(value)
+        if index is None:
+            index = self._index[value] = len(self._values)
+            self._values.append(value)
+            if self._postings is not None:
+                self._postings.append(array("I"))
+        if self._postings is not None:
+            self._postings[index].append(len(self._rows))
+        self._rows.append(index)
+
+    def extend(self, values: Iterable[str]):
+        if self._postings is not None:
+            for value in values:
+                self.append(value)
+            return
+        index, distinct = self._index, self._values
+        indexes = []
+        for value in values:
+            i = index.get(value)
+            if i is None:
+                i = index[value] = len(distinct)
+                distinct.append(value)
+            indexes.append(i)
+        self._rows.extend(indexes)
+
+    def clear(self):
+        self.__init__(self._postings is not None)
+
+
+class _StringColumn(object):
+    # Column of mostly distinct strings, stored UTF-8 encoded back to back in
+    # a single buffer rather than as one Python object per row.
+    def __init__(self):
+        self._buffer = bytearray()
+        self._offsets = array("Q", [0])
+        self._folded: Union[bytearray, None] = None
+
+    def __getitem__(self, row: int) -> str:
+        return self._buffer[self._offsets[row] : self._offsets[row + 1]].decode(
+            errors="surrogateescape"
+        )
+
+    def values(self) -> List[str]:
+        buffer, offsets = self._buffer, self._offsets
+        return [
+            buffer[offsets[row] : offsets[row + 1]].decode(errors="surrogateescape")
+            for row in range(len(offsets) - 1)
+        ]
+
+    def rows_containing(self, text: str) -> Iterator[int]:
+        # Searches the whole buffer at once rather than row by row, ignoring
+        # ASCII case. Matches spanning two values are discarded and the search
+        # resumes at the start of the next value, so each row is reported once.
+        if self._folded is None:
+            self._folded = self._buffer.lower()
+        needle = text.encode(errors="surrogateescape").lower()
+        offsets = self._offsets
+        position = self._folded.find(needle)
+        while position >= 0:
+            row = bisect_right(offsets, position) - 1
+            if position + len(needle) <= offsets[row + 1]:
+                yield row
+            position = self._folded.find(needle, offsets[row + 1])
+
+    def append(self, value: str):
+        self._buffer += value.encode(errors="surrogateescape")
+        self._offsets.append(len(self._buffer))
+        self._folded = None
+
+    def clear(self):
+        self.__init__()
+
+
+class RecordStore(object):
+    """
+    Compact, array backed storage for the files found by a scan. Records are
+    split into columns on the way in and FileModelRecords are only built on
+    demand, so a million rows cost tens rather than hundreds of megabytes.
+    """
+
+    SORT_KEYS = (
+        "file_name",
+        "date_time_original",
+        "camera_model",
+        "full_path",
+        "dest_path",
+    )
+
+    def __init__(self):
+        self._file_names = _StringColumn()
+        self._source_directories = _InternedColumn(indexed=True)
+        self._dest_directories = _InternedColumn()
+        # Destination file names only need storing where they differ from the
+        # source file name, which is rare.
+        self._dest_names: Dict[int, str] = {}
+        self._sizes = array("Q")
+        self._camera_models = _InternedColumn(indexed=True)
+        self._lens_models = _InternedColumn()
+        self._extensions = _InternedColumn(indexed=True)
+        self._dates = array("Q")
+        # Files scanned together, such as a RAW file, its JPEG and sidecars,
+        # share a non-zero group.
+        self._groups = array("I")
+        self._copy = bytearray()
+        self._count = 0
+
+        # Row orders by sort key, built on first use and dropped whenever rows
+        # are added.
+        self._sort_orders: Dict[str, array] = {}
+        self._sorted_dates: Union[array, None] = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def clear(self):
+        self.__init__()
+
+    def append(self, record: FileModelRecord):
+        row = self._count
+        self._file_names.append(record.file_name)
+        self._source_directories.append(osp.dirname(record.full_path))
+        dest_directory, dest_name = osp.split(record.dest_path)
+        self._dest_directories.append(dest_directory)
+        if dest_name != record.file_name:
+            self._dest_names[row] = dest_name
+        self._sizes.append(record.size)
+        self._camera_models.append(record.camera_model)
+        self._lens_models.append(record.lens_model)
+        self._extensions.append(osp.splitext(record.file_name)[1][1:].lower())
+        self._dates.append(date_key(record.date_time_original))
+        self._groups.append(record.group)
+        if row % 8 == 0:
+            self._copy.append(0)
+        self._count += 1
+        self.set_copy(row, record.copy)
+
+        if len(self._sort_orders) or self._sorted_dates is not None:
+            self._sort_orders = {}
+            self._sorted_dates = None
+
+    def extend(self, records: Iterable[FileModelRecord]):
+        for record in records:
+            self.append(record)
+
+    def file_name(self, row: int) -> str:
+        return self._file_names[row]
+
+    def source_directory(self, row: int) -> str:
+        return self._source_directories[row]
+
+    def full_path(self, row: int) -> str:
+        return osp.join(self._source_directories[row], self._file_names[row])
+
+    def dest_path(self, row: int) -> str:
+        name = self._dest_names.get(row)
+        if name is None:
+            name = self._file_names[row]
+        return osp.join(self._dest_directories[row], name)
+
+    def size(self, row: int) -> int:
+        return self._sizes[row]
+
+    def camera_model(self, row: int) -> str:
+        return self._camera_models[row]
+
+    def lens_model(self, row: int) -> str:
+        return self._lens_models[row]
+
+    def group(self, row: int) -> int:
+        return self._groups[row]
+
+    def extension(self, row: int) -> str:
+        return self._extensions[row]
+
+    def date_time_original(self, row: int) -> str:
+        return _date_from_key(self._dates[row])
+
+    def date_in_range(self, row: int, start: datetime, end: datetime) -> bool:
+        return _datetime_key(start) <= self._dates[row] <= _datetime_key(end)
+
+    def filter_date_range(
+        self, rows: Iterable[int], start: datetime, end: datetime
+    ) -> Iterator[int]:
+        start_key, end_key = _datetime_key(start), _datetime_key(end)
+        dates = self._dates
+        return (row for row in rows if start_key <= dates[row] <= end_key)
+
+    def copy(self, row: int) -> bool:
+        return bool(self._copy[row >> 3] & (1 << (row & 7)))
+
+    def set_copy(self, row: int, copy: bool):
+        if copy:
+            self._copy[row >> 3] |= 1 << (row & 7)
+        else:
+            self._copy[row >> 3] &= ~(1 << (row & 7)) & 0xFF
+
+    def set_copy_all(self, copy: bool):
+        self._copy = bytearray(b"\xff" if copy else b"\x00") * len(self._copy)
+
+    def set_copy_rows(self, rows: Iterable[int], copy: bool) -> Union[range, None]:
+        """
+        Set the copy flag of every row in rows and return the range of rows
+        spanned, or None if rows is empty.
+        """
+        first = last = None
+        for row in rows:
+            self.set_copy(row, copy)
+            if first is None or row < first:
+                first = row
+            if last is None or row > last:
+                last = row
+        if first is None:
+            return None
+        return range(first, last + 1)
+
+    def camera_models(self) -> List[str]:
+        return self._camera_models.values()
+
+    def source_directories(self) -> List[str]:
+        return self._source_directories.values()
+
+    def rows_with_camera_models(self, camera_models: Iterable[str]) -> Iterator[int]:
+        return self._camera_models.rows_with(camera_models)
+
+    def rows_with_extensions(self, extensions: Iterable[str]) -> Iterator[int]:
+        return self._extensions.rows_with(e.lstrip(".").lower() for e in extensions)
+
+    def rows_in_source_directories(self, directories: Iterable[str]) -> Iterator[int]:
+        return self._source_directories.rows_with(directories)
+
+    def rows_with_name_containing(self, text: str) -> Iterator[int]:
+        return self._file_names.rows_containing(text)
+
+    def rows_in_date_range(self, start: datetime, end: datetime) -> Iterator[int]:
+        order = self.sort_order("date_time_original")
+        if self._sorted_dates is None:
+            self._sorted_dates = array("Q", (self._dates[row] for row in order))
+        first = bisect_left(self._sorted_dates, _datetime_key(start))
+        last = bisect_right(self._sorted_dates, _datetime_key(end))
+        return iter(order[first:last])
+
+    def sort_order(self, key: str) -> array:
+        """
+        Return the rows ordered by key, one of SORT_KEYS. Orders are computed
+        once and reused until rows are added.
+        """
+        order = self._sort_orders.get(key)
+        if order is not None:
+            return order
+
+        if key == "file_name":
+            names = [self._file_names[row] for row in range(self._count)]
+            rows = sorted(range(self._count), key=names.__getitem__)
+        elif key == "date_time_original":
+            rows = sorted(range(self._count), key=self._dates.__getitem__)
+        elif key == "camera_model":
+            rows = self._sorted_by_interned(self._camera_models)
+        elif key == "full_path":
+            rows = self._sorted_by_interned(self._source_directories)
+        elif key == "dest_path" and not len(self._dest_names):
+            rows = self._sorted_by_interned(self._dest_directories)
+        elif key == "dest_path":
+            paths = [self.dest_path(row) for row in range(self._count)]
+            rows = sorted(range(self._count), key=paths.__getitem__)
+        else:
+            raise ValueError(key)
+
+        order = self._sort_orders[key] = array("I", rows)
+        return order
+
+    def _sorted_by_interned(self, column: _InternedColumn) -> List[int]:
+        # Sorting by file name first and then, stably, by the rank of the
+        # interned value orders rows by value then name without building a
+        # key string per row.
+        ranks = column.ranks()
+        indexes = column.row_indexes()
+        return sorted(self.sort_order("file_name"), key=lambda row: ranks[indexes[row]])
+
+    def template_inputs(
+        self,
+    ) -> Tuple[List[str], array, Tuple[List[str], array], Tuple[List[str], array]]:
+        # File names and date keys of every row, in row order, and the
+        # distinct camera and lens models with the index of each row's value,
+        # for rendering destination templates a whole column at a time.
+        return (
+            self._file_names.values(),
+            self._dates,
+            (self._camera_models.values(), self._camera_models.row_indexes()),
+            (self._lens_models.values(), self._lens_models.row_indexes()),
+        )
+
+    def set_dest_paths(
+        self, dest_directories: Iterable[str], dest_names: Dict[int, str]
+    ):
+        # Replaces the destination directory of every row, in row order.
+        # dest_names holds the rows whose destination file name differs from
+        # the source's.
+        self._dest_directories.clear()
+        self._dest_directories.extend(dest_directories)
+        self._dest_names = dest_names
+        self._sort_orders.pop("dest_path", None)
+
+    def record(self, row: int) -> FileModelRecord:
+        return FileModelRecord(
+            self.file_name(row),
+            self.full_path(row),
+            self.dest_path(row),
+            self.copy(row),
+            self.size(row),
+            self.camera_model(row),
+            self.date_time_original(row),
+            self.lens_model(row),
+            self.group(row),
+        )
+
+    def records(self) -> Iterator[FileModelRecord]:
+        for row in range(self._count):
+            yield self.record(row)
+
+    def checked_records(self) -> Iterator[FileModelRecord]:
+        for row in range(self._count):
+            if self.copy(row):
+                yield self.record(row)
+
+
 class FileModel(QAbstractTableModel):
     def __init__(self, parent=None, **kwargs):
         super().__init__(parent, **kwargs)
 
-        self._data: List[FileModelRecord] = []
-        self._headers = ("File Name", "Source Path", "Destination Path")
+        self._data = RecordStore()
+        self._headers = (
+            "File Name",
+            "Date Taken",
+            "Camera",
+            "Source Path",
+            "Destination Path",
+        )
+
+        # While sorted or filtered, _rows maps view rows to store rows.
+        self._rows: Union[array, None] = None
+        self._sort_column: int = -1
+        self._sort_order: Qt.SortOrder = Qt.AscendingOrder
+        self._query: Union[Query, None] = None
+        self._thumbnail_loader = None
+
+    def set_thumbnail_loader(self, thumbnail_loader):
+        # A ThumbnailLoader providing the decoration of the File Name column,
+        # or None for no thumbnails.
+        if self._thumbnail_loader is not None:
+            self._thumbnail_loader.thumbnails_updated.disconnect(
+                self._thumbnails_updated
+            )
+        self._thumbnail_loader = thumbnail_loader
+        if thumbnail_loader is not None:
+            thumbnail_loader.thumbnails_updated.connect(self._thumbnails_updated)
+        self._thumbnails_updated()
+
+    def _thumbnails_updated(self):
+        # Views only repaint the part of a changed range that is visible.
+        if self.rowCount():
+            self.dataChanged.emit(
+                self.index(0, 0),
+                self.index(self.rowCount() - 1, 0),
+                [Qt.DecorationRole],
+            )
+
+    def store_row(self, row: int) -> int:
+        # Row of file_data() shown at the given row of the model.
+        if self._rows is None:
+            return row
+        return self._rows[row]
+
+    def _row(self, index: QModelIndex) -> int:
+        return self.store_row(index.row())
 
     def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
         return len(self._headers)
 
     def data(self, index: QModelIndex, role: int = Qt.DisplayRole) -> Any:
         column = index.column()
-        data = self._data[index.row()]
+        row = self._row(index)
         if role == Qt.DisplayRole:
             if column == 0:
-                return data.file_name
+                return self._data.file_name(row)
             elif column == 1:
-                return data.full_path
+                return self._data.date_time_original(row).replace(":", "-", 2)
             elif column == 2:
-                return data.dest_path
+                return self._data.camera_model(row)
+            elif column == 3:
+                return self._data.full_path(row)
+            elif column == 4:
+                return self._data.dest_path(row)
         if role == Qt.CheckStateRole and column == 0:
-            return Qt.Checked if data.copy else Qt.Unchecked
+            return Qt.Checked if self._data.copy(row) else Qt.Unchecked
+        if role == Qt.DecorationRole and column == 0:
+            # Only rows being painted ask for their thumbnails, which makes
+            # the visible rows the ones loaded first.
+            if self._thumbnail_loader is not None:
+                return self._thumbnail_loader.thumbnail(self._data.full_path(row))
         return None
 
     def headerData(
@@ -46,19 +502,124 @@ class FileModel(QAbstractTableModel):
         return flags
 
     def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
-        return len(self._data)
+        if self._rows is None:
+            return len(self._data)
+        return len(self._rows)
 
     def setData(self, index: QModelIndex, value: Any, role: int = Qt.EditRole) -> bool:
         if index.column() == 0 and role == Qt.CheckStateRole:
-            self._data[index.row()].copy = value == Qt.Checked
+            self._data.set_copy(self._row(index), value == Qt.Checked)
             self.dataChanged.emit(index, index)
             return True
         return super().setData(index, value, role)
 
-    def file_data(self) -> List[FileModelRecord]:
+    def sort(self, column: int, order: Qt.SortOrder = Qt.AscendingOrder):
+        self._sort_column = column
+        self._sort_order = order
+        self.beginResetModel()
+        self._update_rows()
+        self.endResetModel()
+
+    def set_filter(self, query: Union[Query, None]):
+        # Show only the rows matching query, or every row if query is None.
+        self._query = query
+        self.beginResetModel()
+        self._update_rows()
+        self.endResetModel()
+
+    def refresh(self):
+        # Rows appended while sorted are added at the end; this puts them in
+        # their sorted place.
+        if self._rows is not None:
+            self.sort(self._sort_column, self._sort_order)
+
+    def dest_paths_changed(self):
+        # Call once the destination paths in file_data() have been replanned.
+        if self._sort_column == self._headers.index("Destination Path"):
+            self.refresh()
+        elif self.rowCount():
+            column = self._headers.index("Destination Path")
+            self.dataChanged.emit(
+                self.index(0, column), self.index(self.rowCount() - 1, column)
+            )
+
+    def _update_rows(self):
+        order: Union[array, None] = None
+        if 0 <= self._sort_column < len(RecordStore.SORT_KEYS):
+            order = self._data.sort_order(RecordStore.SORT_KEYS[self._sort_column])
+            # Copied, as rows streamed in while sorted are appended to _rows.
+            order = order[::-1] if self._sort_order == Qt.DescendingOrder else order[:]
+
+        if self._query is None:
+            self._rows = order
+            return
+
+        found: Set[int] = search(self._data, self._query)
+        if order is None:
+            self._rows = array("I", sorted(found))
+        elif len(found) == len(self._data):
+            self._rows = order
+        else:
+            self._rows = array("I", (row for row in order if row in found))
+
+    def _copy_changed(self, rows: Union[range, None]):
+        if rows is None or not len(rows) or not self.rowCount():
+            return
+        if self._rows is not None:
+            rows = range(self.rowCount())
+        self.dataChanged.emit(
+            self.index(rows[0], 0), self.index(rows[-1], 0), [Qt.CheckStateRole]
+        )
+
+    def check_all(self, checked: bool):
+        self._data.set_copy_all(checked)
+        self._copy_changed(range(len(self._data)))
+
+    def check_camera_models(self, camera_models: Iterable[str], checked: bool):
+        rows = self._data.rows_with_camera_models(camera_models)
+        self._copy_changed(self._data.set_copy_rows(rows, checked))
+
+    def check_extensions(self, extensions: Iterable[str], checked: bool):
+        rows = self._data.rows_with_extensions(extensions)
+        self._copy_changed(self._data.set_copy_rows(rows, checked))
+
+    def check_date_range(self, start: datetime, end: datetime, checked: bool):
+        rows = self._data.rows_in_date_range(start, end)
+        self._copy_changed(self._data.set_copy_rows(rows, checked))
+
+    def file_data(self) -> RecordStore:
         return self._data
 
-    def set_file_data(self, data: List[FileModelRecord]):
+    def set_file_data(self, data: Iterable[FileModelRecord]):
         self.beginResetModel()
-        self._data = data
+        self._data.clear()
+        self._data.extend(data)
+        self._update_rows()
         self.endResetModel()
+
+    def append_file_data(self, data: List[FileModelRecord]):
+        if not len(data):
+            return
+        if self._rows is None:
+            first = len(self._data)
+            self.beginInsertRows(QModelIndex(), first, first + len(data) - 1)
+            self._data.extend(data)
+            self.endInsertRows()
+            return
+
+        first = len(self._data)
+        self._data.extend(data)
+        new_rows = [
+            row
+            for row in range(first, len(self._data))
+            if self._query is None or matches(self._data, self._query, row)
+        ]
+        if not len(new_rows):
+            return
+        first = len(self._rows)
+        self.beginInsertRows(QModelIndex(), first, first + len(new_rows) - 1)
+        self._rows.extend(new_rows)
+        self.endInsertRows()
+
+    def clear(self):
+        self.set_file_data([])
@@ -0,0 +1,683 @@
+import os
+import os.path as osp
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, Future
+from typing import FrozenSet, Iterable, List, Set, Union, Dict, Iterator, Tuple
+
+from PyQt5.QtCore import (
+    QObject,
+    QThread,
+    pyqtProperty,
+    pyqtSignal,
+    pyqtSlot,
+    QFileSystemWatcher,
+)
+from recordtype import recordtype
+
+from photoorganiser.consts import PROBED_SUFFIXES, SIDECAR_SUFFIXES, format_suffixes
+from photoorganiser.dest_template import DEFAULT_TEMPLATE, DestinationTemplate
+from photoorganiser.file_model import FileModelRecord
+from photoorganiser.exif_reader import has_image_header
+from photoorganiser.metadata import read_metadata
+from photoorganiser.metadata_cache import MetadataCache, CacheEntry, DirectorySnapshot
+from photoorganiser.metrics import EXIF_PARSE, STAT, WALK, clock, metrics
+
+try:
+    from icecream import ic
+except ImportError:
+
+    def ic(*args, **kwargs):
+        pass
+
+
+_BATCH_SIZE = 256
+_BATCH_INTERVAL = 0.1
+_PENDING_PER_WORKER = 4
+_JPEG_SUFFIXES = frozenset({".jpg", ".jpeg", ".jpe"})
+
+
+def default_worker_count() -> int:
+    # Metadata extraction is dominated by I/O latency (especially on network
+    # shares) so oversubscribe the cores.
+    return min(32, (os.cpu_count() or 1) * 4)
+
+
+_ScanResult = recordtype(
+    "_ScanResult",
+    ["root", "full_path", "record", "cache_entry", "cache_hit", ("skipped", False)],
+)
+
+
+def _suffix(file_name: str) -> str:
+    # Lower case extension, dot included, or "" for a file name without one.
+    dot = file_name.rfind(".")
+    return file_name[dot:].lower() if dot >= 0 else ""
+
+
+def _matching(file_names: Iterable[str], suffixes: FrozenSet[str]) -> List[str]:
+    # The names in one directory listing with one of the given suffixes: a
+    # set lookup per name rather than a regular expression. _suffix() is
+    # inlined; names without a dot look up their last character, which never
+    # matches.
+    return [name for name in file_names if name[name.rfind(".") :].lower() in suffixes]
+
+
+def _group_files(
+    file_names: Iterable[str], suffixes: FrozenSet[str]
+) -> List[List[str]]:
+    # The matching names in one directory listing grouped by stem, such as a
+    # RAW file and the JPEG shot with it, with any sidecars after the images.
+    # Sidecars without an image are dropped.
+    groups: Dict[str, List[str]] = {}
+    sidecars: List[str] = []
+    for name in _matching(file_names, suffixes | SIDECAR_SUFFIXES):
+        dot = name.rfind(".")
+        if name[dot:].lower() in SIDECAR_SUFFIXES:
+            sidecars.append(name)
+        else:
+            groups.setdefault(name[:dot], []).append(name)
+    for name in sidecars:
+        stem = name[: name.rfind(".")]
+        group = groups.get(stem) or groups.get(osp.splitext(stem)[0])
+        if group is not None:
+            group.append(name)
+    return list(groups.values())
+
+
+def _read_order(file_name: str) -> int:
+    # JPEGs are read first within a group: their EXIF block is at the start
+    # of the file and every reader understands them.
+    return 0 if _suffix(file_name) in _JPEG_SUFFIXES else 1
+
+
+def _scan_file(
+    root: str, file_name: str, cached: Union[CacheEntry, None]
+) -> _ScanResult:
+    full_path: str = osp.join(root, file_name)
+    result = _ScanResult(root, full_path, None, None, False)
+    try:
+        start = clock()
+        stat = os.stat(full_path)
+        metrics.observe(STAT, start)
+        if cached is not None and MetadataCache.is_valid(
+            cached, stat.st_size, stat.st_mtime_ns
+        ):
+            result.record = FileModelRecord(
+                file_name,
+                full_path,
+                "",
+                size=stat.st_size,
+                camera_model=cached.camera_model,
+                date_time_original=cached.date_time_original,
+                lens_model=cached.lens_model,
+            )
+            result.cache_hit = True
+            return result
+
+        # Files with generic extensions such as .raw that are not images are
+        # skipped rather than reported as errors.
+        if _suffix(file_name) in PROBED_SUFFIXES and not has_image_header(full_path):
+            result.skipped = True
+            return result
+
+        start = clock()
+        metadata = read_metadata(full_path)
+        metrics.observe(EXIF_PARSE, start)
+    except Exception as e:
+        ic(full_path, e)
+        metadata = None
+
+    if metadata is None:
+        return result
+
+    result.cache_entry = MetadataCache.new_entry(
+        file_name, stat.st_size, stat.st_mtime_ns, metadata
+    )
+    result.record = FileModelRecord(
+        file_name,
+        full_path,
+        "",
+        size=stat.st_size,
+        camera_model=metadata.camera_model,
+        date_time_original=result.cache_entry.date_time_original,
+        lens_model=metadata.lens_model,
+    )
+    return result
+
+
+def _shared_result(
+    root: str,
+    file_name: str,
+    cached: Union[CacheEntry, None],
+    source: Union[FileModelRecord, None],
+) -> _ScanResult:
+    # A group member given the metadata of source, read from another member.
+    full_path: str = osp.join(root, file_name)
+    result = _ScanResult(root, full_path, None, None, False)
+    if source is None:
+        # Only sidecars are left without a source, once every image in the
+        # group has failed.
+        result.skipped = True
+        return result
+    try:
+        start = clock()
+        stat = os.stat(full_path)
+        metrics.observe(STAT, start)
+    except OSError as e:
+        ic(full_path, e)
+        return result
+
+    result.cache_hit = cached is not None and MetadataCache.is_valid(
+        cached, stat.st_size, stat.st_mtime_ns
+    )
+    if not result.cache_hit:
+        result.cache_entry = CacheEntry(
+            file_name,
+            stat.st_size,
+            stat.st_mtime_ns,
+            source.date_time_original,
+            source.camera_model,
+            source.lens_model,
+        )
+    result.record = FileModelRecord(
+        file_name,
+        full_path,
+        "",
+        size=stat.st_size,
+        camera_model=source.camera_model,
+        date_time_original=source.date_time_original,
+        lens_model=source.lens_model,
+    )
+    return result
+
+
+def _scan_group(
+    root: str,
+    file_names: List[str],
+    cached: List[Union[CacheEntry, None]],
+    group: int,
+) -> List[_ScanResult]:
+    # Metadata is read from the first image in the group that has any and
+    # shared with the other members, so a RAW+JPEG pair is parsed once.
+    results: List[Union[_ScanResult, None]] = [None] * len(file_names)
+    images = [
+        i for i, name in enumerate(file_names) if _suffix(name) not in SIDECAR_SUFFIXES
+    ]
+    source = None
+    for i in sorted(images, key=lambda i: _read_order(file_names[i])):
+        results[i] = _scan_file(root, file_names[i], cached[i])
+        source = results[i].record
+        if source is not None:
+            break
+
+    for i, file_name in enumerate(file_names):
+        if results[i] is None:
+            results[i] = _shared_result(root, file_name, cached[i], source)
+        if results[i].record is not None:
+            results[i].record.group = group
+    return results
+
+
+def _cached_result(
+    root: str, file_name: str, cached: CacheEntry, group: int
+) -> _ScanResult:
+    full_path: str = osp.join(root, file_name)
+    record = FileModelRecord(
+        file_name,
+        full_path,
+        "",
+        size=cached.size,
+        camera_model=cached.camera_model,
+        date_time_original=cached.date_time_original,
+        lens_model=cached.lens_model,
+        group=group,
+    )
+    return _ScanResult(root, full_path, record, None, True)
+
+
+def _list_directory(directory: str, mtime_ns: int) -> Union[DirectorySnapshot, None]:
+    # Mirrors os.walk: symlinks to directories are listed but not descended.
+    directory_names: List[str] = []
+    file_names: List[str] = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if not is_dir:
+                    file_names.append(entry.name)
+                elif not entry.is_symlink():
+                    directory_names.append(entry.name)
+    except OSError:
+        return None
+    return DirectorySnapshot(mtime_ns, directory_names, file_names)
+
+
+class _FileScannerWorker(QObject):
+    @pyqtProperty(bool)
+    def running(self) -> bool:
+        return self._running
+
+    @running.setter
+    def running(self, running: bool):
+        self._running = running
+
+    scan_batch = pyqtSignal(list, arguments=("records",))
+    scan_progress = pyqtSignal(int, int, arguments=("scanned", "found"))
+    scan_error = pyqtSignal(str, arguments=("path",))
+    scan_complete = pyqtSignal(int, arguments=("found",))
+    scan_cancelled = pyqtSignal()
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+        self._running: bool = False
+        self._cancel = threading.Event()
+        self._batch: List[FileModelRecord] = []
+        self._last_flush: float = 0.0
+        self._scanned: int = 0
+        self._found: int = 0
+        self._cache: Union[MetadataCache, None] = None
+        self._suffixes: FrozenSet[str] = frozenset()
+        self._groups: int = 0
+        self._template = DestinationTemplate()
+
+        self._watcher: Union[QFileSystemWatcher, None] = None
+        # The grouped files of each watched directory, by name, with their
+        # groups.
+        self._watched: Dict[str, Dict[str, int]] = {}
+        self._cache_dir: str = ""
+        self._cache_max_entries: int = 0
+
+    def reset(self):
+        self._cancel.clear()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @pyqtSlot(str)
+    def clear_cache(self, cache_dir: str):
+        cache = MetadataCache(cache_dir)
+        cache.clear()
+        cache.close()
+
+    @pyqtSlot(str, list, int, str, int, bool, bool, str)
+    def scan(
+        self,
+        source_path: str,
+        formats: List[str],
+        workers: int,
+        cache_dir: str,
+        cache_max_entries: int,
+        incremental: bool,
+        watch: bool,
+        dest_template: str,
+    ):
+        metrics.profiled(self._scan)(
+            source_path,
+            formats,
+            workers,
+            cache_dir,
+            cache_max_entries,
+            incremental,
+            watch,
+            dest_template,
+        )
+
+    def _scan(
+        self,
+        source_path: str,
+        formats: List[str],
+        workers: int,
+        cache_dir: str,
+        cache_max_entries: int,
+        incremental: bool,
+        watch: bool,
+        dest_template: str,
+    ):
+        self.stop_watching()
+        self._template = DestinationTemplate(dest_template)
+        self.running = True
+        self._batch = []
+        self._last_flush = time.monotonic()
+        self._scanned = 0
+        self._found = 0
+        self._groups = 0
+
+        self._suffixes = format_suffixes(formats)
+
+        self._cache_dir = cache_dir
+        self._cache_max_entries = cache_max_entries
+        if len(cache_dir):
+            self._cache = MetadataCache(cache_dir, cache_max_entries)
+        incremental = incremental and self._cache is not None
+
+        pending: Set[Future] = set()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for root, file_names, unchanged in self._walk(source_path, incremental):
+                if self._cancel.is_set():
+                    break
+                if watch:
+                    self._watched[root] = {}
+
+                cached: Dict[str, CacheEntry] = {}
+                if self._cache is not None:
+                    cached = self._cache.lookup_directory(root)
+
+                for group_names in _group_files(file_names, self._suffixes):
+                    if self._cancel.is_set():
+                        break
+                    group = self._new_group(group_names)
+                    if watch:
+                        self._watched[root].update(dict.fromkeys(group_names, group))
+
+                    # The listing of an unchanged directory is taken from its
+                    # snapshot, so trust the cache rather than stat each file.
+                    entries = [cached.get(file_name) for file_name in group_names]
+                    if unchanged and None not in entries:
+                        for file_name, entry in zip(group_names, entries):
+                            self._scanned += 1
+                            self._add_result(
+                                _cached_result(root, file_name, entry, group)
+                            )
+                        continue
+
+                    pending.add(
+                        pool.submit(
+                            metrics.profiled(_scan_group),
+                            root,
+                            group_names,
+                            entries,
+                            group,
+                        )
+                    )
+                    if len(pending) >= workers * _PENDING_PER_WORKER:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        self._collect(done)
+
+            while len(pending) and not self._cancel.is_set():
+                done, pending = wait(
+                    pending, timeout=_BATCH_INTERVAL, return_when=FIRST_COMPLETED
+                )
+                self._collect(done)
+
+            for future in pending:
+                future.cancel()
+
+        self._flush()
+        if self._cache is not None:
+            self._cache.evict()
+            self._cache.close()
+            self._cache = None
+        self.running = False
+
+        if self._cancel.is_set():
+            self._watched.clear()
+            self.scan_cancelled.emit()
+        else:
+            if watch:
+                self._start_watching()
+            self.scan_complete.emit(self._found)
+
+    def _walk(
+        self, source_path: str, incremental: bool
+    ) -> Iterator[Tuple[str, List[str], bool]]:
+        directories = [source_path]
+        while len(directories):
+            directory = directories.pop()
+            start = clock()
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue
+
+            unchanged = False
+            snapshot = None
+            if incremental:
+                snapshot = self._cache.directory_snapshot(directory)
+                unchanged = snapshot is not None and snapshot.mtime_ns == mtime_ns
+                if unchanged:
+                    self._cache.touch_directory(directory)
+            if not unchanged:
+                snapshot = _list_directory(directory, mtime_ns)
+                if snapshot is None:
+                    continue
+                if self._cache is not None:
+                    self._cache.store_directory(directory, snapshot)
+            metrics.observe(WALK, start)
+
+            directories.extend(
+                osp.join(directory, name) for name in reversed(snapshot.directory_names)
+            )
+            yield directory, snapshot.file_names, unchanged
+
+    def _start_watching(self):
+        if self._watcher is None:
+            self._watcher = QFileSystemWatcher(self)
+            self._watcher.directoryChanged.connect(self._directory_changed)
+        self._watcher.addPaths(list(self._watched))
+
+    @pyqtSlot()
+    def stop_watching(self):
+        if self._watcher is not None and len(self._watcher.directories()):
+            self._watcher.removePaths(self._watcher.directories())
+        self._watched.clear()
+
+    @pyqtSlot(str)
+    def _directory_changed(self, directory: str):
+        if directory not in self._watched:
+            return
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError:
+            return
+        # Only the changed directory itself is listed: its subdirectories
+        # are watched, and report their own changes.
+        snapshot = _list_directory(directory, mtime_ns)
+        if snapshot is None:
+            return
+
+        if len(self._cache_dir):
+            self._cache = MetadataCache(self._cache_dir, self._cache_max_entries)
+            self._cache.store_directory(directory, snapshot)
+        self._scan_new_files(directory, snapshot.file_names)
+
+        # New subdirectories are scanned whole, and watched from now on.
+        new_directories: List[str] = []
+        for name in snapshot.directory_names:
+            path = osp.join(directory, name)
+            if path in self._watched:
+                continue
+            for root, file_names, unchanged in self._walk(path, False):
+                new_directories.append(root)
+                self._watched[root] = {}
+                self._scan_new_files(root, file_names)
+
+        self._flush()
+        if self._cache is not None:
+            self._cache.close()
+            self._cache = None
+        if len(new_directories):
+            self._watcher.addPaths(new_directories)
+
+    def _scan_new_files(self, root: str, file_names: List[str]):
+        cached: Dict[str, CacheEntry] = {}
+        if self._cache is not None:
+            cached = self._cache.lookup_directory(root)
+        # The whole listing is grouped, so that a file saved after the rest of
+        # its group, such as a sidecar, joins it. Sidecars still without an
+        # image are left for a later change.
+        known = self._watched[root]
+        for group_names in _group_files(file_names, self._suffixes):
+            new_names = [name for name in group_names if name not in known]
+            if not len(new_names):
+                continue
+            group = next((known[name] for name in group_names if name in known), None)
+            if group is None:
+                group = self._new_group(group_names)
+            known.update(dict.fromkeys(new_names, group))
+
+            # Known members are scanned again as the source of the metadata
+            # shared with new ones, but not reported again.
+            entries = [cached.get(file_name) for file_name in group_names]
+            results = _scan_group(root, group_names, entries, group)
+            for file_name, result in zip(group_names, results):
+                if file_name in new_names:
+                    self._scanned += 1
+                    self._add_result(result)
+
+    def _new_group(self, file_names: List[str]) -> int:
+        # Files on their own are left out of any group.
+        if len(file_names) < 2:
+            return 0
+        self._groups += 1
+        return self._groups
+
+    def _collect(self, done: Set[Future]):
+        for future in done:
+            for result in future.result():
+                self._scanned += 1
+                self._add_result(result)
+
+    def _add_result(self, result: _ScanResult):
+        if result.skipped:
+            return
+        if result.record is None:
+            self.scan_error.emit(result.full_path)
+            return
+        self._found += 1
+        self._batch.append(result.record)
+
+        if self._cache is not None:
+            if result.cache_hit:
+                self._cache.touch(result.root, result.record.file_name)
+            else:
+                self._cache.store(result.root, result.cache_entry)
+
+        if (
+            len(self._batch) >= _BATCH_SIZE
+            or time.monotonic() - self._last_flush >= _BATCH_INTERVAL
+        ):
+            self._flush()
+
+    def _flush(self):
+        self._last_flush = time.monotonic()
+        if len(self._batch):
+            self._template.render_records(self._batch)
+            self.scan_batch.emit(self._batch)
+            self._batch = []
+        if self._cache is not None:
+            self._cache.commit()
+        # Files found while watching arrive in batches alone, as no scan is
+        # in progress to report on.
+        if self.running:
+            self.scan_progress.emit(self._scanned, self._found)
+
+
+class FileScanner(QObject):
+    _scan = pyqtSignal(
+        str,
+        list,
+        int,
+        str,
+        int,
+        bool,
+        bool,
+        str,
+        arguments=(
+            "source_path",
+            "formats",
+            "workers",
+            "cache_dir",
+            "cache_max_entries",
+            "incremental",
+            "watch",
+            "dest_template",
+        ),
+    )
+    _clear_cache = pyqtSignal(str, arguments=("cache_dir",))
+    _stop_watching = pyqtSignal()
+
+    scan_batch = pyqtSignal(list, arguments=("records",))
+    scan_progress = pyqtSignal(int, int, arguments=("scanned", "found"))
+    scan_error = pyqtSignal(str, arguments=("path",))
+    scan_complete = pyqtSignal(int, arguments=("found",))
+    scan_cancelled = pyqtSignal()
+
+    def __init__(self, parent=None, **kwargs):
+        super().__init__(parent, **kwargs)
+
+        self._thread = QThread()
+        self._worker = _FileScannerWorker(
+            scan_batch=self.scan_batch,
+            scan_progress=self.scan_progress,
+            scan_error=self.scan_error,
+            scan_complete=self.scan_complete,
+            scan_cancelled=self.scan_cancelled,
+        )
+        self._scan.connect(self._worker.scan)
+        self._clear_cache.connect(self._worker.clear_cache)
+        self._stop_watching.connect(self._worker.stop_watching)
+        # The thread is started by the first scan rather than on launch.
+        self._worker.moveToThread(self._thread)
+
+    def _start(self):
+        if not self._thread.isRunning():
+            self._thread.start()
+
+    def scan(
+        self,
+        source_path: str,
+        formats: List[str],
+        workers: int = 0,
+        cache_dir: str = "",
+        cache_max_entries: int = 1000000,
+        incremental: bool = False,
+        watch: bool = False,
+        dest_template: str = DEFAULT_TEMPLATE,
+    ):
+        # formats are those listed in RAW_FILE_EXTENSIONS, or ALL_FORMATS.
+        #
+        # Incremental scans only descend into directories whose mtime has
+        # changed since the last scan, reusing the cached listing and metadata
+        # of the rest. Files modified in place (which does not touch the
+        # directory mtime) are not picked up; use a full scan for that.
+        # Requires the metadata cache. With watch set, the source tree is
+        # watched after the scan and new files are streamed through
+        # scan_batch until the next scan or stop_watching().
+        #
+        # Records are given destination paths from dest_template as they are
+        # found, without sequence numbers; run plan_destinations() over the
+        # results once the scan completes.
+        if workers <= 0:
+            workers = default_worker_count()
+        self._worker.reset()
+        self._start()
+        self._scan.emit(
+            source_path,
+            list(formats),
+            workers,
+            cache_dir,
+            cache_max_entries,
+            incremental,
+            watch,
+            dest_template,
+        )
+
+    def stop_watching(self):
+        self._stop_watching.emit()
+
+    def clear_cache(self, cache_dir: str):
+        self._start()
+        self._clear_cache.emit(cache_dir)
+
+    def cancel(self):
+        self._worker.cancel()
+
+    def shutdown(self):
+        self._worker.cancel()
+        self._thread.quit()
+        self._thread.wait()
@@ -0,0 +1,149 @@
+import re
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Iterable, List, Set, Tuple, Union
+
+from recordtype import recordtype
+
+if TYPE_CHECKING:
+    from photoorganiser.file_model import RecordStore
+
+# Rows narrowed down to less than this fraction of the store are checked one
+# by one rather than through an index.
+_FILTER_FRACTION = 8
+
+Query = recordtype(
+    "Query",
+    [
+        ("text", ""),
+        ("camera", ""),
+        ("extensions", None),
+        ("directory", ""),
+        ("start", None),
+        ("end", None),
+    ],
+)
+
+
+def _date_bounds(value: str) -> Tuple[datetime, datetime]:
+    # A year, month or day: "2020", "2020-06" or "2020-06-12".
+    parts = [int(part) for part in re.split("[-:/]", value)]
+    if len(parts) == 1:
+        return datetime(parts[0], 1, 1), datetime(parts[0], 12, 31, 23, 59, 59)
+    if len(parts) == 2:
+        start = datetime(parts[0], parts[1], 1)
+        if parts[1] == 12:
+            end = datetime(parts[0] + 1, 1, 1)
+        else:
+            end = datetime(parts[0], parts[1] + 1, 1)
+        return start, end - timedelta(seconds=1)
+    if len(parts) == 3:
+        start = datetime(*parts)
+        return start, start.replace(hour=23, minute=59, second=59)
+    raise ValueError(value)
+
+
+def parse_query(text: str) -> Union[Query, None]:
+    """
+    Parse a search such as "IMG_12 camera:nikon ext:nef date:2020-06-12".
+    Dates may be a year, month or day, or a range of them separated by
+    "..". Words without a prefix match anywhere in the file name. Returns
+    None for an empty search.
+    """
+    query = Query(extensions=[])
+    words: List[str] = []
+    for word in text.split():
+        key, _, value = word.partition(":")
+        key = key.lower()
+        if not len(value):
+            words.append(word)
+        elif key == "camera":
+            query.camera = value.lower()
+        elif key == "ext":
+            query.extensions.extend(e.lstrip(".").lower() for e in value.split(","))
+        elif key == "dir":
+            query.directory = value.lower()
+        elif key == "date":
+            first, _, last = value.partition("..")
+            try:
+                query.start = _date_bounds(first)[0]
+                query.end = _date_bounds(last or first)[1]
+            except ValueError:
+                words.append(word)
+        else:
+            words.append(word)
+    query.text = " ".join(words)
+
+    if not (
+        len(query.text)
+        or len(query.camera)
+        or len(query.extensions)
+        or len(query.directory)
+        or query.start is not None
+    ):
+        return None
+    return query
+
+
+def _containing(values: Iterable[str], text: str) -> List[str]:
+    return [value for value in values if text in value.lower()]
+
+
+def search(store: "RecordStore", query: Query) -> Set[int]:
+    """
+    Return the rows of store matching query, using the store's indexes for
+    each part of the query and intersecting the results.
+    """
+    results: List[Iterable[int]] = []
+    if len(query.extensions):
+        results.append(store.rows_with_extensions(query.extensions))
+    if len(query.camera):
+        cameras = _containing(store.camera_models(), query.camera)
+        results.append(store.rows_with_camera_models(cameras))
+    if len(query.directory):
+        directories = _containing(store.source_directories(), query.directory)
+        results.append(store.rows_in_source_directories(directories))
+
+    rows: Union[Set[int], None] = None
+    for result in results:
+        if rows is None:
+            rows = set(result)
+        elif len(rows):
+            rows.intersection_update(result)
+
+    # Dates and file names are searched through the store's indexes unless the
+    # other parts have already narrowed the rows down enough that checking
+    # them one by one is quicker.
+    if query.start is not None:
+        if rows is None or len(rows) > len(store) // _FILTER_FRACTION:
+            found = store.rows_in_date_range(query.start, query.end)
+            rows = set(found) if rows is None else rows.intersection(found)
+        else:
+            rows = set(store.filter_date_range(rows, query.start, query.end))
+    if len(query.text):
+        if rows is None or len(rows) > len(store) // _FILTER_FRACTION:
+            found = store.rows_with_name_containing(query.text)
+            rows = set(found) if rows is None else rows.intersection(found)
+        else:
+            text = query.text.lower()
+            rows = {row for row in rows if text in store.file_name(row).lower()}
+
+    if rows is None:
+        return set(range(len(store)))
+    return rows
+
+
+def matches(store: "RecordStore", query: Query, row: int) -> bool:
+    if len(query.extensions) and store.extension(row) not in query.extensions:
+        return False
+    if len(query.camera) and query.camera not in store.camera_model(row).lower():
+        return False
+    if (
+        len(query.directory)
+        and query.directory not in store.source_directory(row).lower()
+    ):
+        return False
+    if query.start is not None and not store.date_in_range(row, query.start, query.end):
+        return False
+    if len(query.text) and query.text.lower() not in store.file_name(row).lower():
+        return False
+    return True
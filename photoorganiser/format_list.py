@@ -10,7 +10,7 @@ from PyQt5.QtCore import (
 )
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QListView
 
-from photoorganiser.consts import RAW_FILE_EXTENSIONS
+from photoorganiser.consts import ALL_FORMATS, RAW_FILE_EXTENSIONS
 
 
 class _FormatModel(QAbstractListModel):
@@ -19,7 +19,7 @@ class _FormatModel(QAbstractListModel):
     def __init__(self, parent=None, **kwargs):
         super().__init__(parent, **kwargs)
 
-        self._data = OrderedDict({"All Image Files": "*"})
+        self._data = OrderedDict({"All Image Files": ALL_FORMATS})
         self._data.update(**RAW_FILE_EXTENSIONS)
 
     def data(self, index: QModelIndex, role: int = Qt.DisplayRole) -> Any:
@@ -64,8 +64,9 @@ class FormatList(QWidget):
         scrolled = False
         item_selection = QItemSelection()
         for format in formats:
+            # Saved formats may predate "orf " losing its stray space.
             matches = self._model.match(
-                self._model.index(0, 0), _FormatModel.FORMAT_ROLE, format
+                self._model.index(0, 0), _FormatModel.FORMAT_ROLE, format.strip()
             )
             if not len(matches):
                 continue
@@ -0,0 +1,223 @@
+import hashlib
+import os
+import os.path as osp
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Union
+
+from photoorganiser.copy_journal import PART_SUFFIX
+
+try:
+    import xxhash
+
+    def new_hash():
+        return xxhash.xxh3_128()
+
+
+except ImportError:
+
+    def new_hash():
+        return hashlib.blake2b(digest_size=16)
+
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+_PARTIAL_HASH_SIZE = 64 * 1024
+_HASH_WORKERS = 4
+
+
+def partial_hash(path: str) -> bytes:
+    # Hash of the size, first and last blocks. Cheap to compute and enough to
+    # tell almost all differing files of the same size apart.
+    h = new_hash()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        h.update(size.to_bytes(8, "little"))
+        h.update(f.read(_PARTIAL_HASH_SIZE))
+        if size > 2 * _PARTIAL_HASH_SIZE:
+            f.seek(-_PARTIAL_HASH_SIZE, os.SEEK_END)
+            h.update(f.read(_PARTIAL_HASH_SIZE))
+    return h.digest()
+
+
+def full_hash(path: str, uncached: bool = False) -> bytes:
+    # With uncached set, the file's pages are dropped from the page cache first
+    # where the platform allows, so that recently written data is read back
+    # from the device rather than from memory.
+    h = new_hash()
+    buffer = memoryview(bytearray(_HASH_CHUNK_SIZE))
+    with open(path, "rb", buffering=0) as f:
+        if uncached and hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        while True:
+            data_len = f.readinto(buffer)
+            if not data_len:
+                break
+            h.update(buffer[:data_len])
+    return h.digest()
+
+
+def _try_hash(hash_function, path: str) -> Union[bytes, None]:
+    try:
+        return hash_function(path)
+    except OSError:
+        return None
+
+
+class LibraryIndex(object):
+    """
+    Persistent index of the files below a destination library root, used to
+    find files that have already been imported. Files are matched on size
+    first, then on a partial hash and finally on a full content hash; hashes
+    of library files are computed on demand and stored. Safe to share between
+    copy worker threads.
+    """
+
+    FILE_NAME = "library_index.sqlite3"
+
+    def __init__(self, config_dir: str, library_root: str):
+        self._library_root = osp.abspath(library_root)
+        self._lock = threading.Lock()
+        self._refreshed = False
+        self._pool = ThreadPoolExecutor(max_workers=_HASH_WORKERS)
+
+        self._connection = sqlite3.connect(
+            osp.join(config_dir, self.FILE_NAME), check_same_thread=False
+        )
+        self._connection.executescript(
+            """
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                partial_hash BLOB,
+                full_hash BLOB
+            );
+            CREATE INDEX IF NOT EXISTS files_size ON files (size);
+            """
+        )
+
+    def close(self):
+        self._pool.shutdown()
+        with self._lock:
+            self._connection.close()
+
+    def refresh(self):
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        prefix = osp.join(self._library_root, "")
+        known: Dict[str, Tuple[int, int]] = {
+            path: (size, mtime_ns)
+            for path, size, mtime_ns in self._connection.execute(
+                "SELECT path, size, mtime_ns FROM files WHERE substr(path, 1, ?) = ?",
+                (len(prefix), prefix),
+            )
+        }
+
+        changed: List[Tuple[str, int, int]] = []
+        directories = [self._library_root]
+        while len(directories):
+            try:
+                entries = os.scandir(directories.pop())
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                        continue
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    # Part files are copies in progress, and may be complete
+                    # but not yet verified or renamed into place.
+                    if entry.name.endswith(PART_SUFFIX):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    key = (stat.st_size, stat.st_mtime_ns)
+                    if known.pop(entry.path, None) != key:
+                        changed.append((entry.path,) + key)
+
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns) VALUES (?, ?, ?)",
+                changed,
+            )
+            self._connection.executemany(
+                "DELETE FROM files WHERE path = ?", [(path,) for path in known]
+            )
+        self._refreshed = True
+
+    def add(self, path: str, content_hash: Union[bytes, None] = None):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, NULL, ?)",
+                (osp.abspath(path), stat.st_size, stat.st_mtime_ns, content_hash),
+            )
+
+    def _candidates(self, size: int) -> List[list]:
+        # The index file is shared by every library, so only files below this
+        # library's root are candidates.
+        prefix = osp.join(self._library_root, "")
+        with self._lock:
+            if not self._refreshed:
+                self._refresh()
+            return [
+                list(row)
+                for row in self._connection.execute(
+                    "SELECT path, partial_hash, full_hash FROM files "
+                    "WHERE size = ? AND substr(path, 1, ?) = ?",
+                    (size, len(prefix), prefix),
+                )
+            ]
+
+    def _fill_hashes(self, candidates: List[list], column: int, hash_function):
+        missing = [c for c in candidates if c[column] is None]
+        if not len(missing):
+            return
+        hashes = self._pool.map(
+            _try_hash, [hash_function] * len(missing), [c[0] for c in missing]
+        )
+        name = "partial_hash" if column == 1 else "full_hash"
+        updates = []
+        for candidate, value in zip(missing, hashes):
+            candidate[column] = value
+            if value is not None:
+                updates.append((value, candidate[0]))
+        with self._lock, self._connection:
+            self._connection.executemany(
+                f"UPDATE files SET {name} = ? WHERE path = ?", updates
+            )
+
+    def find_duplicate(self, path: str) -> Union[str, None]:
+        """
+        Return the path of a library file with the same content as path, or
+        None if there is none.
+        """
+        size = os.stat(path).st_size
+        candidates = self._candidates(size)
+        if not len(candidates):
+            return None
+
+        source_partial_hash = partial_hash(path)
+        self._fill_hashes(candidates, 1, partial_hash)
+        candidates = [c for c in candidates if c[1] == source_partial_hash]
+        if not len(candidates):
+            return None
+
+        source_full_hash = full_hash(path)
+        self._fill_hashes(candidates, 2, full_hash)
+        for candidate in candidates:
+            if candidate[2] == source_full_hash:
+                return candidate[0]
+        return None
@@ -0,0 +1,670 @@
+import os.path as osp
+from datetime import datetime
+from typing import TYPE_CHECKING, List, Dict, Union
+
+from PyQt5.QtCore import pyqtSlot, Qt, QPoint, QTimer, QSize, QStringListModel
+from PyQt5.QtWidgets import (
+    QWidget,
+    QVBoxLayout,
+    QPushButton,
+    QLineEdit,
+    QMainWindow,
+    QHBoxLayout,
+    QFileDialog,
+    QFormLayout,
+    QTableView,
+    QSpinBox,
+    QCheckBox,
+    QComboBox,
+    QMenu,
+    QMessageBox,
+    QCompleter,
+)
+
+from photoorganiser.consts import VERIFY_CHECKSUM, VERIFY_OFF, VERIFY_REREAD
+from photoorganiser.dest_template import (
+    DEFAULT_TEMPLATE,
+    PLACEHOLDERS,
+    DestinationTemplate,
+    TemplateError,
+    find_collisions,
+    plan_destinations,
+)
+from photoorganiser.file_model import FileModel, FileModelRecord
+from photoorganiser.file_search import parse_query
+from photoorganiser.format_list import FormatList
+from photoorganiser.metrics import metrics
+from photoorganiser.progress_aggregator import ProgressAggregator
+from photoorganiser.progress_dialog import ProgressDialog
+from photoorganiser.settings import Settings
+
+# The scanner, copier and thumbnail loader, and what they import, are only
+# loaded on first use so that the window appears as soon as possible.
+if TYPE_CHECKING:
+    from photoorganiser.copy_journal import CopyJournal
+    from photoorganiser.file_copier import FileCopier
+    from photoorganiser.file_scanner import FileScanner
+    from photoorganiser.library_index import LibraryIndex
+    from photoorganiser.thumbnails import ThumbnailLoader
+
+try:
+    from icecream import ic
+except ImportError:
+
+    def ic(*args, **kwargs):
+        pass
+
+
+class PhotoOrganiser(QMainWindow):
+    def __init__(self):
+        super().__init__()
+
+        self._photo_organiser_widget = PhotoOrganiserWidget(self)
+        self.setCentralWidget(self._photo_organiser_widget)
+
+    def closeEvent(self, event):
+        self._photo_organiser_widget.shutdown()
+        super().closeEvent(event)
+
+
+class PhotoOrganiserWidget(QWidget):
+    def __init__(self, parent=None, **kwargs):
+        super().__init__(parent, **kwargs)
+
+        # Created by _scanner(), _copier() and _thumbnails() on first use.
+        self._file_scanner: Union["FileScanner", None] = None
+        self._file_copier: Union["FileCopier", None] = None
+        self._progress_dialog: Union[ProgressDialog, None] = None
+        self._progress_aggregator: Union[ProgressAggregator, None] = None
+        self._thumbnail_loader: Union["ThumbnailLoader", None] = None
+        self._library_index: Union["LibraryIndex", None] = None
+        self._copy_journal: Union["CopyJournal", None] = None
+        self._copy_failed: bool = False
+
+        l = QVBoxLayout(self)
+
+        source_config_layout = QFormLayout()
+
+        source_path_layout = QHBoxLayout()
+        self._source_path_le = QLineEdit(self)
+        source_path_layout.addWidget(self._source_path_le)
+        source_path_layout.addWidget(
+            QPushButton("Browse...", self, clicked=self._browse_for_source_path)
+        )
+        source_config_layout.addRow("Source:", source_path_layout)
+
+        self._source_format_list = FormatList(self)
+        source_config_layout.addRow("File Type:", self._source_format_list)
+
+        self._scan_workers_sb = QSpinBox(self)
+        self._scan_workers_sb.setRange(0, 256)
+        self._scan_workers_sb.setSpecialValueText("Auto")
+        source_config_layout.addRow("Scan Workers:", self._scan_workers_sb)
+
+        self._use_cache_cb = QCheckBox("Use metadata cache", self)
+        cache_layout = QHBoxLayout()
+        cache_layout.addWidget(self._use_cache_cb)
+        cache_layout.addWidget(
+            QPushButton("Clear Cache", self, clicked=self._clear_metadata_cache)
+        )
+        source_config_layout.addRow("Cache:", cache_layout)
+
+        self._incremental_scan_cb = QCheckBox("Only rescan changed folders", self)
+        self._watch_source_cb = QCheckBox("Watch for new files", self)
+        self._watch_source_cb.toggled.connect(self._watch_source_toggled)
+        scan_mode_layout = QHBoxLayout()
+        scan_mode_layout.addWidget(self._incremental_scan_cb)
+        scan_mode_layout.addWidget(self._watch_source_cb)
+        source_config_layout.addRow("Scan Mode:", scan_mode_layout)
+
+        self._find_files_pb = QPushButton(
+            "Find files...", self, clicked=self._find_files
+        )
+        source_config_layout.addRow("", self._find_files_pb)
+
+        l.addLayout(source_config_layout)
+
+        self._file_model = FileModel(self)
+        self._search_le = QLineEdit(
+            self,
+            placeholderText="Search, e.g. IMG_12 camera:nikon ext:nef "
+            "date:2020-06-12",
+            clearButtonEnabled=True,
+        )
+        # Searching a large scan on every key press would make typing stutter.
+        self._search_timer = QTimer(
+            self, singleShot=True, interval=200, timeout=self._search
+        )
+        self._search_le.textChanged.connect(self._search_timer.start)
+        self._show_thumbnails_cb = QCheckBox("Show thumbnails", self)
+        self._show_thumbnails_cb.toggled.connect(self._show_thumbnails_toggled)
+        search_layout = QHBoxLayout()
+        search_layout.addWidget(self._search_le)
+        search_layout.addWidget(self._show_thumbnails_cb)
+        l.addLayout(search_layout)
+
+        self._table_view = QTableView(self)
+        self._table_view.horizontalHeader().setStretchLastSection(True)
+        self._table_view.setSelectionBehavior(QTableView.SelectRows)
+        self._table_view.setModel(self._file_model)
+        self._table_view.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self._table_view.setSortingEnabled(True)
+        self._table_view.setContextMenuPolicy(Qt.CustomContextMenu)
+        self._table_view.customContextMenuRequested.connect(self._show_table_menu)
+        l.addWidget(self._table_view)
+
+        self._row_height = self._table_view.verticalHeader().defaultSectionSize()
+
+        dest_config_layout = QFormLayout()
+
+        dest_path_layout = QHBoxLayout()
+        self._dest_path_le = QLineEdit(self)
+        dest_path_layout.addWidget(self._dest_path_le)
+        dest_path_layout.addWidget(
+            QPushButton("Browse...", self, clicked=self._browse_for_dest_path)
+        )
+        dest_config_layout.addRow("Destination:", dest_path_layout)
+
+        self._dest_template_le = QLineEdit(self)
+        self._dest_template_le.setToolTip(
+            "Placeholders: "
+            + ", ".join(f"{{{name}}}" for name in PLACEHOLDERS)
+            + "\nNumbers may be padded, as in {month:02} or {seq:04}."
+        )
+        self._dest_template_le.editingFinished.connect(self._dest_template_changed)
+        dest_config_layout.addRow("Layout:", self._dest_template_le)
+
+        self._skip_duplicates_cb = QCheckBox(
+            "Skip files already in the destination", self
+        )
+        dest_config_layout.addRow("", self._skip_duplicates_cb)
+
+        self._move_cb = QCheckBox("Move files instead of copying", self)
+        dest_config_layout.addRow("", self._move_cb)
+
+        self._verify_cb = QComboBox(self)
+        self._verify_cb.addItem("Off", VERIFY_OFF)
+        self._verify_cb.addItem("Checksum", VERIFY_CHECKSUM)
+        self._verify_cb.addItem("Checksum and re-read", VERIFY_REREAD)
+        self._sync_cb = QCheckBox("Sync to disk", self)
+        verify_layout = QHBoxLayout()
+        verify_layout.addWidget(self._verify_cb)
+        verify_layout.addWidget(self._sync_cb)
+        dest_config_layout.addRow("Verify:", verify_layout)
+
+        l.addLayout(dest_config_layout)
+
+        self._copy_pb = QPushButton("Copy...", clicked=self._start_copy)
+        self._scanning = False
+        l.addWidget(self._copy_pb)
+
+        settings = Settings()
+        scan_settings = settings.read("scan")
+        dest_settings = settings.read("dest")
+        copy_settings = settings.read("copy")
+        self._scan_workers_sb.setValue(scan_settings["workers"])
+        self._use_cache_cb.setChecked(settings.read("cache")["enabled"])
+        self._incremental_scan_cb.setChecked(scan_settings["incremental"])
+        self._watch_source_cb.setChecked(scan_settings["watch"])
+        self._show_thumbnails_cb.setChecked(settings.read("thumbnails")["enabled"])
+        if len(dest_settings["path"]):
+            self._dest_path_le.setText(dest_settings["path"])
+        self._skip_duplicates_cb.setChecked(dest_settings["skip_duplicates"])
+        self._dest_template_le.setText(dest_settings["template"])
+        verify_index = self._verify_cb.findData(copy_settings["verify"])
+        self._verify_cb.setCurrentIndex(max(verify_index, 0))
+        self._sync_cb.setChecked(copy_settings["sync"])
+        self._move_cb.setChecked(copy_settings["move"])
+        if len(settings.read("file_type")["file_type"]):
+            self._source_format_list.set_selected_formats(
+                settings.read("file_type")["file_type"]
+            )
+
+        # Recent sources are offered as the source is typed, and choosing one
+        # selects the file types it was last scanned for.
+        self._source_history_model = QStringListModel(self)
+        self._source_path_le.setCompleter(QCompleter(self._source_history_model, self))
+        self._source_path_le.editingFinished.connect(self._source_path_changed)
+        self._scan_source_path: str = ""
+        self._scan_formats: List[str] = []
+        self._update_source_history()
+        history = settings.source_history()
+        if len(history):
+            self._source_path_le.setText(history[0]["path"])
+            self._source_path_changed()
+
+    def shutdown(self):
+        # Stops whichever workers were started. Copies in progress are
+        # cancelled, keeping their part files to resume, and those waiting to
+        # be synced or verified are finished so that they are recorded as
+        # complete.
+        if self._file_scanner is not None:
+            self._file_scanner.shutdown()
+        if self._file_copier is not None:
+            self._file_copier.cancel_all()
+            self._file_copier.shutdown()
+        if self._thumbnail_loader is not None:
+            self._thumbnail_loader.shutdown()
+
+    def _scanner(self) -> "FileScanner":
+        if self._file_scanner is None:
+            from photoorganiser.file_scanner import FileScanner
+
+            self._file_scanner = FileScanner(
+                self,
+                scan_batch=self.scan_batch,
+                scan_progress=self.scan_progress,
+                scan_error=self.scan_error,
+                scan_complete=self.scan_complete,
+                scan_cancelled=self.scan_cancelled,
+            )
+        return self._file_scanner
+
+    def _copier(self) -> "FileCopier":
+        if self._file_copier is None:
+            from photoorganiser.file_copier import FileCopier
+
+            copy_settings = Settings().read("copy")
+            progress_rate = Settings().read("progress")["rate_hz"]
+
+            self._file_copier = FileCopier(
+                self,
+                workers=copy_settings["workers"],
+                per_source_device=copy_settings["per_source_device"],
+                per_dest_device=copy_settings["per_dest_device"],
+                progress_rate=progress_rate,
+                verify=copy_settings["verify"],
+                sync=copy_settings["sync"],
+                move=copy_settings["move"],
+                copy_complete=self.copy_complete,
+                copy_error=self.copy_error,
+                copy_progress=self.copy_progress,
+                copy_skipped=self.copy_skipped,
+            )
+            self._progress_dialog = ProgressDialog(self)
+            self._progress_aggregator = ProgressAggregator(
+                self,
+                rate_hz=progress_rate,
+                progress_updated=self._progress_dialog.set_transfer_progress,
+                file_progress_updated=self._progress_dialog.set_file_progress,
+            )
+            self._file_copier.copy_resumed.connect(
+                self._progress_aggregator.file_resumed
+            )
+        return self._file_copier
+
+    def _thumbnails(self) -> "ThumbnailLoader":
+        if self._thumbnail_loader is None:
+            from photoorganiser.thumbnails import ThumbnailLoader
+
+            thumbnail_settings = Settings().read("thumbnails")
+            self._thumbnail_loader = ThumbnailLoader(
+                self,
+                size=thumbnail_settings["size"],
+                cache_dir=Settings().config_dir,
+                max_bytes=thumbnail_settings["memory_mb"] * 1024 * 1024,
+                max_disk_bytes=thumbnail_settings["disk_mb"] * 1024 * 1024,
+            )
+        return self._thumbnail_loader
+
+    @pyqtSlot()
+    def _browse_for_source_path(self):
+        path = QFileDialog.getExistingDirectory(self, "Source...")
+        if path is None:
+            return
+        self._source_path_le.setText(path)
+        self._source_path_changed()
+
+    @pyqtSlot()
+    def _source_path_changed(self):
+        last_scan = Settings().last_scan(self._source_path_le.text())
+        if last_scan is not None and len(last_scan["formats"]):
+            self._source_format_list.set_selected_formats(last_scan["formats"])
+
+    def _update_source_history(self):
+        self._source_history_model.setStringList(
+            [entry["path"] for entry in Settings().source_history()]
+        )
+
+    @pyqtSlot()
+    def _browse_for_dest_path(self):
+        path = QFileDialog.getExistingDirectory(self, "Destination...")
+        if path is None:
+            return
+        self._dest_path_le.setText(path)
+
+        with Settings() as s:
+            s["dest"]["path"] = path
+
+    def _dest_template(self) -> DestinationTemplate:
+        template = Settings().read("dest")["template"]
+        try:
+            return DestinationTemplate(template)
+        except TemplateError as e:
+            # Only a layout edited into the settings file can be invalid, so
+            # it is replaced rather than failing every scan.
+            QMessageBox.warning(
+                self,
+                "Layout",
+                f"{template} is not a valid layout: {e}\n\n"
+                f"Using {DEFAULT_TEMPLATE} instead.",
+            )
+            with Settings() as s:
+                s["dest"]["template"] = DEFAULT_TEMPLATE
+            self._dest_template_le.setText(DEFAULT_TEMPLATE)
+            return DestinationTemplate()
+
+    @pyqtSlot()
+    def _dest_template_changed(self):
+        text = self._dest_template_le.text()
+        previous = Settings().read("dest")["template"]
+        if text == previous:
+            return
+        try:
+            DestinationTemplate(text)
+        except TemplateError as e:
+            QMessageBox.warning(self, "Layout", f"{text} is not a valid layout: {e}")
+            self._dest_template_le.setText(previous)
+            return
+
+        with Settings() as s:
+            s["dest"]["template"] = text
+        if not self._scanning:
+            self._plan_destinations()
+
+    def _plan_destinations(self):
+        plan_destinations(self._file_model.file_data(), self._dest_template())
+        self._file_model.dest_paths_changed()
+
+    @pyqtSlot()
+    def _find_files(self):
+        if self._scanning:
+            self._file_scanner.cancel()
+            return
+
+        source_path = self._source_path_le.text()
+        if not osp.exists(source_path) or not osp.isdir(source_path):
+            ic("Source is not a directory...")
+            return
+
+        formats = self._source_format_list.get_selected_formats()
+        with Settings() as s:
+            s["file_type"]["file_type"] = formats
+            s["scan"]["workers"] = self._scan_workers_sb.value()
+            s["cache"]["enabled"] = self._use_cache_cb.isChecked()
+            s["scan"]["incremental"] = self._incremental_scan_cb.isChecked()
+            s["scan"]["watch"] = self._watch_source_cb.isChecked()
+            cache_max_entries = s["cache"]["max_entries"]
+        cache_dir = Settings().config_dir if self._use_cache_cb.isChecked() else ""
+
+        self._scanning = True
+        self._find_files_pb.setText("Cancel")
+        self._copy_pb.setDisabled(True)
+        self._file_model.clear()
+        self._scan_source_path = source_path
+        self._scan_formats = formats
+        self._scanner().scan(
+            source_path,
+            formats,
+            self._scan_workers_sb.value(),
+            cache_dir,
+            cache_max_entries,
+            self._incremental_scan_cb.isChecked(),
+            self._watch_source_cb.isChecked(),
+            self._dest_template().template,
+        )
+
+    @pyqtSlot(bool)
+    def _watch_source_toggled(self, checked: bool):
+        if not checked and self._file_scanner is not None:
+            self._file_scanner.stop_watching()
+
+    @pyqtSlot(bool)
+    def _show_thumbnails_toggled(self, checked: bool):
+        with Settings() as s:
+            s["thumbnails"]["enabled"] = checked
+            size = s["thumbnails"]["size"]
+
+        if checked:
+            self._table_view.setIconSize(QSize(size, size))
+            self._table_view.verticalHeader().setDefaultSectionSize(size + 4)
+        else:
+            self._table_view.verticalHeader().setDefaultSectionSize(self._row_height)
+        # The loader is created by the first rows to show, see scan_batch().
+        self._file_model.set_thumbnail_loader(
+            self._thumbnails()
+            if checked and len(self._file_model.file_data())
+            else None
+        )
+
+    @pyqtSlot()
+    def _search(self):
+        self._file_model.set_filter(parse_query(self._search_le.text()))
+
+    @pyqtSlot(QPoint)
+    def _show_table_menu(self, pos: QPoint):
+        model = self._file_model
+        menu = QMenu(self)
+        menu.addAction("Check All", lambda: model.check_all(True))
+        menu.addAction("Uncheck All", lambda: model.check_all(False))
+
+        row = self._table_view.indexAt(pos).row()
+        if row >= 0:
+            row = model.store_row(row)
+            records = model.file_data()
+            camera_model = records.camera_model(row)
+            extension = records.extension(row)
+            day = records.date_time_original(row)[:10]
+
+            for checked, label in ((True, "Check"), (False, "Uncheck")):
+                menu.addSeparator()
+                if camera_model:
+                    menu.addAction(
+                        f"{label} {camera_model} Files",
+                        lambda c=checked: model.check_camera_models([camera_model], c),
+                    )
+                if day:
+                    start = datetime.strptime(day, "%Y:%m:%d")
+                    end = start.replace(hour=23, minute=59, second=59)
+                    menu.addAction(
+                        f"{label} Files from {start.date().isoformat()}",
+                        lambda c=checked: model.check_date_range(start, end, c),
+                    )
+                if extension:
+                    menu.addAction(
+                        f"{label} .{extension} Files",
+                        lambda c=checked: model.check_extensions([extension], c),
+                    )
+
+        menu.exec(self._table_view.viewport().mapToGlobal(pos))
+
+    @pyqtSlot()
+    def _clear_metadata_cache(self):
+        config_dir = Settings().config_dir
+        self._scanner().clear_cache(config_dir)
+        # Thumbnails are cleared from memory too, but no loader is created
+        # just to clear them from disk.
+        if self._thumbnail_loader is not None:
+            self._thumbnail_loader.clear()
+            self._thumbnail_loader.clear_disk_cache()
+            self._table_view.viewport().update()
+        else:
+            from photoorganiser.thumbnails import clear_disk_cache
+
+            clear_disk_cache(config_dir)
+
+    def _scan_finished(self):
+        self._scanning = False
+        self._plan_destinations()
+        self._write_metrics()
+        self._file_model.refresh()
+        self._find_files_pb.setText("Find files...")
+        self._copy_pb.setEnabled(True)
+
+    @pyqtSlot(list)
+    def scan_batch(self, records: List[FileModelRecord]):
+        if self._thumbnail_loader is None and self._show_thumbnails_cb.isChecked():
+            self._file_model.set_thumbnail_loader(self._thumbnails())
+        self._file_model.append_file_data(records)
+
+    @pyqtSlot(int, int)
+    def scan_progress(self, scanned: int, found: int):
+        self._find_files_pb.setText(f"Cancel ({found}/{scanned} files)")
+
+    @pyqtSlot(str)
+    def scan_error(self, path: str):
+        ic("Cannot read metadata", path)
+
+    @pyqtSlot(int)
+    def scan_complete(self, found: int):
+        Settings().record_source(self._scan_source_path, self._scan_formats, found)
+        self._update_source_history()
+        self._scan_finished()
+
+    @pyqtSlot()
+    def scan_cancelled(self):
+        self._scan_finished()
+
+    @pyqtSlot()
+    def _start_copy(self):
+        from photoorganiser.copy_journal import CopyJournal
+        from photoorganiser.library_index import LibraryIndex
+
+        dest_path = self._dest_path_le.text()
+        self._copy_pb.setDisabled(True)
+
+        skip_duplicates = self._skip_duplicates_cb.isChecked()
+        verify = self._verify_cb.currentData()
+        sync = self._sync_cb.isChecked()
+        move = self._move_cb.isChecked()
+        with Settings() as s:
+            s["dest"]["skip_duplicates"] = skip_duplicates
+            s["copy"]["verify"] = verify
+            s["copy"]["sync"] = sync
+            s["copy"]["move"] = move
+        file_copier = self._copier()
+        file_copier.set_verification(verify, sync)
+        file_copier.set_move(move)
+
+        if self._library_index is not None:
+            self._library_index.close()
+            self._library_index = None
+        if skip_duplicates:
+            self._library_index = LibraryIndex(Settings().config_dir, dest_path)
+        file_copier.set_library_index(self._library_index)
+
+        if self._copy_journal is not None:
+            self._copy_journal.close()
+        self._copy_journal = CopyJournal(Settings().config_dir, dest_path)
+        file_copier.set_journal(self._copy_journal)
+        self._copy_failed = False
+
+        # Offer to finish an earlier copy to the same destination that was
+        # interrupted, rather than starting the current selection.
+        unfinished = self._copy_journal.unfinished()
+        if (
+            len(unfinished)
+            and QMessageBox.question(
+                self,
+                "Resume Copy",
+                f"A copy of {len(unfinished)} files to {dest_path} did not "
+                "finish. Resume it?",
+            )
+            == QMessageBox.Yes
+        ):
+            file_records = [
+                FileModelRecord(
+                    osp.basename(entry.dest_path),
+                    entry.source_path,
+                    entry.dest_path,
+                    size=entry.size,
+                )
+                for entry in unfinished
+            ]
+        else:
+            records = self._file_model.file_data()
+            # Two files planned to the same path would overwrite each other.
+            collisions = find_collisions(
+                records, (row for row in range(len(records)) if records.copy(row))
+            )
+            if len(collisions):
+                examples = "\n".join(
+                    f"{dest}: {', '.join(records.file_name(row) for row in rows)}"
+                    for dest, rows in list(collisions.items())[:5]
+                )
+                QMessageBox.warning(
+                    self,
+                    "Copy",
+                    f"{len(collisions)} destination paths are shared by more than "
+                    f"one file. Change the layout, for example by adding {{seq}}, "
+                    f"or uncheck files:\n\n{examples}",
+                )
+                self._copy_pb.setEnabled(True)
+                return
+            self._copy_journal.begin(
+                (r.full_path, osp.join(dest_path, r.dest_path), r.size)
+                for r in records.checked_records()
+            )
+            file_records = records.checked_records()
+
+        self._copy_dict: Dict[str, str] = {}
+        bytes_total: int = 0
+
+        for file_record in file_records:
+            uid = file_copier.copy_file(
+                file_record.full_path,
+                osp.join(dest_path, file_record.dest_path),
+                file_record.group,
+            )
+            self._copy_dict[uid] = file_record
+            bytes_total += file_record.size
+
+        self._progress_dialog.set_file_dict(self._copy_dict)
+        self._progress_aggregator.start(bytes_total)
+        self._progress_dialog.show()
+
+    @pyqtSlot(str)
+    def copy_complete(self, uid: str):
+        self._progress_aggregator.file_finished(uid)
+        self._progress_dialog.file_copy_finished()
+        self._copy_dict.pop(uid)
+        self._check_copy_finished()
+
+    @pyqtSlot(str, int)
+    def copy_error(self, uid: str, error: int):
+        ic(uid, error, self._copy_dict[uid])
+        self._copy_failed = True
+        self._progress_aggregator.file_abandoned(uid)
+        self._progress_dialog.file_copy_error(uid)
+        self._check_copy_finished()
+
+    @pyqtSlot(str, str)
+    def copy_skipped(self, uid: str, existing_path: str):
+        ic("Already in library", self._copy_dict[uid], existing_path)
+        self._progress_aggregator.file_skipped(uid, self._copy_dict[uid].size)
+        self._progress_dialog.file_copy_finished()
+        self._copy_dict.pop(uid)
+        self._check_copy_finished()
+
+    def _check_copy_finished(self):
+        if not len(self._copy_dict):
+            self._progress_aggregator.stop()
+            self._copy_pb.setEnabled(True)
+            self._write_metrics()
+            # Failed files are left in the journal to be retried on resume.
+            if not self._copy_failed:
+                self._copy_journal.finish()
+
+    def _write_metrics(self):
+        if not metrics.enabled:
+            return
+        path = Settings().read("metrics")["path"]
+        if len(path):
+            try:
+                metrics.write(path)
+            except OSError as e:
+                ic(path, e)
+
+    @pyqtSlot(str, "qint64", "qint64")
+    def copy_progress(self, uid: str, progress: int, total: int):
+        self._progress_aggregator.file_progress(uid, progress, total)
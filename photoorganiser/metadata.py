@@ -0,0 +1,52 @@
+from datetime import datetime
+from typing import Union, Dict
+
+from recordtype import recordtype
+
+from photoorganiser.exif_reader import (
+    read_exif_tags,
+    MODEL,
+    DATE_TIME_ORIGINAL,
+    LENS_MODEL,
+    REQUIRED_TAGS,
+)
+
+ImageMetadata = recordtype(
+    "ImageMetadata", ["date_time_original", "camera_model", ("lens_model", "")]
+)
+
+
+def _read_exifread_tags(full_path: str) -> Union[Dict[str, str], None]:
+    # exifread is only needed for the few formats read_exif_tags() cannot
+    # parse, and is slow to import, so is imported on first use.
+    import exifread
+
+    with open(full_path, "rb") as f:
+        exif_tags = exifread.process_file(f, details=False)
+
+    if not all(name in exif_tags for name in REQUIRED_TAGS):
+        return None
+    return {
+        name: exif_tags[name].values
+        for name in REQUIRED_TAGS + (LENS_MODEL,)
+        if name in exif_tags
+    }
+
+
+def read_metadata(full_path: str) -> Union[ImageMetadata, None]:
+    exif_tags = read_exif_tags(full_path)
+    if exif_tags is None:
+        exif_tags = _read_exifread_tags(full_path)
+    if exif_tags is None:
+        return None
+
+    try:
+        date_time_original = datetime.strptime(
+            exif_tags[DATE_TIME_ORIGINAL], "%Y:%m:%d %H:%M:%S"
+        )
+    except ValueError:
+        return None
+    camera_model: str = exif_tags[MODEL].replace(" ", "_")
+    lens_model: str = exif_tags.get(LENS_MODEL, "").strip().replace(" ", "_")
+
+    return ImageMetadata(date_time_original, camera_model, lens_model)
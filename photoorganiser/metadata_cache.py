@@ -0,0 +1,216 @@
+import os.path as osp
+import sqlite3
+import time
+from typing import Dict, List, Union
+
+from recordtype import recordtype
+
+from photoorganiser.metadata import ImageMetadata
+
+_DATE_FORMAT = "%Y:%m:%d %H:%M:%S"
+# Bumped whenever the tables change; older caches are discarded.
+_SCHEMA_VERSION = 3
+
+CacheEntry = recordtype(
+    "CacheEntry",
+    [
+        "file_name",
+        "size",
+        "mtime_ns",
+        "date_time_original",
+        "camera_model",
+        "lens_model",
+    ],
+)
+
+DirectorySnapshot = recordtype(
+    "DirectorySnapshot", ["mtime_ns", "directory_names", "file_names"]
+)
+
+
+class MetadataCache(object):
+    FILE_NAME = "metadata_cache.sqlite3"
+
+    def __init__(self, config_dir: str, max_entries: int = 1000000):
+        self._max_entries = max_entries
+        self._connection = sqlite3.connect(osp.join(config_dir, self.FILE_NAME))
+        (version,) = self._connection.execute("PRAGMA user_version").fetchone()
+        if version != _SCHEMA_VERSION:
+            self._connection.executescript(
+                f"""
+                DROP TABLE IF EXISTS metadata;
+                DROP TABLE IF EXISTS directories;
+                PRAGMA user_version = {_SCHEMA_VERSION};
+                """
+            )
+        self._connection.executescript(
+            """
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS metadata (
+                directory TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                date_time_original TEXT NOT NULL,
+                camera_model TEXT NOT NULL,
+                lens_model TEXT NOT NULL,
+                last_used INTEGER NOT NULL,
+                PRIMARY KEY (directory, file_name)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS metadata_last_used ON metadata (last_used);
+            CREATE TABLE IF NOT EXISTS directories (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                directory_names TEXT NOT NULL,
+                file_names TEXT NOT NULL,
+                last_used INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS directories_last_used
+                ON directories (last_used);
+            """
+        )
+        self._used: List[tuple] = []
+        self._stored: List[tuple] = []
+        self._directories: List[tuple] = []
+        self._used_directories: List[tuple] = []
+        self._now = int(time.time())
+
+    def close(self):
+        self.commit()
+        self._connection.close()
+
+    def lookup_directory(self, directory: str) -> Dict[str, CacheEntry]:
+        cursor = self._connection.execute(
+            "SELECT file_name, size, mtime_ns, date_time_original, camera_model, "
+            "lens_model FROM metadata WHERE directory = ?",
+            (directory,),
+        )
+        return {row[0]: CacheEntry(*row) for row in cursor}
+
+    @staticmethod
+    def is_valid(entry: CacheEntry, size: int, mtime_ns: int) -> bool:
+        return entry.size == size and entry.mtime_ns == mtime_ns
+
+    @staticmethod
+    def new_entry(
+        file_name: str, size: int, mtime_ns: int, metadata: ImageMetadata
+    ) -> CacheEntry:
+        return CacheEntry(
+            file_name,
+            size,
+            mtime_ns,
+            metadata.date_time_original.strftime(_DATE_FORMAT),
+            metadata.camera_model,
+            metadata.lens_model,
+        )
+
+    def directory_snapshot(self, directory: str) -> Union[DirectorySnapshot, None]:
+        row = self._connection.execute(
+            "SELECT mtime_ns, directory_names, file_names FROM directories "
+            "WHERE path = ?",
+            (directory,),
+        ).fetchone()
+        if row is None:
+            return None
+        # Names are stored "/" separated, which can never appear in a name.
+        return DirectorySnapshot(
+            row[0],
+            row[1].split("/") if len(row[1]) else [],
+            row[2].split("/") if len(row[2]) else [],
+        )
+
+    def store_directory(self, directory: str, snapshot: DirectorySnapshot):
+        self._directories.append(
+            (
+                directory,
+                snapshot.mtime_ns,
+                "/".join(snapshot.directory_names),
+                "/".join(snapshot.file_names),
+                self._now,
+            )
+        )
+
+    def touch_directory(self, directory: str):
+        self._used_directories.append((self._now, directory))
+
+    def touch(self, directory: str, file_name: str):
+        self._used.append((self._now, directory, file_name))
+
+    def store(self, directory: str, entry: CacheEntry):
+        self._stored.append(
+            (
+                directory,
+                entry.file_name,
+                entry.size,
+                entry.mtime_ns,
+                entry.date_time_original,
+                entry.camera_model,
+                entry.lens_model,
+                self._now,
+            )
+        )
+
+    def commit(self):
+        if not (
+            len(self._used)
+            or len(self._stored)
+            or len(self._directories)
+            or len(self._used_directories)
+        ):
+            return
+        with self._connection:
+            self._connection.executemany(
+                "UPDATE metadata SET last_used = ? WHERE directory = ? AND file_name = ?",
+                self._used,
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                self._stored,
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?, ?)",
+                self._directories,
+            )
+            self._connection.executemany(
+                "UPDATE directories SET last_used = ? WHERE path = ?",
+                self._used_directories,
+            )
+        self._used = []
+        self._stored = []
+        self._directories = []
+        self._used_directories = []
+
+    def evict(self):
+        # Both the metadata and the directory snapshots are kept to
+        # max_entries rows, dropping the least recently used.
+        self.commit()
+        (count,) = self._connection.execute("SELECT COUNT(*) FROM metadata").fetchone()
+        if count > self._max_entries:
+            with self._connection:
+                self._connection.execute(
+                    "DELETE FROM metadata WHERE (directory, file_name) IN "
+                    "(SELECT directory, file_name FROM metadata "
+                    "ORDER BY last_used LIMIT ?)",
+                    (count - self._max_entries,),
+                )
+        (count,) = self._connection.execute(
+            "SELECT COUNT(*) FROM directories"
+        ).fetchone()
+        if count > self._max_entries:
+            with self._connection:
+                self._connection.execute(
+                    "DELETE FROM directories WHERE path IN "
+                    "(SELECT path FROM directories ORDER BY last_used LIMIT ?)",
+                    (count - self._max_entries,),
+                )
+
+    def clear(self):
+        self._used = []
+        self._stored = []
+        self._directories = []
+        self._used_directories = []
+        with self._connection:
+            self._connection.execute("DELETE FROM metadata")
+            self._connection.execute("DELETE FROM directories")
+        self._connection.execute("VACUUM")
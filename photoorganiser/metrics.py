@@ -0,0 +1,214 @@
+import json
+import os
+import os.path as osp
+import threading
+import time
+from bisect import bisect_left
+from typing import TYPE_CHECKING, Any, Callable, Dict, List
+
+if TYPE_CHECKING:
+    import cProfile
+
+# Pipeline stages timed while scanning and copying.
+WALK = "walk"
+STAT = "stat"
+EXIF_PARSE = "exif_parse"
+PLAN = "plan"
+QUEUE_WAIT = "queue_wait"
+READ = "read"
+WRITE = "write"
+# Kernel copies read and write in one call, so are timed as a stage of their
+# own.
+KERNEL_COPY = "kernel_copy"
+PERMISSIONS = "permissions"
+SYNC = "sync"
+VERIFY = "verify"
+
+# Histogram bucket upper bounds in seconds, doubling from 1us to about 134s.
+_BOUNDS = tuple(1e-6 * 2 ** i for i in range(28))
+_PROMETHEUS_PREFIX = "photoorganiser_stage"
+
+clock = time.perf_counter
+
+
+class Histogram(object):
+    def __init__(self):
+        self.counts: List[int] = [0] * (len(_BOUNDS) + 1)
+        self.count: int = 0
+        self.total: float = 0.0
+        self.max: float = 0.0
+        self.bytes: int = 0
+
+    def observe(self, seconds: float, size: int = 0):
+        self.counts[bisect_left(_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.bytes += size
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q: float) -> float:
+        # The upper bound of the bucket holding the quantile, capped at the
+        # largest observation.
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(_BOUNDS, self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics(object):
+    """
+    Per-stage timing histograms for the scan and copy pipelines, recorded from
+    any thread. Recording is off until enable() is called, and cheap when
+    off, so hot paths can be instrumented unconditionally:
+
+        start = clock()
+        os.stat(path)
+        metrics.observe(STAT, start)
+    """
+
+    def __init__(self):
+        self.enabled: bool = False
+        self.profiling: bool = False
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Histogram] = {}
+        self._profiles: Dict[int, "cProfile.Profile"] = {}
+
+    def enable(self, profile: bool = False):
+        # With profile, the calls wrapped by profiled() and the calling thread
+        # from here on are run under cProfile too.
+        self.enabled = True
+        if profile:
+            self.profiling = True
+            self._thread_profile().enable()
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+
+    def observe(self, stage: str, start: float, size: int = 0):
+        # Records the time since start, taken from clock(), against stage.
+        if not self.enabled:
+            return
+        seconds = clock() - start
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram()
+            histogram.observe(seconds, size)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                stage: dict(
+                    count=h.count,
+                    seconds=round(h.total, 6),
+                    bytes=h.bytes,
+                    p50=round(h.quantile(0.5), 6),
+                    p90=round(h.quantile(0.9), 6),
+                    p99=round(h.quantile(0.99), 6),
+                    max=round(h.max, 6),
+                )
+                for stage, h in sorted(self._histograms.items())
+            }
+
+    def write(self, path: str):
+        # Written as a Prometheus textfile collector file if path ends in
+        # .prom, otherwise as JSON, replacing any earlier file atomically.
+        if path.endswith(".prom"):
+            text = self._prometheus()
+        else:
+            text = json.dumps(dict(time=time.time(), stages=self.snapshot()), indent=2)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        os.makedirs(osp.dirname(osp.abspath(path)), exist_ok=True)
+        with open(temp_path, "w") as f:
+            f.write(text + "\n")
+        os.replace(temp_path, path)
+
+    def _prometheus(self) -> str:
+        lines = [
+            f"# HELP {_PROMETHEUS_PREFIX}_seconds Time spent in each pipeline stage.",
+            f"# TYPE {_PROMETHEUS_PREFIX}_seconds histogram",
+        ]
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+        for stage, h in histograms:
+            cumulative = 0
+            for bound, count in zip(_BOUNDS + (float("inf"),), h.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:.6g}"
+                lines.append(
+                    f'{_PROMETHEUS_PREFIX}_seconds_bucket{{stage="{stage}",le="{le}"}} '
+                    f"{cumulative}"
+                )
+            lines.append(
+                f'{_PROMETHEUS_PREFIX}_seconds_sum{{stage="{stage}"}} {h.total}'
+            )
+            lines.append(
+                f'{_PROMETHEUS_PREFIX}_seconds_count{{stage="{stage}"}} {h.count}'
+            )
+        lines.append(
+            f"# HELP {_PROMETHEUS_PREFIX}_bytes_total Bytes moved by each stage."
+        )
+        lines.append(f"# TYPE {_PROMETHEUS_PREFIX}_bytes_total counter")
+        for stage, h in histograms:
+            if h.bytes:
+                lines.append(
+                    f'{_PROMETHEUS_PREFIX}_bytes_total{{stage="{stage}"}} {h.bytes}'
+                )
+        return "\n".join(lines)
+
+    def _thread_profile(self) -> "cProfile.Profile":
+        # cProfile and pstats are only imported when profiling, as they take
+        # longer to import than the rest of the application's startup.
+        import cProfile
+
+        ident = threading.get_ident()
+        with self._lock:
+            profile = self._profiles.get(ident)
+            if profile is None:
+                profile = self._profiles[ident] = cProfile.Profile()
+        return profile
+
+    def profiled(self, function: Callable) -> Callable:
+        # function itself when not profiling, otherwise a wrapper running it
+        # under its thread's profiler. Worker threads are only profiled while
+        # running such calls, so a profile can be written at any time.
+        if not self.profiling:
+            return function
+
+        def wrapper(*args, **kwargs):
+            profile = self._thread_profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler is already active, such as on Python 3.12
+                # and later where profiling is process wide.
+                return function(*args, **kwargs)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profile.disable()
+
+        return wrapper
+
+    def write_profile(self, path: str):
+        # Stops profiling the calling thread and writes the profiles of every
+        # thread, merged, in pstats format.
+        self._thread_profile().disable()
+        with self._lock:
+            profiles = [p for p in self._profiles.values() if p.getstats()]
+        if not len(profiles):
+            return
+        import pstats
+
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(path)
+
+
+metrics = Metrics()
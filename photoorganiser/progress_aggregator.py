@@ -0,0 +1,136 @@
+import time
+from typing import Dict, Union
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal, pyqtSlot
+
+# Weight given to the latest sample of the transfer rate.
+_RATE_SMOOTHING = 0.2
+
+
+class ProgressAggregator(QObject):
+    """
+    Collects per-file copy progress as it arrives and republishes it, together
+    with the aggregate transfer rate and ETA, at most rate_hz times a second.
+    """
+
+    progress_updated = pyqtSignal(
+        "qint64",
+        "qint64",
+        float,
+        float,
+        arguments=("bytes_done", "bytes_total", "bytes_per_second", "eta_seconds"),
+    )
+    file_progress_updated = pyqtSignal(
+        str, "qint64", "qint64", arguments=("uid", "progress", "total")
+    )
+
+    def __init__(self, parent=None, rate_hz: int = 30, **kwargs):
+        super().__init__(parent, **kwargs)
+
+        # With rate_hz 0 or less progress is only published by stop().
+        self._timer = QTimer(self, timeout=self._publish)
+        self._timer.setInterval(int(1000 / rate_hz) if rate_hz > 0 else 0)
+        self._periodic = rate_hz > 0
+
+        self._file_progress: Dict[str, int] = {}
+        # Bytes copied before an interruption, of files being resumed.
+        self._resumed: Dict[str, int] = {}
+        self._bytes_finished: int = 0
+        self._bytes_total: int = 0
+        self._current: Union[tuple, None] = None
+        self._dirty: bool = False
+
+        self._last_time: float = 0.0
+        self._last_bytes: int = 0
+        self._bytes_per_second: float = 0.0
+
+    def start(self, bytes_total: int):
+        self._timer.stop()
+        self._file_progress.clear()
+        self._resumed.clear()
+        self._bytes_finished = 0
+        self._bytes_total = bytes_total
+        self._current = None
+        self._last_time = time.monotonic()
+        self._last_bytes = 0
+        self._bytes_per_second = 0.0
+        self._dirty = True
+        if self._periodic:
+            self._timer.start()
+
+    def stop(self):
+        self._publish()
+        self._timer.stop()
+
+    def bytes_done(self) -> int:
+        return self._bytes_finished + sum(self._file_progress.values())
+
+    @pyqtSlot(str, "qint64", "qint64")
+    def file_progress(self, uid: str, progress: int, total: int):
+        self._file_progress[uid] = progress
+        self._current = (uid, progress, total)
+        self._dirty = True
+
+    @pyqtSlot(str, "qint64")
+    def file_resumed(self, uid: str, offset: int):
+        # Counted as done, but not towards the transfer rate.
+        self._resumed[uid] = offset
+        self._bytes_finished += offset
+        self._last_bytes += offset
+        self._dirty = True
+
+    @pyqtSlot(str)
+    def file_finished(self, uid: str):
+        # The worker always reports the final progress of a completed file.
+        self._bytes_finished += self._file_progress.pop(uid, 0)
+        self._resumed.pop(uid, None)
+        self._forget_current(uid)
+        self._dirty = True
+
+    @pyqtSlot(str)
+    def file_abandoned(self, uid: str):
+        self._file_progress.pop(uid, None)
+        self._bytes_finished -= self._resumed.pop(uid, 0)
+        self._forget_current(uid)
+        self._dirty = True
+
+    @pyqtSlot(str, "qint64")
+    def file_skipped(self, uid: str, size: int):
+        self._file_progress.pop(uid, None)
+        self._forget_current(uid)
+        self._bytes_total -= size
+        self._dirty = True
+
+    def _forget_current(self, uid: str):
+        if self._current is not None and self._current[0] == uid:
+            self._current = None
+
+    @pyqtSlot()
+    def _publish(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+
+        bytes_done = self.bytes_done()
+        now = time.monotonic()
+        elapsed = now - self._last_time
+        if elapsed > 0:
+            rate = (bytes_done - self._last_bytes) / elapsed
+            if self._bytes_per_second:
+                rate = (
+                    _RATE_SMOOTHING * rate
+                    + (1 - _RATE_SMOOTHING) * self._bytes_per_second
+                )
+            self._bytes_per_second = max(rate, 0.0)
+            self._last_time = now
+            self._last_bytes = bytes_done
+
+        eta = -1.0
+        if self._bytes_per_second > 0:
+            eta = max(self._bytes_total - bytes_done, 0) / self._bytes_per_second
+
+        self.progress_updated.emit(
+            bytes_done, self._bytes_total, self._bytes_per_second, eta
+        )
+        if self._current is not None:
+            self.file_progress_updated.emit(*self._current)
@@ -24,12 +24,21 @@ class ProgressDialog(QDialog):
         self._file_list_progress.setFormat("%v/%m")
         l.addRow("Files copied:", self._file_list_progress)
 
+        # In thousandths, as QProgressBar's range cannot hold the size of a
+        # file over 2 GiB.
         self._file_copy_progress = QProgressBar(self)
+        self._file_copy_progress.setRange(0, 1000)
         l.addRow("Current File Progress:", self._file_copy_progress)
 
         self._current_file_label = QLabel(self)
         l.addRow("", self._current_file_label)
 
+        self._transfer_rate_label = QLabel(self)
+        l.addRow("Transfer Rate:", self._transfer_rate_label)
+
+        self._eta_label = QLabel(self)
+        l.addRow("Time Remaining:", self._eta_label)
+
         self._error_count_label = QLabel("0", self)
         l.addRow("Errors:", self._error_count_label)
 
@@ -49,8 +58,25 @@ class ProgressDialog(QDialog):
     def set_file_progress(self, uid: str, progress: int, total: int):
         current_file: FileModelRecord = self._file_dict[uid]
         self._current_file_label.setText(current_file.file_name)
-        self._file_copy_progress.setRange(0, total)
-        self._file_copy_progress.setValue(progress)
+        self._file_copy_progress.setValue(progress * 1000 // total if total else 1000)
+
+    def set_transfer_progress(
+        self,
+        bytes_done: int,
+        bytes_total: int,
+        bytes_per_second: float,
+        eta_seconds: float,
+    ):
+        self._transfer_rate_label.setText(
+            f"{bytes_per_second / 1048576:.1f} MB/s "
+            f"({bytes_done / 1048576:.0f}/{bytes_total / 1048576:.0f} MB)"
+        )
+        if eta_seconds < 0:
+            self._eta_label.setText("")
+        else:
+            minutes, seconds = divmod(int(eta_seconds), 60)
+            hours, minutes = divmod(minutes, 60)
+            self._eta_label.setText(f"{hours}:{minutes:02}:{seconds:02}")
 
     def file_copy_error(self, uid: str):
         self._file_dict.pop(uid)
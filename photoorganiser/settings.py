@@ -1,11 +1,72 @@
+import atexit
+import copy
+import threading
+import time
 import toml
 import os, os.path as osp
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Union
 from PyQt5.QtCore import QStandardPaths as QSP
 
+from photoorganiser.consts import DEFAULT_TEMPLATE
 from photoorganiser.utils import Singleton
 
+try:
+    from icecream import ic
+except ImportError:
+
+    def ic(*args, **kwargs):
+        pass
+
+
+_DEFAULT_CONFIG = {
+    "title": "PhotoOrganiser Settings",
+    "file_type": {"file_type": []},
+    "dest": {"path": "", "skip_duplicates": False, "template": DEFAULT_TEMPLATE},
+    "scan": {"workers": 0, "incremental": False, "watch": False},
+    "cache": {"enabled": True, "max_entries": 1000000},
+    "copy": {
+        "workers": 0,
+        "per_source_device": 2,
+        "per_dest_device": 4,
+        "verify": "off",
+        "sync": False,
+        "move": False,
+    },
+    "progress": {"rate_hz": 30},
+    "thumbnails": {"enabled": True, "size": 64, "memory_mb": 64, "disk_mb": 256},
+    # Stage timings are written to path (JSON, or Prometheus text if it ends in
+    # .prom) after each scan and copy, and a cProfile profile to profile on
+    # exit. Both are off when empty.
+    "metrics": {"path": "", "profile": ""},
+    # Named sets of the keys in SCAN_PROFILE_KEYS, see save_scan_profile().
+    "scan_profiles": {},
+    # The sources scanned most recently, newest first, see record_source().
+    "history": {"sources": []},
+}
+
+# What a scan profile holds: the file types, scan options and layout.
+SCAN_PROFILE_KEYS = ("formats", "workers", "cache", "incremental", "watch", "template")
+_MAX_SOURCE_HISTORY = 20
+
+# Changes are written this long after the last of them, so that a burst of
+# changes is written once.
+_WRITE_DELAY = 1.0
+
 
 class Settings(object, metaclass=Singleton):
+    """
+    Settings, loaded from a TOML file once and shared. Use read() for a section
+    that is only read, and the context manager to change settings:
+
+        with Settings() as s:
+            s["dest"]["path"] = path
+
+    Changes are written back on a background thread, shortly after the last
+    change and atomically, so a slow config directory never blocks the GUI.
+    Pending changes are written by flush(), and on exit.
+    """
+
     def __init__(self):
         config_dir = QSP.standardLocations(QSP.AppConfigLocation)[0]
         self._settings_file_path = osp.join(
@@ -14,21 +75,137 @@ class Settings(object, metaclass=Singleton):
 
         if not osp.exists(self._settings_file_path):
             os.makedirs(osp.dirname(self._settings_file_path), exist_ok=True)
-            self._config_data = {
-                "title": "PhotoOrganiser Settings",
-                "file_type": {"file_type": []},
-                "dest": {"path": ""},
-            }
+            self._config_data = {}
 
         else:
             self._config_data = toml.load(self._settings_file_path)
+        # What is in the file, to tell whether the settings need writing.
+        self._saved = copy.deepcopy(self._config_data)
+
+        for key, value in _DEFAULT_CONFIG.items():
+            if isinstance(value, dict):
+                section = self._config_data.setdefault(key, {})
+                for section_key, section_value in value.items():
+                    section.setdefault(section_key, copy.deepcopy(section_value))
+            else:
+                self._config_data.setdefault(key, value)
+
+        # Held while the settings are being changed or serialised, and while
+        # writing the file so that an older write cannot finish last.
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._write_lock = threading.Lock()
+        self._write_due: Union[float, None] = None
+        self._writer: Union[threading.Thread, None] = None
+        atexit.register(self.flush)
+
+    @property
+    def config_dir(self) -> str:
+        return osp.dirname(self._settings_file_path)
+
+    def read(self, section: str) -> Mapping[str, Any]:
+        # A read only view of a copy of a section, which never causes a write:
+        # nested values such as the file_type list cannot be changed through
+        # it either.
+        with self._lock:
+            return MappingProxyType(copy.deepcopy(self._config_data[section]))
 
     def flush(self):
-        with open(self._settings_file_path, "w") as f:
-            toml.dump(self._config_data, f)
+        # Writes any changes now, on the calling thread.
+        with self._lock:
+            self._write_due = None
+        self._write()
+
+    def _write(self):
+        with self._write_lock:
+            with self._lock:
+                if self._config_data == self._saved:
+                    return
+                text = toml.dumps(self._config_data)
+                saved = copy.deepcopy(self._config_data)
+
+            temp_path = f"{self._settings_file_path}.{os.getpid()}.tmp"
+            try:
+                with open(temp_path, "w") as f:
+                    f.write(text)
+                    # Otherwise the rename can reach the disk before the data,
+                    # leaving an empty file after a crash.
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self._settings_file_path)
+            except OSError as e:
+                ic(self._settings_file_path, e)
+                return
+            self._saved = saved
+
+    def _schedule_write(self):
+        with self._lock:
+            self._write_due = time.monotonic() + _WRITE_DELAY
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write_later, name="Settings writer", daemon=True
+                )
+                self._writer.start()
+            self._changed.notify()
+
+    def _write_later(self):
+        while True:
+            with self._lock:
+                while self._write_due is None:
+                    self._changed.wait()
+                delay = self._write_due - time.monotonic()
+                if delay > 0:
+                    self._changed.wait(delay)
+                    continue
+                self._write_due = None
+            self._write()
 
     def __enter__(self):
+        self._lock.acquire()
         return self._config_data
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.flush()
+        try:
+            if self._config_data != self._saved:
+                self._schedule_write()
+        finally:
+            self._lock.release()
+
+    def scan_profile_names(self) -> List[str]:
+        return sorted(self._config_data["scan_profiles"])
+
+    def scan_profile(self, name: str) -> Union[Dict[str, Any], None]:
+        profile = self._config_data["scan_profiles"].get(name)
+        return copy.deepcopy(profile) if profile is not None else None
+
+    def save_scan_profile(self, name: str, profile: Dict[str, Any]):
+        # profile maps some of SCAN_PROFILE_KEYS to values, e.g. formats to a
+        # list of extensions and template to a destination layout.
+        unknown = set(profile) - set(SCAN_PROFILE_KEYS)
+        if len(unknown):
+            raise KeyError(f"Unknown scan profile keys: {', '.join(sorted(unknown))}")
+        with self as s:
+            s["scan_profiles"][name] = copy.deepcopy(profile)
+
+    def delete_scan_profile(self, name: str):
+        with self as s:
+            s["scan_profiles"].pop(name, None)
+
+    def source_history(self) -> List[Dict[str, Any]]:
+        # Entries hold the source path, the formats it was last scanned for,
+        # and when and how many files were found.
+        return copy.deepcopy(self._config_data["history"]["sources"])
+
+    def last_scan(self, path: str) -> Union[Dict[str, Any], None]:
+        for entry in self._config_data["history"]["sources"]:
+            if entry["path"] == path:
+                return copy.deepcopy(entry)
+        return None
+
+    def record_source(self, path: str, formats: List[str], found: int):
+        entry = dict(
+            path=path, formats=list(formats), found=found, scanned=int(time.time())
+        )
+        with self as s:
+            sources = [e for e in s["history"]["sources"] if e["path"] != path]
+            s["history"]["sources"] = [entry] + sources[: _MAX_SOURCE_HISTORY - 1]
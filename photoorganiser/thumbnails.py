@@ -0,0 +1,276 @@
+import hashlib
+import io
+import os
+import os.path as osp
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, Set, Tuple, Union
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal, pyqtSlot
+from PyQt5.QtGui import QImage
+
+from photoorganiser.exif_reader import read_embedded_preview
+
+try:
+    from icecream import ic
+except ImportError:
+
+    def ic(*args, **kwargs):
+        pass
+
+
+# Requests beyond this many are dropped, oldest first: when scrolling quickly
+# through a large table, rows that have already scrolled out of view are not
+# worth loading.
+_MAX_QUEUED = 256
+_JPEG_QUALITY = 85
+# Below the cache directory given to ThumbnailLoader.
+_DISK_CACHE_DIR = "thumbnails"
+
+
+def default_worker_count() -> int:
+    return min(4, os.cpu_count() or 1)
+
+
+def make_thumbnail(full_path: str, size: int) -> bytes:
+    """
+    Return a JPEG thumbnail of full_path no larger than size pixels square,
+    decoded from the preview embedded in RAW files where there is one.
+    """
+    # Pillow is imported on first use so that it costs nothing at startup, or
+    # at all with thumbnails turned off.
+    from PIL import Image, ImageOps
+
+    preview = read_embedded_preview(full_path)
+    with Image.open(io.BytesIO(preview) if preview else full_path) as image:
+        # Lets the JPEG decoder scale down by up to 8x while decoding.
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        output = io.BytesIO()
+        image.convert("RGB").save(output, "JPEG", quality=_JPEG_QUALITY)
+    return output.getvalue()
+
+
+class ThumbnailDiskCache(object):
+    # Thumbnails as JPEG files, named by the path, size and mtime of their
+    # image and the thumbnail size. Once over max_bytes, the least recently
+    # used files by mtime, which get() touches, are removed until a tenth of
+    # the space is free again.
+    def __init__(self, cache_dir: str, size: int, max_bytes: int = 256 * 1024 * 1024):
+        self._cache_dir = cache_dir
+        self._size = size
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Bytes on disk, only counted by the first put() rather than on launch.
+        self._bytes: Union[int, None] = None
+
+    def _path(self, full_path: str, stat: os.stat_result) -> str:
+        key = f"{full_path}\0{stat.st_size}\0{stat.st_mtime_ns}\0{self._size}"
+        digest = hashlib.blake2b(key.encode(errors="surrogateescape")).hexdigest()
+        return osp.join(self._cache_dir, digest[:2], digest[2:32] + ".jpg")
+
+    def get(self, full_path: str, stat: os.stat_result) -> Union[bytes, None]:
+        path = self._path(full_path, stat)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, full_path: str, stat: os.stat_result, data: bytes):
+        path = self._path(full_path, stat)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(osp.dirname(path), exist_ok=True)
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            ic(path, e)
+            return
+
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = sum(size for _, size, _ in self._files())
+            else:
+                self._bytes += len(data)
+            if self._bytes > self._max_bytes:
+                self._evict()
+
+    def clear(self):
+        with self._lock:
+            shutil.rmtree(self._cache_dir, ignore_errors=True)
+            self._bytes = 0
+
+    def _files(self) -> Iterator[Tuple[str, int, int]]:
+        # The path, size and mtime of each thumbnail, leaving out any being
+        # written.
+        try:
+            directories = [e.path for e in os.scandir(self._cache_dir) if e.is_dir()]
+        except OSError:
+            return
+        for directory in directories:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                if not entry.name.endswith(".jpg"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                yield entry.path, stat.st_size, stat.st_mtime_ns
+
+    def _evict(self):
+        files = sorted(self._files(), key=lambda f: f[2])
+        self._bytes = sum(size for _, size, _ in files)
+        target = self._max_bytes - self._max_bytes // 10
+        for path, size, _ in files:
+            if self._bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError as e:
+                ic(path, e)
+                continue
+            self._bytes -= size
+
+
+def clear_disk_cache(cache_dir: str):
+    """
+    Remove the thumbnails cached below cache_dir, as given to ThumbnailLoader,
+    on a thread of its own so that no loader has to be created for it.
+    """
+    cache = ThumbnailDiskCache(osp.join(cache_dir, _DISK_CACHE_DIR), 0)
+    threading.Thread(
+        target=cache.clear, name="Thumbnail cache clearer", daemon=True
+    ).start()
+
+
+class ThumbnailLoader(QObject):
+    """
+    Loads thumbnails on a pool of threads. thumbnail() returns a cached image
+    straight away or queues a load, most recent requests first, so the rows
+    the view is currently painting are served before ones scrolled past.
+    Loaded images are kept in an LRU bounded by memory and, when a cache
+    directory is given, in one on disk bounded by max_disk_bytes.
+    """
+
+    thumbnails_updated = pyqtSignal()
+    _loaded = pyqtSignal(str, QImage, arguments=("full_path", "image"))
+
+    def __init__(
+        self,
+        parent=None,
+        size: int = 64,
+        cache_dir: str = "",
+        max_bytes: int = 64 * 1024 * 1024,
+        max_disk_bytes: int = 256 * 1024 * 1024,
+        workers: int = 0,
+        **kwargs,
+    ):
+        super().__init__(parent, **kwargs)
+
+        self._size = size
+        self._disk_cache = (
+            ThumbnailDiskCache(
+                osp.join(cache_dir, _DISK_CACHE_DIR), size, max_disk_bytes
+            )
+            if len(cache_dir)
+            else None
+        )
+        self._max_bytes = max_bytes
+        self._workers = workers if workers > 0 else default_worker_count()
+        self._pool = ThreadPoolExecutor(max_workers=self._workers)
+
+        self._images: Dict[str, QImage] = OrderedDict()
+        self._bytes: int = 0
+        self._queue: Dict[str, None] = OrderedDict()
+        self._in_flight: Set[str] = set()
+
+        self._loaded.connect(self._image_loaded)
+        # Views are told about newly loaded thumbnails in batches rather than
+        # once per image.
+        self._update_timer = QTimer(
+            self, singleShot=True, interval=50, timeout=self.thumbnails_updated
+        )
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def shutdown(self):
+        self._queue.clear()
+        self._pool.shutdown()
+
+    def clear(self):
+        self._queue.clear()
+        self._images.clear()
+        self._bytes = 0
+
+    def clear_disk_cache(self):
+        # Removes the thumbnails cached on disk, on the pool.
+        if self._disk_cache is not None:
+            self._pool.submit(self._disk_cache.clear)
+
+    def thumbnail(self, full_path: str) -> Union[QImage, None]:
+        image = self._images.get(full_path)
+        if image is not None:
+            self._images.move_to_end(full_path)
+            return None if image.isNull() else image
+
+        if full_path not in self._in_flight:
+            self._queue.pop(full_path, None)
+            self._queue[full_path] = None
+            if len(self._queue) > _MAX_QUEUED:
+                self._queue.popitem(last=False)
+            self._submit()
+        return None
+
+    def _submit(self):
+        while len(self._in_flight) < self._workers and len(self._queue):
+            full_path, _ = self._queue.popitem(last=True)
+            self._in_flight.add(full_path)
+            self._pool.submit(self._load, full_path)
+
+    def _load(self, full_path: str):
+        # Runs on the pool. QImage, unlike QPixmap, may be used off the GUI
+        # thread.
+        image = QImage()
+        try:
+            stat = os.stat(full_path)
+            data = None
+            if self._disk_cache is not None:
+                data = self._disk_cache.get(full_path, stat)
+            if data is None:
+                data = make_thumbnail(full_path, self._size)
+                if self._disk_cache is not None:
+                    self._disk_cache.put(full_path, stat, data)
+            image.loadFromData(data, "JPEG")
+        except Exception as e:
+            ic(full_path, e)
+        self._loaded.emit(full_path, image)
+
+    @pyqtSlot(str, QImage)
+    def _image_loaded(self, full_path: str, image: QImage):
+        self._in_flight.discard(full_path)
+        # Failures are remembered as null images so they are not retried.
+        self._images[full_path] = image
+        self._bytes += max(image.sizeInBytes(), 1)
+        while self._bytes > self._max_bytes and len(self._images) > 1:
+            _, evicted = self._images.popitem(last=False)
+            self._bytes -= max(evicted.sizeInBytes(), 1)
+
+        self._submit()
+        if not self._update_timer.isActive():
+            self._update_timer.start()
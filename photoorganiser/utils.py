@@ -5,3 +5,12 @@ class Singleton(type):
         if cls not in cls._instances:
             cls._instances[cls] = super().__call__(*args, **kwargs)
         return cls._instances[cls]
+
+
+def configure_application(application):
+    # Shared by the GUI and the CLI so both resolve the same settings and
+    # cache locations.
+    application.setApplicationName("PhotoOrganiser")
+    application.setOrganizationName("jazzycamel")
+    application.setOrganizationDomain("https://github.com/jazzycamel/photoorganiser")
+    application.setApplicationVersion("0.1")
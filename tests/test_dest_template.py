@@ -0,0 +1,194 @@
+import os.path as osp
+import unittest
+
+from photoorganiser.dest_template import (
+    DEFAULT_TEMPLATE,
+    DestinationTemplate,
+    TemplateError,
+    find_collisions,
+    plan_destinations,
+)
+from photoorganiser.file_model import FileModelRecord, RecordStore
+
+
+def _record(file_name: str, date: str, camera: str = "Camera", group: int = 0):
+    return FileModelRecord(
+        file_name,
+        osp.join("/source", file_name),
+        "",
+        camera_model=camera,
+        date_time_original=date,
+        lens_model="Lens",
+        group=group,
+    )
+
+
+def _store(*records: FileModelRecord) -> RecordStore:
+    store = RecordStore()
+    store.extend(records)
+    return store
+
+
+class TemplateCompilerTests(unittest.TestCase):
+    def render(self, template: str, file_name: str = "IMG_0001.JPG", **kwargs):
+        return DestinationTemplate(template).render(
+            [file_name],
+            [kwargs.get("date", 20200102030405)],
+            [kwargs.get("camera", "Camera")],
+            [kwargs.get("lens", "Lens")],
+            [kwargs["seq"]] if "seq" in kwargs else None,
+        )[0]
+
+    def test_default_template(self):
+        self.assertEqual(
+            self.render(DEFAULT_TEMPLATE),
+            osp.join("2020", "1", "2", "Camera", "IMG_0001.JPG"),
+        )
+
+    def test_date_placeholders_and_format_specs(self):
+        self.assertEqual(
+            self.render(
+                "{year}/{month:02}/{day:02}/{hour:02}{minute:02}{second:02}/{file_name}"
+            ),
+            osp.join("2020", "01", "02", "030405", "IMG_0001.JPG"),
+        )
+        self.assertEqual(
+            self.render("{date}/{file_name}"), osp.join("2020-01-02", "IMG_0001.JPG")
+        )
+
+    def test_file_name_placeholders(self):
+        self.assertEqual(
+            self.render("{camera}/{stem}_{seq:04}.{ext}", seq=7),
+            osp.join("Camera", "IMG_0001_0007.jpg"),
+        )
+
+    def test_sidecar_named_after_image_keeps_image_stem(self):
+        template = "{stem}_{seq:04}.{ext}"
+        self.assertEqual(
+            self.render(template, "IMG_0001.CR3", seq=1), "IMG_0001_0001.cr3"
+        )
+        self.assertEqual(
+            self.render(template, "IMG_0001.CR3.xmp", seq=1), "IMG_0001_0001.cr3.xmp"
+        )
+        self.assertEqual(
+            self.render(template, "IMG_0001.xmp", seq=1), "IMG_0001_0001.xmp"
+        )
+        self.assertEqual(
+            self.render(template, "my.holiday.xmp", seq=1), "my.holiday_0001.xmp"
+        )
+
+    def test_metadata_cannot_add_path_components(self):
+        self.assertEqual(
+            self.render("{lens}/{file_name}", lens="EF24-105mm f/4L"),
+            osp.join("EF24-105mm f-4L", "IMG_0001.JPG"),
+        )
+        self.assertEqual(
+            self.render("{camera}/{file_name}", camera=".."),
+            osp.join("Unknown", "IMG_0001.JPG"),
+        )
+
+    def test_literal_braces(self):
+        self.assertEqual(
+            self.render("{{raw}}/{file_name}"), osp.join("{raw}", "IMG_0001.JPG")
+        )
+
+    def test_uses_sequence(self):
+        self.assertTrue(DestinationTemplate("{year}/{seq}.{ext}").uses_sequence)
+        self.assertFalse(DestinationTemplate(DEFAULT_TEMPLATE).uses_sequence)
+
+    def test_invalid_templates(self):
+        for template in (
+            "",
+            "/{year}/{file_name}",
+            "{year}/../{file_name}",
+            "{year}/",
+            "photos/image.jpg",
+            "{year}/{bogus}",
+            "{year}/{file_name!r}",
+            "{camera:d}/{file_name}",
+            "{year/{file_name}",
+        ):
+            with self.subTest(template=template):
+                with self.assertRaises(TemplateError):
+                    DestinationTemplate(template)
+
+
+class CollisionTests(unittest.TestCase):
+    def test_no_collisions(self):
+        store = _store(
+            _record("IMG_0001.JPG", "2020:01:02 03:04:05"),
+            _record("IMG_0002.JPG", "2020:01:02 03:04:06"),
+        )
+        self.assertEqual(plan_destinations(store, DestinationTemplate()), {})
+
+    def test_collisions_are_reported_by_path(self):
+        store = _store(
+            _record("IMG_0001.JPG", "2020:01:02 03:04:05"),
+            _record("IMG_0002.JPG", "2020:01:02 03:04:06"),
+            _record("IMG_0003.JPG", "2021:01:02 03:04:05"),
+            _record("IMG_0004.JPG", "2020:05:06 03:04:05"),
+        )
+        collisions = plan_destinations(store, DestinationTemplate("{year}/photo.{ext}"))
+        self.assertEqual(collisions, {osp.join("2020", "photo.jpg"): [0, 1, 3]})
+        self.assertEqual(find_collisions(store, [0, 2]), {})
+        self.assertEqual(
+            find_collisions(store, [2, 3, 1]),
+            {osp.join("2020", "photo.jpg"): [3, 1]},
+        )
+
+    def test_paths_differing_only_in_case_collide(self):
+        store = _store(
+            _record("IMG_1.JPG", "2020:01:02 03:04:05"),
+            _record("img_1.jpg", "2020:01:02 03:04:06"),
+        )
+        dest = osp.join("2020", "1", "2", "Camera", "IMG_1.JPG")
+        self.assertEqual(
+            plan_destinations(store, DestinationTemplate()), {dest: [0, 1]}
+        )
+        self.assertEqual(find_collisions(store), {dest: [0, 1]})
+
+
+class SequenceTests(unittest.TestCase):
+    def test_sequence_follows_capture_time_then_file_name(self):
+        store = _store(
+            _record("C.JPG", "2020:01:02 03:04:07"),
+            _record("B.JPG", "2020:01:02 03:04:05"),
+            _record("A.JPG", "2020:01:02 03:04:05"),
+        )
+        plan_destinations(store, DestinationTemplate("{seq:03}_{file_name}"))
+        self.assertEqual(
+            [store.dest_path(row) for row in range(len(store))],
+            ["003_C.JPG", "002_B.JPG", "001_A.JPG"],
+        )
+
+    def test_group_shares_a_number(self):
+        store = _store(
+            _record("IMG_0002.NEF", "2020:01:02 03:04:06", group=1),
+            _record("IMG_0001.JPG", "2020:01:02 03:04:05"),
+            _record("IMG_0002.JPG", "2020:01:02 03:04:06", group=1),
+            _record("IMG_0002.NEF.xmp", "2020:01:02 03:04:06", group=1),
+            _record("IMG_0003.JPG", "2020:01:02 03:04:07"),
+        )
+        collisions = plan_destinations(
+            store, DestinationTemplate("{year}/{stem}_{seq:04}.{ext}")
+        )
+        self.assertEqual(collisions, {})
+        self.assertEqual(
+            [store.dest_path(row) for row in range(len(store))],
+            [
+                osp.join("2020", "IMG_0002_0002.nef"),
+                osp.join("2020", "IMG_0001_0001.jpg"),
+                osp.join("2020", "IMG_0002_0002.jpg"),
+                osp.join("2020", "IMG_0002_0002.nef.xmp"),
+                osp.join("2020", "IMG_0003_0003.jpg"),
+            ],
+        )
+
+    def test_render_records_leaves_sequence_unassigned(self):
+        records = [_record("IMG_0001.JPG", "2020:01:02 03:04:05")]
+        DestinationTemplate("{year}/{seq}_{file_name}").render_records(records)
+        self.assertEqual(records[0].dest_path, osp.join("2020", "0_IMG_0001.JPG"))
+
+
+if __name__ == "__main__":
+    unittest.main()